@@ -1404,14 +1404,11 @@ def mask_vertices(mask_im, vertices_file):
         yvert.append(pixels[3]) # y -> RA
     poly = Polygon(xvert, yvert)
 
-    # Find distance to nearest poly edge and unmask those that
-    # are outside the facet (dist < 0)
-    masked_ind = np.indices(data[0, 0].shape)
-    dist = poly.is_inside(masked_ind[0], masked_ind[1])
-    outside_ind = np.where(dist < 0.0)
-    if len(outside_ind[0]) > 0:
-        data[0, 0, masked_ind[0][outside_ind], [masked_ind[1][outside_ind]]] = 0
-        bool_data[0, 0, masked_ind[0][outside_ind], [masked_ind[1][outside_ind]]] = 0
+    # Unmask pixels that are outside the facet (pixels on the edge of the
+    # facet are kept)
+    inside = poly.rasterize(data[0, 0].shape)
+    data[0, 0][~inside] = 0
+    bool_data[0, 0][~inside] = 0
 
     new_im.putdata(data)
     bool_mask.putdata(bool_data)
@@ -10,6 +10,7 @@ import lofar.parmdb
 import numpy as np
 import multiprocessing
 import itertools
+from factor.lib.baselines import get_baseline_cache_dir, get_cached_baseline_lengths
 
 
 class Band(object):
@@ -146,6 +147,11 @@ class Band(object):
                             self.minSamplesPerFile = min(self.minSamplesPerFile,numsamples)
                             break
                     tab.close()
+
+                # Compute the baseline lengths (needed for pre-averaging) once
+                # and cache them for use by all directions
+                get_cached_baseline_lengths(self.files[0],
+                    get_baseline_cache_dir(self.working_dir))
             self.save_state()
 
         self.log.debug("Using {0} files.".format(len(self.files)))
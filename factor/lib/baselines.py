@@ -0,0 +1,161 @@
+"""
+Module that holds functions for baseline lengths and their cache
+
+The baseline lengths depend only on the array geometry, so they are computed
+once (when the bands are set up) and stored in a cache file in the working
+directory. The cache file is keyed by a checksum of the ANTENNA table, so that
+all bands and operations that use the same stations share it.
+"""
+import os
+import hashlib
+import pickle
+import numpy as np
+import casacore.tables as pt
+from factor.lib.cache import write_cache_file
+
+
+def get_antenna_checksum(ms_file):
+    """
+    Returns a checksum of the ANTENNA table (names and positions) of an MS
+
+    Parameters
+    ----------
+    ms_file : str
+        Filename of MS
+
+    Returns
+    -------
+    checksum : str
+        MD5 hex digest of the antenna names and positions
+
+    """
+    anttab = pt.table(ms_file+'::ANTENNA', ack=False)
+    antnames = anttab.getcol('NAME')
+    positions = anttab.getcol('POSITION')
+    anttab.close()
+
+    md5 = hashlib.md5()
+    md5.update(','.join(antnames).encode('utf-8'))
+    md5.update(np.ascontiguousarray(positions, dtype=np.float64).tobytes())
+
+    return md5.hexdigest()
+
+
+def get_baseline_lengths(ms_file):
+    """
+    Returns dict of baseline lengths in km for all baselines in an MS
+
+    The length of each baseline is the mean length of its UVW vectors. The
+    dict also maps the antenna indices (as strings) to the antenna names
+
+    Parameters
+    ----------
+    ms_file : str
+        Filename of MS
+
+    Returns
+    -------
+    baseline_dict : dict
+        Dict with the antenna names (keys '<ant>') and baseline lengths (keys
+        '<ant1>-<ant2>')
+
+    """
+    anttab = pt.table(ms_file+'::ANTENNA', ack=False)
+    antnames = anttab.getcol('NAME')
+    anttab.close()
+
+    t = pt.table(ms_file, ack=False)
+    ant1 = t.getcol('ANTENNA1')
+    ant2 = t.getcol('ANTENNA2')
+    all_uvw = t.getcol('UVW')
+    t.close()
+
+    # Average the UVW lengths of each baseline in one pass
+    sel = np.where(ant1 < ant2)[0]
+    nant = len(antnames)
+    blids = ant1[sel].astype(np.int64) * nant + ant2[sel]
+    uvw_dist = np.sqrt(all_uvw[sel, 0]**2 + all_uvw[sel, 1]**2 + all_uvw[sel, 2]**2)
+    blids_unique, blindex = np.unique(blids, return_inverse=True)
+    mean_dist = (np.bincount(blindex, weights=uvw_dist) /
+        np.bincount(blindex).astype(float))
+
+    baseline_dict = {}
+    for blid, dist in zip(blids_unique, mean_dist):
+        a1 = int(blid // nant)
+        a2 = int(blid % nant)
+        baseline_dict['{0}'.format(a1)] = antnames[a1]
+        baseline_dict['{0}'.format(a2)] = antnames[a2]
+        baseline_dict['{0}-{1}'.format(a1, a2)] = dist / 1.e3
+
+    return baseline_dict
+
+
+def get_baseline_cache_dir(working_dir):
+    """
+    Returns the directory of the baseline-length cache files
+
+    Parameters
+    ----------
+    working_dir : str
+        Factor working directory
+
+    Returns
+    -------
+    cache_dir : str
+        Directory that holds the cache files
+
+    """
+    return os.path.join(working_dir, 'state')
+
+
+def get_baseline_cache_file(ms_file, cache_dir):
+    """
+    Returns the filename of the baseline-length cache file for an MS
+
+    Parameters
+    ----------
+    ms_file : str
+        Filename of MS
+    cache_dir : str
+        Directory that holds the cache files
+
+    Returns
+    -------
+    cache_file : str
+        Filename of cache file
+
+    """
+    return os.path.join(cache_dir, 'baseline_lengths_{0}.pkl'.format(
+        get_antenna_checksum(ms_file)))
+
+
+def get_cached_baseline_lengths(ms_file, cache_dir):
+    """
+    Returns dict of baseline lengths, using the cache if possible
+
+    If no cache file exists for the array geometry of the MS, the baseline
+    lengths are computed and saved to a new cache file
+
+    Parameters
+    ----------
+    ms_file : str
+        Filename of MS
+    cache_dir : str
+        Directory that holds the cache files
+
+    Returns
+    -------
+    baseline_dict : dict
+        Dict with the antenna names and baseline lengths (see
+        get_baseline_lengths())
+
+    """
+    cache_file = get_baseline_cache_file(ms_file, cache_dir)
+    if os.path.exists(cache_file):
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+
+    baseline_dict = get_baseline_lengths(ms_file)
+    write_cache_file(cache_file, lambda f: pickle.dump(baseline_dict, f))
+
+    return baseline_dict
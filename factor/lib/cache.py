@@ -0,0 +1,109 @@
+"""
+Module that holds functions for cache files
+
+Data derived from a file (e.g., the statistics of an image or the values of a
+parmdb) are saved in a cache file that is named after the MD5 hash of the
+absolute path of the file (see get_cache_file()), together with a key that is
+used to check whether they are up to date (see get_file_key()). Cache files are
+written atomically (see write_cache_file()), so that jobs that run in parallel
+never read a partially written one.
+"""
+import os
+import hashlib
+
+
+def get_cache_file(filename, prefix, extension, cache_dir=None):
+    """
+    Returns the filename of the cache file for a file
+
+    Parameters
+    ----------
+    filename : str
+        Filename of the file (or directory, e.g., a casa image or a parmdb) the
+        cached data are derived from
+    prefix : str
+        Prefix of the cache filename, which identifies the kind of data
+    extension : str
+        Extension of the cache filename
+    cache_dir : str, optional
+        Directory that holds the cache files. If None, the directory of the
+        file is used
+
+    Returns
+    -------
+    cache_file : str
+        Filename of cache file
+
+    """
+    path = os.path.abspath(filename)
+    if cache_dir is None:
+        cache_dir = os.path.dirname(path)
+    md5 = hashlib.md5()
+    md5.update(path.encode('utf-8'))
+
+    return os.path.join(cache_dir, '{0}_{1}.{2}'.format(prefix, md5.hexdigest(),
+        extension))
+
+
+def get_file_key(filename):
+    """
+    Returns the key used to check whether cached data are up to date
+
+    For directories (e.g., casa images or parmdbs), the size is the total size
+    of their files and the modification time is the latest one. The lock files
+    of casacore tables are ignored, as they are changed whenever a table is
+    opened
+
+    Parameters
+    ----------
+    filename : str
+        Filename of file or directory
+
+    Returns
+    -------
+    key : tuple
+        Tuple of (absolute path, size, modification time)
+
+    """
+    path = os.path.abspath(filename)
+    if os.path.isdir(path):
+        size = 0
+        mtime = 0.0
+        for root, dirs, files in os.walk(path):
+            for f in files:
+                if f == 'table.lock':
+                    continue
+                st = os.stat(os.path.join(root, f))
+                size += st.st_size
+                mtime = max(mtime, st.st_mtime)
+    else:
+        st = os.stat(path)
+        size = st.st_size
+        mtime = st.st_mtime
+
+    return (path, size, mtime)
+
+
+def write_cache_file(cache_file, write_func):
+    """
+    Writes a cache file atomically
+
+    The data are written to a temporary file that is then renamed, so that
+    jobs that run in parallel never read a partially written cache file
+
+    Parameters
+    ----------
+    cache_file : str
+        Filename of cache file. Its directory is made if needed
+    write_func : function
+        Function that writes the data to the file object it is called with
+
+    """
+    cache_dir = os.path.dirname(os.path.abspath(cache_file))
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    temp_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+    with open(temp_file, 'wb') as f:
+        write_func(f)
+    os.rename(temp_file, cache_file)
@@ -0,0 +1,207 @@
+"""
+Definition of the cost model used to weight operations in the scheduler
+
+The cost of an operation is the CPU time (run time times the number of CPUs
+per node given to it) that it needs. For each type of operation, the cost is
+modeled as:
+
+    log(cost) = b0 + b1*log(npix) + b2*log(nvis) + b3*pre_average
+
+where npix is the number of pixels of the image made by the operation and nvis
+is the relative number of visibilities (number of files divided by the
+averaging steps). The coefficients are fit to the timings of previously
+completed operations, which are stored in the working directory
+"""
+import os
+import pickle
+import logging
+import numpy as np
+
+log = logging.getLogger('factor:cost_model')
+
+
+class CostModel(object):
+    """
+    The CostModel object predicts the cost of operations from past timings
+
+    Parameters
+    ----------
+    working_dir : str
+        Factor working directory. The timings are stored in its state directory
+    min_timings : int, optional
+        Minimum number of timings of an operation type needed to fit its model.
+        Until then, a simple estimate (npix * nvis) is used
+
+    """
+    def __init__(self, working_dir, min_timings=5):
+        self.timings_file = os.path.join(working_dir, 'state', 'operation_timings.pkl')
+        self.min_timings = min_timings
+        self.timings = []
+        if os.path.exists(self.timings_file):
+            try:
+                with open(self.timings_file, 'rb') as f:
+                    self.timings = pickle.load(f)
+            except Exception:
+                log.warning('Could not read operation timings from {0}. Starting '
+                    'with none'.format(self.timings_file))
+                self.timings = []
+        self.coefficients = {}
+        self.fit()
+
+
+    def get_features(self, op):
+        """
+        Returns the features of an operation used by the model
+
+        Parameters
+        ----------
+        op : Operation object
+            Operation
+
+        Returns
+        -------
+        features : dict
+            Dict with npix, nvis, and pre_average
+
+        """
+        d = op.direction
+        if d.facet_imsize is not None and op.name != 'facetselfcal':
+            imsize = d.facet_imsize
+        else:
+            imsize = d.cal_imsize
+        npix = float(max(1, imsize))**2
+        nfiles = len(op.bands) * len(op.bands[0].files)
+        timestep = getattr(d, 'facetselfcal_timestep', 1)
+        freqstep = getattr(d, 'facetselfcal_freqstep', 1)
+        nvis = nfiles / float(max(1, timestep) * max(1, freqstep))
+        pre_average = 1.0 if getattr(d, 'pre_average', False) else 0.0
+
+        return {'npix': npix, 'nvis': nvis, 'pre_average': pre_average}
+
+
+    def get_design_row(self, features):
+        """
+        Returns the row of the design matrix for the given features
+        """
+        return [1.0, np.log(features['npix']), np.log(features['nvis']),
+            features['pre_average']]
+
+
+    def fit(self):
+        """
+        Fits the model coefficients for each operation type with enough timings
+        """
+        self.coefficients = {}
+        op_names = set([t['op_name'] for t in self.timings])
+        for op_name in op_names:
+            timings = [t for t in self.timings if t['op_name'] == op_name]
+            if len(timings) < self.min_timings:
+                continue
+            A = np.array([self.get_design_row(t) for t in timings])
+            b = np.log([max(1.0, t['runtime'] * t['ncpu']) for t in timings])
+            self.coefficients[op_name] = np.linalg.lstsq(A, b, rcond=-1)[0]
+
+
+    def predict_cost(self, op):
+        """
+        Returns the predicted cost (in CPU seconds) of an operation
+
+        Parameters
+        ----------
+        op : Operation object
+            Operation
+
+        Returns
+        -------
+        cost : float or None
+            Predicted cost, or None if there is no model for the operation type
+
+        """
+        if op.name not in self.coefficients:
+            return None
+        row = self.get_design_row(self.get_features(op))
+
+        return float(np.exp(np.dot(row, self.coefficients[op.name])))
+
+
+    def predict_runtime(self, op):
+        """
+        Returns the predicted run time in seconds of an operation
+
+        The run time is the predicted cost divided by the number of CPUs per node
+        given to the operation
+
+        Parameters
+        ----------
+        op : Operation object
+            Operation, with resources allocated
+
+        Returns
+        -------
+        runtime : float or None
+            Predicted run time, or None if there is no model for the operation
+            type
+
+        """
+        cost = self.predict_cost(op)
+        if cost is None:
+            return None
+
+        return cost / float(max(1, op.direction.max_proc_per_node))
+
+
+    def get_weights(self, op_list):
+        """
+        Returns the resource weights of a list of operations
+
+        The predicted costs are used if all operations have a model, otherwise
+        the simple estimate (npix * nvis) is used for all of them
+
+        Parameters
+        ----------
+        op_list : list of Operation objects
+            Operations to weight
+
+        Returns
+        -------
+        weights : list of float
+            Weight of each operation
+
+        """
+        costs = [self.predict_cost(op) for op in op_list]
+        if None in costs:
+            costs = []
+            for op in op_list:
+                features = self.get_features(op)
+                costs.append(features['npix'] * features['nvis'])
+
+        return costs
+
+
+    def add_timing(self, op, runtime):
+        """
+        Adds the timing of a completed operation and saves all timings
+
+        Parameters
+        ----------
+        op : Operation object
+            Completed operation
+        runtime : float
+            Run time in seconds
+
+        """
+        timing = self.get_features(op)
+        timing.update({'op_name': op.name, 'direction_name': op.direction.name,
+            'ncpu': op.direction.max_proc_per_node, 'runtime': runtime})
+        self.timings.append(timing)
+
+        # Write to a temporary file first, so that the timings file is never
+        # left partially written
+        timings_dir = os.path.dirname(self.timings_file)
+        if not os.path.exists(timings_dir):
+            os.makedirs(timings_dir)
+        temp_file = '{0}.tmp'.format(self.timings_file)
+        with open(temp_file, 'wb') as f:
+            pickle.dump(self.timings, f)
+        os.rename(temp_file, self.timings_file)
+        self.fit()
@@ -0,0 +1,320 @@
+"""
+Module that holds functions for tiled image I/O
+
+FITS images are accessed through memory maps and casa images through
+getdata()/putdata() on boxes of rows, so that images can be read, modified and
+written one tile of rows at a time in constant memory. The tiles cover the
+last two (y, x) axes of the image and include all of the leading (e.g.,
+frequency and Stokes) axes.
+"""
+import os
+import numpy as np
+from astropy.io import fits as pyfits
+import casacore.images as pim
+
+
+def get_row_tiles(nrows, rows_per_tile=1024):
+    """
+    Returns the row ranges of the tiles of an image
+
+    Parameters
+    ----------
+    nrows : int
+        Number of rows (length of the y axis) of the image
+    rows_per_tile : int, optional
+        Number of rows per tile
+
+    Returns
+    -------
+    tiles : list of tuples
+        List of (start row, end row) tuples
+
+    """
+    rows_per_tile = max(1, int(rows_per_tile))
+
+    return [(r0, min(r0 + rows_per_tile, nrows)) for r0 in range(0, nrows, rows_per_tile)]
+
+
+def is_fits(filename):
+    """
+    Returns True if an image is a FITS file (casa images are directories)
+    """
+    return not os.path.isdir(filename)
+
+
+def open_fits(filename, readonly=True):
+    """
+    Opens a FITS image with its data memory mapped
+
+    Parameters
+    ----------
+    filename : str
+        Filename of FITS image
+    readonly : bool, optional
+        If False, changes to the data are written to the file when it is
+        flushed or closed
+
+    Returns
+    -------
+    hdulist : HDUList object
+        FITS HDU list. The image is hdulist[0]
+
+    """
+    if readonly:
+        mode = 'readonly'
+    else:
+        mode = 'update'
+
+    return pyfits.open(filename, mode=mode, memmap=True, ignore_missing_end=True)
+
+
+def create_fits(filename, header, shape, dtype=np.float32):
+    """
+    Creates a zero-filled FITS image without holding its data in memory
+
+    The file is made by writing the header and extending the file to the
+    size of the data, which the file system fills with zeros
+
+    Parameters
+    ----------
+    filename : str
+        Filename of output FITS image
+    header : FITS header
+        Header from which the non-structural keywords (e.g., WCS) are copied
+    shape : tuple of int
+        Shape of the image data (in numpy order)
+    dtype : numpy dtype, optional
+        Data type of the image
+
+    Returns
+    -------
+    hdulist : HDUList object
+        FITS HDU list, opened for update with its data memory mapped
+
+    """
+    new_header = pyfits.PrimaryHDU(np.zeros([1] * len(shape), dtype=dtype)).header
+    for i, n in enumerate(reversed(shape)):
+        new_header['NAXIS{}'.format(i+1)] = n
+    structural = ['SIMPLE', 'BITPIX', 'NAXIS', 'EXTEND', 'BSCALE', 'BZERO', 'END']
+    for card in header.cards:
+        if card.keyword in structural or card.keyword.startswith('NAXIS'):
+            continue
+        new_header.append(card)
+
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    nbytes = int(np.ceil(nbytes / 2880.0)) * 2880
+    header_str = new_header.tostring()
+    with open(filename, 'wb') as f:
+        f.write(header_str.encode('ascii'))
+        if nbytes > 0:
+            f.seek(len(header_str) + nbytes - 1)
+            f.write(b'\0')
+
+    return open_fits(filename, readonly=False)
+
+
+def read_casa_tile(image, r0, r1):
+    """
+    Reads rows r0 to r1 (exclusive) of a casa image
+
+    Parameters
+    ----------
+    image : casacore.images image() object
+        Image
+    r0 : int
+        Start row
+    r1 : int
+        End row (exclusive)
+
+    Returns
+    -------
+    data : array
+        Data of the tile
+
+    """
+    shape = image.shape()
+    blc = [0] * (len(shape) - 2) + [r0, 0]
+    trc = [n - 1 for n in shape[:-2]] + [r1 - 1, shape[-1] - 1]
+
+    return image.getdata(blc=blc, trc=trc)
+
+
+def write_casa_tile(image, data, r0):
+    """
+    Writes a tile of rows starting at row r0 to a casa image
+
+    Parameters
+    ----------
+    image : casacore.images image() object
+        Image
+    data : array
+        Data of the tile
+    r0 : int
+        Start row
+
+    """
+    blc = [0] * (len(data.shape) - 2) + [r0, 0]
+    image.putdata(data, blc=blc)
+
+
+def iter_image_tiles(filename, rows_per_tile=1024):
+    """
+    Iterates over the tiles of a FITS or casa image
+
+    Parameters
+    ----------
+    filename : str
+        Filename of image
+    rows_per_tile : int, optional
+        Number of rows per tile
+
+    Yields
+    ------
+    r0 : int
+        Start row of the tile
+    data : array
+        Data of the tile
+
+    """
+    if is_fits(filename):
+        hdulist = open_fits(filename)
+        try:
+            data = hdulist[0].data
+            for r0, r1 in get_row_tiles(data.shape[-2], rows_per_tile):
+                yield r0, np.array(data[..., r0:r1, :])
+        finally:
+            hdulist.close()
+    else:
+        image = pim.image(filename)
+        for r0, r1 in get_row_tiles(image.shape()[-2], rows_per_tile):
+            yield r0, read_casa_tile(image, r0, r1)
+
+
+def pad_fits(infile, outfile, padsize, rows_per_tile=1024):
+    """
+    Pads the last two axes of a FITS image with zeros to padsize x padsize
+
+    The image is centered in the padded image and the reference pixel is
+    shifted to match. The input image may also be the output image
+
+    Parameters
+    ----------
+    infile : str
+        Filename of input FITS image
+    outfile : str
+        Filename of output FITS image
+    padsize : int
+        Size of the padded image
+    rows_per_tile : int, optional
+        Number of rows per tile
+
+    Returns
+    -------
+    offset : int
+        Offset of the input image in the padded image
+
+    """
+    hdulist_in = open_fits(infile)
+    data_in = hdulist_in[0].data
+    header = hdulist_in[0].header.copy()
+    nrows = data_in.shape[-2]
+    offset = (padsize - nrows) // 2
+    header['CRPIX1'] += offset
+    header['CRPIX2'] += offset
+
+    # Write to a temporary file first, so that the input image can be replaced
+    temp_file = '{0}.{1}.tmp'.format(outfile, os.getpid())
+    shape_out = data_in.shape[:-2] + (padsize, padsize)
+    hdulist_out = create_fits(temp_file, header, shape_out, dtype=data_in.dtype.newbyteorder('>'))
+    data_out = hdulist_out[0].data
+    for r0, r1 in get_row_tiles(nrows, rows_per_tile):
+        data_out[..., offset+r0:offset+r1, offset:offset+data_in.shape[-1]] = data_in[..., r0:r1, :]
+    hdulist_out.close()
+    hdulist_in.close()
+    os.rename(temp_file, outfile)
+
+    return offset
+
+
+def get_corner_mask(r0, r1, shape, radius):
+    """
+    Returns a mask of the pixels in rows r0 to r1 that lie outside a radius
+
+    The distance of a pixel is measured from the image center as done
+    originally in zero_avgpb.py (so that the pixels in each quadrant are
+    mirror images of those in the others)
+
+    Parameters
+    ----------
+    r0 : int
+        Start row
+    r1 : int
+        End row (exclusive)
+    shape : tuple of int
+        Shape (ny, nx) of the image
+    radius : float
+        Radius in pixels
+
+    Returns
+    -------
+    mask : array
+        Boolean array of shape (r1 - r0, nx) that is True for pixels outside
+        the radius
+
+    """
+    ny, nx = shape
+    cy = ny // 2
+    cx = nx // 2
+
+    # Find the largest distance along each axis of the mirrored pixels (-1
+    # where a pixel has no mirrored counterpart in a quadrant)
+    rows = np.arange(r0, r1)
+    dy = np.maximum(np.where(rows >= cy, rows + 1 - cy, -1),
+        np.where(rows < ny - cy, ny - rows - cy, -1))
+    cols = np.arange(nx)
+    dx = np.maximum(np.where(cols >= cx, cols + 1 - cx, -1),
+        np.where(cols < nx - cx, nx - cols - cx, -1))
+    dist = np.sqrt(dx[np.newaxis, :]**2 + dy[:, np.newaxis]**2)
+
+    return (dist > radius) & (dy[:, np.newaxis] > 0) & (dx[np.newaxis, :] > 0)
+
+
+def get_polygon_mask(poly, r0, r1, ncols, include_boundary=True, margin=2):
+    """
+    Returns a mask of the pixels in rows r0 to r1 that lie inside a polygon
+
+    Only the part of the rows that lies within the bounding box of the polygon
+    is rasterized
+
+    Parameters
+    ----------
+    poly : Polygon object
+        Polygon in pixel coordinates (x along the rows, y along the columns)
+    r0 : int
+        Start row
+    r1 : int
+        End row (exclusive)
+    ncols : int
+        Number of columns
+    include_boundary : bool, optional
+        If True, pixels on a side of the polygon are considered inside
+    margin : int, optional
+        Number of pixels by which to extend the bounding box
+
+    Returns
+    -------
+    mask : array
+        Boolean array of shape (r1 - r0, ncols) that is True for pixels inside
+        the polygon
+
+    """
+    mask = np.zeros((r1 - r0, ncols), dtype=bool)
+    xmin = max(int(np.min(poly.x)) - margin, r0)
+    xmax = min(int(np.max(poly.x)) + margin, r1)
+    ymin = max(int(np.min(poly.y)) - margin, 0)
+    ymax = min(int(np.max(poly.y)) + margin, ncols)
+    if xmax > xmin and ymax > ymin:
+        mask[xmin-r0:xmax-r0, ymin:ymax] = poly.rasterize((xmax-xmin, ymax-ymin),
+            offset=(xmin, ymin), include_boundary=include_boundary)
+
+    return mask
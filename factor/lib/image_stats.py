@@ -0,0 +1,352 @@
+"""
+Module that holds functions for image statistics and their cache
+
+The noise of an image is estimated with an iteratively sigma-clipped robust
+sigma (see meanclip()). For large images, the estimate is made from a random
+subsample of the pixels, the size of which sets the statistical error of the
+estimate (see get_num_samples()). The statistics of each image are stored in
+a cache file keyed by the image path, size and modification time (see
+factor.lib.cache), so that an image that is checked several times is read
+only once. The statistics of an image can also be saved for a copy of it (see
+copy_image_stats()), as done for the images that are kept from one selfcal
+loop to the next.
+"""
+import os
+import pickle
+import numpy as np
+from factor.lib.image_io import iter_image_tiles
+from factor.lib.cache import get_cache_file, get_file_key, write_cache_file
+
+
+def robust_sigma(in_y, zero=0):
+    """
+    Calculate a resistant estimate of the dispersion of
+    a distribution. For an uncontaminated distribution,
+    this is identical to the standard deviation.
+
+    Use the median absolute deviation as the initial
+    estimate, then weight points using Tukey Biweight.
+    See, for example, Understanding Robust and
+    Exploratory Data Analysis, by Hoaglin, Mosteller
+    and Tukey, John Wiley and Sons, 1983.
+
+    .. note:: ROBUST_SIGMA routine from IDL ASTROLIB.
+
+    Examples
+    --------
+    >>> result = robust_sigma(in_y, zero=1)
+
+    Parameters
+    ----------
+    in_y : array_like
+        Vector of quantity for which the dispersion is
+        to be calculated
+
+    zero : int
+        If set, the dispersion is calculated w.r.t. 0.0
+        rather than the central value of the vector. If
+        Y is a vector of residuals, this should be set.
+
+    Returns
+    -------
+    out_val : float
+        Dispersion value. If failed, returns -1.
+
+    """
+    # Flatten array
+    y = in_y.ravel()
+
+    eps = 1.0E-20
+    c1 = 0.6745
+    c2 = 0.80
+    c3 = 6.0
+    c4 = 5.0
+    c_err = -1.0
+    min_points = 3
+
+    if zero:
+        y0 = 0.0
+    else:
+        y0 = np.median(y)
+
+    dy = y - y0
+    del_y = abs(dy)
+
+    # First, the median absolute deviation MAD about the median:
+    mad = np.median(del_y) / c1
+
+    # If the MAD=0, try the MEAN absolute deviation:
+    if mad < eps:
+        mad = del_y.mean() / c2
+    if mad < eps:
+        return 0.0
+
+    # Now the biweighted value:
+    u = dy / (c3 * mad)
+    uu = u * u
+    q = np.where(uu <= 1.0)
+    count = len(q[0])
+    if count < min_points:
+        print('ROBUST_SIGMA: This distribution is TOO WEIRD! '
+            'Returning {}'.format(c_err))
+        return c_err
+
+    numerator = np.sum((y[q] - y0)**2.0 * (1.0 - uu[q])**4.0)
+    n = y.size
+    den1 = np.sum((1.0 - uu[q]) * (1.0 - c4 * uu[q]))
+    siggma = n * numerator / (den1 * (den1 - 1.0))
+
+    if siggma > 0:
+        out_val = np.sqrt(siggma)
+    else:
+        out_val = 0.0
+
+    return out_val
+
+
+def meanclip(indata, clipsig=4.0, maxiter=10, converge_num=0.001):
+    """
+    Computes an iteratively sigma-clipped mean on a data set
+
+    Clipping is done about the median, but the mean is returned.
+
+    .. note:: MYMEANCLIP routine from ACS library.
+
+    Parameters
+    ----------
+    indata : array_like
+        Input data
+    clipsig : float, optional
+        Number of sigma at which to clip
+    maxiter : int, optional
+        Ceiling on number of clipping iterations
+    converge_num : float, optional
+        If the proportion of rejected pixels is less than this fraction, the
+        iterations stop
+
+    Returns
+    -------
+    mean : float
+        N-sigma clipped mean
+    sigma : float
+        Robust sigma of remaining pixels
+
+    """
+    skpix = indata.reshape(indata.size, )
+
+    ct = indata.size
+    niter = 0
+    c1 = 1.0
+    c2 = 0.0
+    while (c1 >= c2) and (niter < maxiter):
+        lastct = ct
+        medval = np.median(skpix)
+        sig = np.std(skpix)
+        wsm = np.where(abs(skpix-medval) < clipsig*sig)
+        ct = len(wsm[0])
+        if ct > 0:
+            skpix = skpix[wsm]
+
+        c1 = abs(ct - lastct)
+        c2 = converge_num * lastct
+        niter += 1
+
+    mean = np.mean(skpix)
+    sigma = robust_sigma(skpix)
+
+    return mean, sigma
+
+
+def get_num_samples(rel_error):
+    """
+    Returns the number of pixels needed to estimate the noise to a given error
+
+    The relative standard error of the standard deviation of N Gaussian samples
+    is 1/sqrt(2N). The number returned is twice the one that gives rel_error
+    for the standard deviation, to allow for the lower efficiency of the
+    clipped robust sigma
+
+    Parameters
+    ----------
+    rel_error : float
+        Target relative standard error of the noise estimate
+
+    Returns
+    -------
+    nsamples : int
+        Number of pixels
+
+    """
+    return int(np.ceil(1.0 / rel_error**2))
+
+
+def calc_stats(imagename, rel_error=0.001, seed=0, rows_per_tile=1024):
+    """
+    Calculates the statistics of an image
+
+    The image is read in tiles of rows (see factor.lib.image_io), in two
+    passes: the first finds the number of finite pixels and the extrema, and
+    the second gathers the random subsample used for the noise estimate
+
+    Parameters
+    ----------
+    imagename : str
+        Filename of image (FITS or casa). Non-finite values are ignored
+    rel_error : float, optional
+        Target relative standard error of the noise estimate. If the image has
+        more unmasked pixels than are needed for this error, the noise is
+        estimated from a random subsample of them. If 0, all pixels are used
+    seed : int, optional
+        Seed of the random subsample, so that the estimate of a given image is
+        reproducible
+    rows_per_tile : int, optional
+        Number of rows per tile
+
+    Returns
+    -------
+    stats : dict
+        Dict with the clipped mean ('mean'), noise ('rms'), maximum ('max') and
+        minimum ('min') of the image and the number of pixels used for the
+        noise ('nsamples')
+
+    """
+    nfinite = []
+    maxval = -np.inf
+    minval = np.inf
+    for r0, tile in iter_image_tiles(imagename, rows_per_tile):
+        finite = np.isfinite(tile)
+        nfinite.append(np.sum(finite))
+        if nfinite[-1] > 0:
+            maxval = max(maxval, np.max(tile[finite]))
+            minval = min(minval, np.min(tile[finite]))
+    ntotal = sum(nfinite)
+    if ntotal == 0:
+        return {'mean': np.nan, 'rms': np.nan, 'max': np.nan, 'min': np.nan,
+            'nsamples': 0}
+
+    if rel_error > 0:
+        nsamples = get_num_samples(rel_error)
+    else:
+        nsamples = ntotal
+    if nsamples < ntotal:
+        # Draw the subsample with replacement, which avoids permuting the full
+        # image and is statistically equivalent for nsamples << ntotal
+        rs = np.random.RandomState(seed)
+        indices = np.sort(rs.randint(0, ntotal, nsamples))
+    else:
+        indices = None
+
+    samples = []
+    start = 0
+    for n, (r0, tile) in zip(nfinite, iter_image_tiles(imagename, rows_per_tile)):
+        values = tile[np.isfinite(tile)]
+        if indices is None:
+            samples.append(values)
+        else:
+            i0, i1 = np.searchsorted(indices, [start, start + n])
+            samples.append(values[indices[i0:i1] - start])
+        start += n
+    samples = np.concatenate(samples)
+    mean, rms = meanclip(samples)
+
+    return {'mean': float(mean), 'rms': float(rms), 'max': float(maxval),
+        'min': float(minval), 'nsamples': samples.size}
+
+
+def get_image_stats(imagename, rel_error=0.001, cache_dir=None, use_cache=True):
+    """
+    Returns the statistics of an image, using the cache if possible
+
+    If no up-to-date cache file exists for the image, the statistics are
+    computed and saved to a new cache file
+
+    Parameters
+    ----------
+    imagename : str
+        Filename of image (FITS or casacore)
+    rel_error : float, optional
+        Target relative standard error of the noise estimate (see calc_stats())
+    cache_dir : str, optional
+        Directory that holds the cache files. If None, the directory of the
+        image is used
+    use_cache : bool, optional
+        If False, the cache is neither read nor written
+
+    Returns
+    -------
+    stats : dict
+        Dict of image statistics (see calc_stats())
+
+    """
+    if use_cache:
+        key = get_file_key(imagename) + (rel_error,)
+        cache_file = get_cache_file(imagename, 'image_stats', 'pkl', cache_dir)
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    cached_key, stats = pickle.load(f)
+                if cached_key == key:
+                    return stats
+            except Exception:
+                pass
+
+    stats = calc_stats(imagename, rel_error=rel_error)
+
+    if use_cache:
+        save_image_stats(imagename, stats, rel_error=rel_error, cache_dir=cache_dir)
+
+    return stats
+
+
+def save_image_stats(imagename, stats, rel_error=0.001, cache_dir=None):
+    """
+    Saves the statistics of an image to its cache file
+
+    Parameters
+    ----------
+    imagename : str
+        Filename of image (FITS or casacore)
+    stats : dict
+        Dict of image statistics (see calc_stats())
+    rel_error : float, optional
+        Target relative standard error with which the statistics were computed
+    cache_dir : str, optional
+        Directory that holds the cache files. If None, the directory of the
+        image is used
+
+    """
+    key = get_file_key(imagename) + (rel_error,)
+    cache_file = get_cache_file(imagename, 'image_stats', 'pkl', cache_dir)
+    write_cache_file(cache_file, lambda f: pickle.dump((key, stats), f))
+
+
+def copy_image_stats(imagename, copyname, rel_error=0.001, cache_dir=None):
+    """
+    Saves the statistics of an image as those of a copy of it
+
+    The copy has its own path and modification time, so it would otherwise
+    have no valid cache file. The statistics of the original image are taken
+    from its cache file if possible
+
+    Parameters
+    ----------
+    imagename : str
+        Filename of image (FITS or casacore)
+    copyname : str
+        Filename of an identical copy of the image
+    rel_error : float, optional
+        Target relative standard error of the noise estimate (see calc_stats())
+    cache_dir : str, optional
+        Directory that holds the cache files. If None, the directory of each
+        image is used
+
+    Returns
+    -------
+    stats : dict
+        Dict of image statistics (see calc_stats())
+
+    """
+    stats = get_image_stats(imagename, rel_error=rel_error, cache_dir=cache_dir)
+    save_image_stats(copyname, stats, rel_error=rel_error, cache_dir=cache_dir)
+
+    return stats
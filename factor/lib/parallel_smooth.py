@@ -0,0 +1,166 @@
+"""
+Module that holds functions for smoothing many solution series in parallel
+
+The series (e.g., one per station, polarization and channel) are smoothed in a
+single process pool that is created once per call of smooth_series(). Each
+worker is sent batches of rows of the input arrays, which, like the output
+arrays, are held in shared memory that the workers inherit when the pool is
+created, so that only the row indices (and any per-series extra outputs that
+are requested) are passed between processes.
+"""
+import multiprocessing
+import ctypes
+import numpy as np
+
+
+# Shared arrays and smoothing functions of the current call of smooth_series(),
+# set in each worker by init_worker()
+_jobs = []
+
+
+def to_shared_array(data):
+    """
+    Returns a copy of a 2-D array in shared memory
+
+    Parameters
+    ----------
+    data : array
+        2-D array of float values
+
+    Returns
+    -------
+    shared : multiprocessing.RawArray
+        Shared array holding the data (as doubles)
+
+    """
+    shared = multiprocessing.RawArray(ctypes.c_double, int(np.prod(data.shape)))
+    from_shared_array(shared, data.shape)[:] = data
+
+    return shared
+
+
+def from_shared_array(shared, shape):
+    """
+    Returns a numpy view of a shared array
+    """
+    return np.frombuffer(shared, dtype=np.float64).reshape(shape)
+
+
+def init_worker(jobs):
+    """
+    Sets the shared arrays and smoothing functions used by smooth_batch()
+
+    Parameters
+    ----------
+    jobs : list of tuples
+        List of (smoothing function, shared input array, shared output array,
+        shape, valid rows, rows for which the extra outputs are returned)
+
+    """
+    global _jobs
+    _jobs = jobs
+
+
+def smooth_batch(task):
+    """
+    Smooths a batch of rows of one job
+
+    Parameters
+    ----------
+    task : tuple
+        Tuple of (job index, start row, end row (exclusive))
+
+    Returns
+    -------
+    result : tuple
+        Tuple of (job index, list of (row, extra outputs) tuples)
+
+    """
+    ijob, start, end = task
+    func, shared_in, shared_out, shape, valid, info_rows = _jobs[ijob]
+    data_in = from_shared_array(shared_in, shape)
+    data_out = from_shared_array(shared_out, shape)
+
+    info = []
+    for row in range(start, end):
+        if not valid[row]:
+            continue
+        result = func(np.copy(data_in[row]))
+        data_out[row] = result[0]
+        if row in info_rows:
+            info.append((row, result[1:]))
+
+    return ijob, info
+
+
+def smooth_series(jobs, ncores=None, batch_size=None):
+    """
+    Smooths the series of one or more jobs in a single process pool
+
+    Parameters
+    ----------
+    jobs : list of tuples
+        List of (func, data, valid, info_rows) tuples, one per job, where func
+        is the smoothing function (it is called with a single series and must
+        return a tuple whose first item is the smoothed series), data is a 2-D
+        array of shape (nseries, nsamples), valid is a boolean array that
+        is False for series that are not smoothed (or None to smooth all) and
+        info_rows is a list of the series for which the remaining items of
+        the tuple returned by func are wanted (or None)
+    ncores : int, optional
+        Number of processes. If None, the number of CPUs is used. If 1, the
+        series are smoothed without a pool
+    batch_size : int, optional
+        Number of series per batch sent to a worker. If None, the series of
+        each job are split into about four batches per process
+
+    Returns
+    -------
+    results : list of tuples
+        List of (smoothed data, info) tuples, one per job, where info is a dict
+        with the extra outputs of func for each series in info_rows. Series
+        that are not valid are returned unchanged
+
+    """
+    if ncores is None:
+        ncores = multiprocessing.cpu_count()
+    ncores = max(1, int(ncores))
+
+    shared_jobs = []
+    tasks = []
+    for ijob, (func, data, valid, info_rows) in enumerate(jobs):
+        data = np.asarray(data, dtype=np.float64)
+        nseries = data.shape[0]
+        if valid is None:
+            valid = np.ones(nseries, dtype=bool)
+        if info_rows is None:
+            info_rows = []
+        shared_jobs.append((func, to_shared_array(data), to_shared_array(data),
+            data.shape, np.asarray(valid, dtype=bool), set(info_rows)))
+        if batch_size is None:
+            job_batch_size = max(1, int(np.ceil(nseries / float(4 * ncores))))
+        else:
+            job_batch_size = max(1, int(batch_size))
+        for start in range(0, nseries, job_batch_size):
+            tasks.append((ijob, start, min(start + job_batch_size, nseries)))
+
+    if ncores > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(ncores, len(tasks)), initializer=init_worker,
+            initargs=(shared_jobs,))
+        batch_results = pool.map(smooth_batch, tasks)
+        pool.close()
+        pool.join()
+    else:
+        init_worker(shared_jobs)
+        batch_results = [smooth_batch(task) for task in tasks]
+        init_worker([])
+
+    infos = [{} for job in jobs]
+    for ijob, info in batch_results:
+        infos[ijob].update(info)
+
+    results = []
+    for (func, shared_in, shared_out, shape, valid, info_rows), info in zip(shared_jobs, infos):
+        results.append((np.copy(from_shared_array(shared_out, shape)), info))
+
+    return results
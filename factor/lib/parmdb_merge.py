@@ -0,0 +1,175 @@
+"""
+Module that holds functions for merging parmdbs
+
+The input parmdbs are read concurrently (one process per parmdb, up to the
+number of cores), the values of each parm are concatenated in time in memory
+(after checking that the time chunks do not overlap and that their frequency
+axes agree), and the merged values are added to the output parmdb in bulk:
+one call per group of parms that share their axes and per time segment
+between gaps (see factor.lib.solution_store.add_values_by_segment()).
+"""
+import multiprocessing
+import numpy as np
+from factor.lib.solution_store import add_values_by_segment, get_axes_key
+
+
+def read_parms(parmdb_name):
+    """
+    Returns the values of all parms of a parmdb, with flagged values set to NaN
+
+    Solutions of zero are flagged solutions
+
+    Parameters
+    ----------
+    parmdb_name : str
+        Filename of parmdb
+
+    Returns
+    -------
+    parms : dict
+        Dict of parm values as returned by getValuesGrid()
+
+    """
+    import lofar.parmdb
+
+    pdb = lofar.parmdb.parmdb(parmdb_name)
+    parms = pdb.getValuesGrid('*')
+    del pdb
+
+    return flag_parms(parms)
+
+
+def flag_parms(parms):
+    """
+    Returns a copy of parm values with flagged (zero) values set to NaN
+
+    Parameters
+    ----------
+    parms : dict
+        Dict of parm values as returned by getValuesGrid()
+
+    Returns
+    -------
+    parms : dict
+        Dict of parm values with flagged values set to NaN
+
+    """
+    flagged_parms = {}
+    for name, parm in parms.items():
+        values = np.array(parm['values'], dtype=float)
+        values[values == 0.0] = np.nan
+        flagged_parms[name] = dict(parm)
+        flagged_parms[name]['values'] = values
+
+    return flagged_parms
+
+
+def read_parmdbs(parmdb_names, ncores=None):
+    """
+    Reads several parmdbs concurrently
+
+    Parameters
+    ----------
+    parmdb_names : list of str
+        Filenames of parmdbs
+    ncores : int, optional
+        Number of processes. If None, the number of CPUs is used. If 1, the
+        parmdbs are read without a pool
+
+    Returns
+    -------
+    parms_list : list of dicts
+        List of the dicts of parm values (see read_parms()), in the order of
+        parmdb_names
+
+    """
+    if ncores is None:
+        ncores = multiprocessing.cpu_count()
+    ncores = min(max(1, int(ncores)), len(parmdb_names))
+
+    if ncores > 1:
+        pool = multiprocessing.Pool(ncores)
+        parms_list = pool.map(read_parms, parmdb_names)
+        pool.close()
+        pool.join()
+    else:
+        parms_list = [read_parms(parmdb_name) for parmdb_name in parmdb_names]
+
+    return parms_list
+
+
+def concat_in_time(parms_list, tol=0.01):
+    """
+    Concatenates the values of each parm in time
+
+    Parameters
+    ----------
+    parms_list : list of dicts
+        List of dicts of parm values as returned by getValuesGrid(), one per
+        time chunk. A parm need not be present in all chunks
+    tol : float, optional
+        Fraction of a time width by which two chunks may overlap before they
+        are considered to overlap (to allow for rounding of the times)
+
+    Returns
+    -------
+    parms : dict
+        Dict of merged parm values, with the chunks sorted in time
+
+    """
+    chunks = {}
+    for parms in parms_list:
+        for name, parm in parms.items():
+            if len(parm['times']) > 0:
+                chunks.setdefault(name, []).append(parm)
+
+    merged = {}
+    for name, parm_chunks in chunks.items():
+        parm_chunks = sorted(parm_chunks, key=lambda p: p['times'][0])
+        first = parm_chunks[0]
+        for prev, parm in zip(parm_chunks[:-1], parm_chunks[1:]):
+            if (len(parm['freqs']) != len(first['freqs']) or
+                not np.allclose(parm['freqs'], first['freqs'])):
+                raise ValueError('The frequency axes of the time chunks of parm '
+                    '{} differ'.format(name))
+            prev_end = prev['times'][-1] + prev['timewidths'][-1] / 2.0
+            start = parm['times'][0] - parm['timewidths'][0] / 2.0
+            if start < prev_end - tol * min(prev['timewidths'][-1], parm['timewidths'][0]):
+                raise ValueError('The time chunks of parm {0} overlap (chunk ending '
+                    'at {1} and chunk starting at {2})'.format(name, prev_end, start))
+        merged[name] = {'values': np.concatenate([p['values'] for p in parm_chunks]),
+            'times': np.concatenate([p['times'] for p in parm_chunks]),
+            'timewidths': np.concatenate([p['timewidths'] for p in parm_chunks]),
+            'freqs': np.array(first['freqs']),
+            'freqwidths': np.array(first['freqwidths'])}
+
+    return merged
+
+
+def add_parms(pdb, parms, gap_factor=1.1):
+    """
+    Adds parm values to a parmdb in bulk
+
+    The parms are grouped by their time and frequency axes and the values of
+    each group are added with one call per time segment between gaps
+
+    Parameters
+    ----------
+    pdb : parmdb object
+        Parmdb to which the values are added (it is not flushed)
+    parms : dict
+        Dict of parm values as returned by getValuesGrid()
+    gap_factor : float, optional
+        Separation, in units of the time width, above which there is a gap
+        (see factor.lib.solution_store.get_time_segments())
+
+    """
+    groups = {}
+    for name, parm in parms.items():
+        groups.setdefault(get_axes_key(parm), []).append(name)
+
+    for names in groups.values():
+        first = parms[names[0]]
+        values = dict([(name, parms[name]['values']) for name in names])
+        add_values_by_segment(pdb, values, first['freqs'], first['freqwidths'],
+            first['times'], first['timewidths'], gap_factor=gap_factor)
@@ -172,51 +172,291 @@ class Polygon:
             mindst = float(mindst)
         return mindst
 
-    def  check_intersections(self):
+    def rasterize(self, shape, offset=(0, 0), include_boundary=True, smalld=1e-12):
+        """
+        Returns a boolean image that is True for pixels inside the polygon
+
+        The polygon is filled scanline by scanline with the even-odd rule. The
+        result is the same as that of is_inside() for the pixel coordinates
+        (pixel [i, j] has coordinates x = i + offset[0], y = j + offset[1]), but
+        much faster for large images
+
+        Parameters
+        ----------
+        shape : tuple of int
+            Shape (nx, ny) of the image
+        offset : tuple of int, optional
+            Coordinates (x, y) of pixel [0, 0]
+        include_boundary : bool, optional
+            If True, pixels on a side of the polygon (is_inside() = 0) are
+            considered inside, otherwise they are considered outside
+        smalld : float, optional
+            Tolerance within which a pixel is considered to be on a side
+
+        Returns
+        -------
+        mask : array
+            Boolean image
+
+        """
+        return rasterize([self], shape, offset=offset,
+            include_boundary=include_boundary, smalld=smalld)
+
+
+    def _fill(self, mask, offset, include_boundary, smalld):
+        """
+        Fills the polygon into a boolean image (see rasterize())
+        """
+        nx, ny = mask.shape
+        x = self.x - offset[0]
+        y = self.y - offset[1]
+
+        # Find the crossings of the sides with each scanline (x = row). A side
+        # crosses the rows with x1 <= row < x2 (or x2 <= row < x1), so that
+        # vertices are counted once and sides along a scanline are skipped
+        rows = []
+        ycross = []
+        for i in range(len(x) - 1):
+            x1, y1, x2, y2 = x[i], y[i], x[i+1], y[i+1]
+            if x1 == x2:
+                continue
+            rstart = max(int(np.ceil(min(x1, x2))), 0)
+            rend = min(int(np.ceil(max(x1, x2))), nx)
+            if rend <= rstart:
+                continue
+            r = np.arange(rstart, rend)
+            rows.append(r)
+            ycross.append(y1 + (r - x1) * (y2 - y1) / (x2 - x1))
+
+        # Fill between pairs of crossings. A pixel is inside if it has an odd
+        # number of crossings above it, i.e., if it lies in [c0, c1), [c2, c3),
+        # etc.
+        if len(rows) > 0:
+            rows = np.concatenate(rows)
+            ycross = np.concatenate(ycross)
+            order = np.lexsort((ycross, rows))
+            rows = rows[order]
+            ycross = ycross[order]
+            starts = np.clip(np.ceil(ycross[0::2]), 0, ny).astype(int)
+            ends = np.clip(np.ceil(ycross[1::2]), 0, ny).astype(int)
+            for r, start, end in zip(rows[0::2], starts, ends):
+                if end > start:
+                    mask[r, start:end] = True
+
+        # Set the pixels on the sides of the polygon
+        for i in range(len(x) - 1):
+            x1, y1, x2, y2 = x[i], y[i], x[i+1], y[i+1]
+            x21 = x2 - x1
+            y21 = y2 - y1
+            length = np.hypot(x21, y21)
+            rstart = max(int(np.ceil(min(x1, x2) - smalld)), 0)
+            rend = min(int(np.floor(max(x1, x2) + smalld)) + 1, nx)
+            if rend <= rstart or length == 0.0:
+                continue
+            r = np.arange(rstart, rend)
+            if x21 == 0.0:
+                # Side lies along a scanline: all pixels between its ends are
+                # on it
+                if abs(x1 - np.round(x1)) >= smalld:
+                    continue
+                jstart = max(int(np.ceil(min(y1, y2) - smalld)), 0)
+                jend = min(int(np.floor(max(y1, y2) + smalld)) + 1, ny)
+                if jend > jstart:
+                    mask[r[0], jstart:jend] = include_boundary
+                continue
+
+            # Find the nearest pixel to the side on each scanline and check
+            # its distance to the side
+            yside = y1 + np.clip((r - x1) / x21, 0.0, 1.0) * y21
+            j = np.round(yside)
+            t = np.clip(((r - x1) * x21 + (j - y1) * y21) / length**2, 0.0, 1.0)
+            dist = np.hypot(x1 + t * x21 - r, y1 + t * y21 - j)
+            near = (dist < smalld) & (j >= 0) & (j < ny)
+            mask[r[near], j[near].astype(int)] = include_boundary
+
+
+    def find_intersections(self):
+        """
+        Finds the pairs of non-adjacent sides of the polygon that intersect
+
+        The sides are swept in order of their minimum x coordinate. Each side
+        is tested only against the sides that start (in x) before it ends and
+        that overlap it in y, with all tests for a side done at once, so the
+        cost grows as n log(n) for polygons whose sides are local (such as
+        those of user-supplied regions) instead of as n^2
+
+        Returns
+        -------
+        intersections : list of tuples
+            List of (side A, side B) tuples, with side A > side B, where side i
+            is the side from vertex i to vertex i+1
+
+        """
+        nsides = len(self.x) - 1
+        # need at least 3 sides to have a chance of an intersection
+        if nsides < 3:
+            return []
+        x1 = self.x[:-1]
+        y1 = self.y[:-1]
+        x2 = self.x[1:]
+        y2 = self.y[1:]
+        xmin = np.minimum(x1, x2)
+        xmax = np.maximum(x1, x2)
+        ymin = np.minimum(y1, y2)
+        ymax = np.maximum(y1, y2)
+
+        order = np.argsort(xmin, kind='mergesort')
+        xmin_sorted = xmin[order]
+        intersections = []
+        for k, i in enumerate(order):
+            # Sides that start before side i ends (and after it starts in the
+            # sweep order)
+            kend = np.searchsorted(xmin_sorted, xmax[i], side='right')
+            if kend <= k + 1:
+                continue
+            j = order[k+1:kend]
+            j = j[(ymin[j] <= ymax[i]) & (ymax[j] >= ymin[i])]
+
+            # Skip adjacent sides (including the last and first sides)
+            segA = np.maximum(i, j)
+            segB = np.minimum(i, j)
+            j = j[(segA - segB > 1) & ~((segA == nsides-1) & (segB == 0))]
+            if len(j) == 0:
+                continue
+            hit = _segments_intersect(x1[i], y1[i], x2[i], y2[i], x1[j], y1[j],
+                x2[j], y2[j])
+            for jj in j[hit]:
+                intersections.append((max(i, jj), min(i, jj)))
+
+        return sorted(intersections)
+
+
+    def check_intersections(self):
         """
         Check all segments of the polygon for intersection.
 
         Returns
         -------
         num_intersections : int
-            Number of intersections found
+            Number of intersections found (see find_intersections() for the
+            intersecting sides)
         """
-        num_intersections = 0
-        numpoints = len(self.x)
-        # need at least 4 points to have a chance of an intersection
-        if  numpoints < 4:
-            return 0
-        for segA in xrange(2,numpoints-1):
-            for segB in xrange(segA-1):
-                if segA == numpoints-2 and segB == 0:
-                    continue
-                if _segments_intersect(self.x[segA], self.y[segA], self.x[segA+1], self.y[segA+1],
-                                       self.x[segB], self.y[segB], self.x[segB+1], self.y[segB+1]):
-                    num_intersections += 1
-                    print "Found intersection between lines %d-%d ([%.1f, %.1f]-[%.1f, %.1f]) and %d-%d ([%.1f, %.1f]-[%.1f, %.1f])"%(
-                        segA,segA+1,self.x[segA], self.y[segA], self.x[segA+1], self.y[segA+1],
-                        segB,segB+1,self.x[segB], self.y[segB], self.x[segB+1], self.y[segB+1])
-        return num_intersections
-                
+        return len(self.find_intersections())
+
+
+def rasterize(polygons, shape, offset=(0, 0), include_boundary=True, smalld=1e-12):
+    """
+    Returns a boolean image that is True for pixels inside any of the polygons
+
+    Parameters
+    ----------
+    polygons : list of Polygon objects
+        Polygons to fill
+    shape : tuple of int
+        Shape (nx, ny) of the image
+    offset : tuple of int, optional
+        Coordinates (x, y) of pixel [0, 0]
+    include_boundary : bool, optional
+        If True, pixels on a side of a polygon are considered inside it
+    smalld : float, optional
+        Tolerance within which a pixel is considered to be on a side
+
+    Returns
+    -------
+    mask : array
+        Boolean image
+
+    """
+    mask = np.zeros(shape, dtype=bool)
+    for poly in polygons:
+        if len(polygons) == 1:
+            poly_mask = mask
+        else:
+            poly_mask = np.zeros(shape, dtype=bool)
+        poly._fill(poly_mask, offset, include_boundary, smalld)
+        if poly_mask is not mask:
+            mask |= poly_mask
+
+    return mask
+
+
+def sexagesimal2deg(values, is_ra):
+    """
+    Converts makesourcedb RA or Dec strings to degrees
+
+    This is much faster than astropy's Angle for long lists (e.g., the
+    vertices of the polygons of a region file), but only handles the
+    'hh:mm:ss.s' (RA) and 'dd.mm.ss.s' (Dec) formats
+
+    Parameters
+    ----------
+    values : list of str
+        RA or Dec strings
+    is_ra : bool
+        If True, the values are RAs
+
+    Returns
+    -------
+    deg : array or None
+        Values in degrees, or None if any value is not understood
+
+    """
+    parts = []
+    signs = []
+    try:
+        for v in values:
+            v = v.strip()
+            if is_ra:
+                fields = v.split(':')
+            else:
+                fields = v.replace('.', ':', 2).split(':')
+            if len(fields) != 3:
+                return None
+            signs.append(-1.0 if fields[0].startswith('-') else 1.0)
+            parts.append([abs(float(fields[0])), float(fields[1]), float(fields[2])])
+    except (ValueError, AttributeError):
+        return None
+    parts = np.array(parts, dtype=float).reshape(-1, 3)
+    deg = np.array(signs) * (parts[:, 0] + parts[:, 1] / 60.0 + parts[:, 2] / 3600.0)
+    if is_ra:
+        deg *= 15.0
+
+    return deg
+
+
 def _segments_intersect(Ax, Ay, Bx, By, Cx, Cy, Dx, Dy):
     """
     Check if two line-segments (Ax, Ay) -> (Bx, By) and (Cx, Cy) -> (Dx, Dy)
     intersect within the length on these segments.
 
+    The coordinates of the segments CD may be arrays, in which case segment AB
+    is checked against each of them.
+
     Returns
     -------
-    intersect : bool
+    intersect : bool or array of bool
         True if the two segments intersect, False otherwise.
     """
     # ACD is clockwise:
-    ACD = _det([Ax, Cx, Dx], [Ay, Cy, Dy]) < 0
+    ACD = _det3(Ax, Cx, Dx, Ay, Cy, Dy) < 0
     # BCD is clockwise:
-    BCD = _det([Bx, Cx, Dx], [By, Cy, Dy]) < 0
+    BCD = _det3(Bx, Cx, Dx, By, Cy, Dy) < 0
     # ABC is clockwise:
-    ABC = _det([Ax, Bx, Cx], [Ay, By, Cy]) < 0
+    ABC = _det3(Ax, Bx, Cx, Ay, By, Cy) < 0
     # ABD is clockwise:
-    ABD = _det([Ax, Bx, Dx], [Ay, By, Dy]) < 0
-    return ACD != BCD and ABC != ABD
+    ABD = _det3(Ax, Bx, Dx, Ay, By, Dy) < 0
+    return (ACD != BCD) & (ABC != ABD)
+
+
+def _det3(x0, x1, x2, y0, y1, y2):
+    """
+    Compute twice the area of the triangle defined by three points (see _det())
+
+    The coordinates may be arrays, in which case the area of each triangle is
+    returned
+    """
+    return (y0 * x2 - x0 * y2) + (y1 * x0 - x1 * y0) + (y2 * x1 - x2 * y1)
+
 
 def _det(xvert, yvert):
     """
@@ -3,14 +3,17 @@ Module defining the operation scheduler class
 """
 import logging
 import multiprocessing
+import Queue
 import signal
 import os
 import sys
+import time
 import imp
 import numpy as np
 import shutil
 from collections import Counter
 from factor.lib.context import Timer
+from factor.lib.cost_model import CostModel
 
 log = logging.getLogger('factor:scheduler')
 
@@ -38,7 +41,6 @@ def call_generic_pipeline(op_name, direction_name, parset, config, logbasename,
     """
     from lofarpipe.support.pipelinelogging import getSearchingLogger
     from factor.lib.context import RedirectStdStreams
-    import time
 
     genericpipeline_path = os.path.dirname(genericpipeline_executable)
     loader = imp.load_source('loader', os.path.join(genericpipeline_path,
@@ -62,7 +64,6 @@ def call_generic_pipeline(op_name, direction_name, parset, config, logbasename,
         handler.setLevel(logging.DEBUG)
 
     # Run the pipeline, redirecting screen output to log files
-    time.sleep(2.0) # pause to allow result_callback() to transfer resources
     log.info('<-- Operation {0} started (direction: {1})'.format(op_name,
         direction_name))
     with open("{0}.out.log".format(logbasename), "wb") as out, \
@@ -141,101 +142,200 @@ class Scheduler(object):
                 h_flat.extend(h)
             c = Counter(h_flat)
 
-            for op, h in zip(op_group, hosts):
+            # Weight the ops by their predicted cost, so that the ops that share
+            # a node get CPUs and memory in proportion to it (and hence finish
+            # at about the same time)
+            resource_weights = self.cost_model.get_weights(op_group)
+            fmem_list = []
+            for op, h, w in zip(op_group, hosts, resource_weights):
                 if len(h) == 1:
                     nops_per_node = min(ndir_per_node, c[h[0]])
+                    w_node = sum([w_other for h_other, w_other in zip(hosts,
+                        resource_weights) if h_other == h])
+                    if w_node > 0.0:
+                        share = c[h[0]] / float(nops_per_node) * w / w_node
+                    else:
+                        share = 1.0 / float(nops_per_node)
                 else:
-                    nops_per_node = 1
+                    share = 1.0
                 op.direction.hosts = h
 
                 # Maximum number of normal and IO-intensive processes that the
                 # pipeline should run at once
-                op.direction.max_proc_per_node =  max(1, int(np.ceil(ncpu_max /
-                    float(nops_per_node))))
-                op.direction.max_io_proc_per_node = max(1, int(np.ceil(nthread_io /
-                    float(nops_per_node))))
-
-            # Adjust resources to stay within limits for each node by adding or
-            # subtracting CPUs from the most appropriate operation(s). For now,
-            # we use the size of the facet image to determine the weights
-            resource_weights = [op.direction.facet_imsize if op.direction.facet_imsize is
-                not None else 0.0 for op in op_group]
+                op.direction.max_proc_per_node =  max(1, int(round(ncpu_max *
+                    share)))
+                op.direction.max_io_proc_per_node = max(1, int(round(nthread_io *
+                    share)))
+                fmem_list.append(fmem_max * share)
+
+            # Adjust resources to stay within limits for each node by
+            # subtracting CPUs from the ops with the lowest weights first
+            order = np.argsort(resource_weights)
             j = 0
             while sum([op.direction.max_proc_per_node for op in op_group]) > ncpu_max * len(hosts):
-                op_take = op_group[resource_weights.index(sorted(resource_weights)[j])]
-                op_take.direction.max_proc_per_node -= 1
-                op_take.direction.save_state()
+                op_take = op_group[order[j]]
+                if op_take.direction.max_proc_per_node > 1:
+                    op_take.direction.max_proc_per_node -= 1
                 if j < len(op_group)-1:
                     j += 1
                 else:
                     j = 0
 
-            for op in op_group:
-                # Set maximum number of threads for normal and IO-intensive
-                # multithreaded processes (e.g., DPPP jobs) when run once,
-                # nfiles, and ntimes times per step (the most common cases)
-                op.direction.max_cpus_per_proc_single = op.direction.max_proc_per_node
-                op.direction.max_cpus_per_proc_ntimes = int(np.ceil(
-                    op.direction.max_proc_per_node /
-                    float(min(ntimes, op.direction.max_proc_per_node))))
-                op.direction.max_cpus_per_io_proc_ntimes = int(np.ceil(
-                    op.direction.max_proc_per_node /
-                    float(min(ntimes, op.direction.max_io_proc_per_node))))
-                op.direction.max_cpus_per_proc_nfiles = int(np.ceil(
-                    op.direction.max_proc_per_node /
-                    float(min(nfiles, op.direction.max_proc_per_node))))
-                op.direction.max_cpus_per_io_proc_nfiles = int(np.ceil(
-                    op.direction.max_proc_per_node /
-                    float(min(nfiles, op.direction.max_io_proc_per_node))))
-
-                # Maximum percentage of memory to give to jobs that allow memory
-                # limits (e.g., WSClean jobs)
-                op.direction.max_percent_memory_per_proc_single = (fmem_max /
-                    float(nops_per_node) * 100.0)
-                op.direction.max_percent_memory_per_proc_ntimes = (fmem_max /
-                    float(nops_per_node) * 100.0 /
-                    float(min(ntimes, op.direction.max_proc_per_node)))
-                op.direction.max_percent_memory_per_io_proc_ntimes = (fmem_max /
-                    float(nops_per_node) * 100.0 /
-                    float(min(ntimes, op.direction.max_io_proc_per_node)))
-                op.direction.max_percent_memory_per_proc_nfiles = (fmem_max /
-                    float(nops_per_node) * 100.0 /
-                    float(min(nfiles, op.direction.max_proc_per_node)))
-                op.direction.max_percent_memory_per_io_proc_nfiles = (fmem_max /
-                    float(nops_per_node) * 100.0 /
-                    float(min(nfiles, op.direction.max_io_proc_per_node)))
-
-                # Save the state
-                op.direction.save_state()
+            for op, fmem in zip(op_group, fmem_list):
+                self.set_proc_resources(op, fmem, ntimes, nfiles)
+                predicted_runtime = self.cost_model.predict_runtime(op)
+                if predicted_runtime is not None:
+                    log.debug('Predicted run time of operation {0} (direction: {1}) '
+                        'with {2} CPUs per node: {3:.0f} s'.format(op.name,
+                        op.direction.name, op.direction.max_proc_per_node,
+                        predicted_runtime))
+
+
+    def set_proc_resources(self, op, fmem, ntimes, nfiles):
+        """
+        Set the per-process resources of an operation from its per-node ones
+
+        Parameters
+        ----------
+        op : Operation object
+            Operation for which op.direction.max_proc_per_node and
+            op.direction.max_io_proc_per_node have been set
+        fmem : float
+            Fraction of the memory of each node given to the operation
+        ntimes : int
+            Number of time chunks per band
+        nfiles : int
+            Total number of files
+
+        """
+        # Set maximum number of threads for normal and IO-intensive
+        # multithreaded processes (e.g., DPPP jobs) when run once,
+        # nfiles, and ntimes times per step (the most common cases)
+        op.direction.max_cpus_per_proc_single = op.direction.max_proc_per_node
+        op.direction.max_cpus_per_proc_ntimes = int(np.ceil(
+            op.direction.max_proc_per_node /
+            float(min(ntimes, op.direction.max_proc_per_node))))
+        op.direction.max_cpus_per_io_proc_ntimes = int(np.ceil(
+            op.direction.max_proc_per_node /
+            float(min(ntimes, op.direction.max_io_proc_per_node))))
+        op.direction.max_cpus_per_proc_nfiles = int(np.ceil(
+            op.direction.max_proc_per_node /
+            float(min(nfiles, op.direction.max_proc_per_node))))
+        op.direction.max_cpus_per_io_proc_nfiles = int(np.ceil(
+            op.direction.max_proc_per_node /
+            float(min(nfiles, op.direction.max_io_proc_per_node))))
+
+        # Maximum percentage of memory to give to jobs that allow memory
+        # limits (e.g., WSClean jobs)
+        op.direction.max_percent_memory_per_proc_single = fmem * 100.0
+        op.direction.max_percent_memory_per_proc_ntimes = (fmem * 100.0 /
+            float(min(ntimes, op.direction.max_proc_per_node)))
+        op.direction.max_percent_memory_per_io_proc_ntimes = (fmem * 100.0 /
+            float(min(ntimes, op.direction.max_io_proc_per_node)))
+        op.direction.max_percent_memory_per_proc_nfiles = (fmem * 100.0 /
+            float(min(nfiles, op.direction.max_proc_per_node)))
+        op.direction.max_percent_memory_per_io_proc_nfiles = (fmem * 100.0 /
+            float(min(nfiles, op.direction.max_io_proc_per_node)))
+
+        # Save the state
+        op.direction.save_state()
+
+
+    def rebalance_resources(self, op):
+        """
+        Give the resources that are free on the hosts of an operation to it
+
+        The operation gets all CPUs, IO threads, and memory that the running
+        operations on its hosts do not use, but never less than it was given
+        by allocate_resources()
+
+        Parameters
+        ----------
+        op : Operation object
+            Queued operation that is about to be started
+
+        """
+        ncpu_max = op.parset['cluster_specific']['ncpu']
+        nthread_io = op.parset['cluster_specific']['nthread_io']
+        fmem_max = op.parset['cluster_specific']['wsclean_fmem']
+        nbands = len(op.bands)
+        ntimes = len(op.bands[0].files)
+        nfiles = ntimes * nbands
+
+        # Find the resources used on each host of the op by the running ops
+        ncpu_free = ncpu_max
+        nthread_io_free = nthread_io
+        fmem_free = fmem_max
+        for host in op.direction.hosts:
+            running_ops = [r for r in self.running_ops if host in r.direction.hosts]
+            ncpu_free = min(ncpu_free, ncpu_max - sum([r.direction.max_proc_per_node
+                for r in running_ops]))
+            nthread_io_free = min(nthread_io_free, nthread_io - sum(
+                [r.direction.max_io_proc_per_node for r in running_ops]))
+            fmem_free = min(fmem_free, fmem_max - sum(
+                [r.direction.max_percent_memory_per_proc_single / 100.0
+                for r in running_ops]))
+
+        fmem = op.direction.max_percent_memory_per_proc_single / 100.0
+        if (ncpu_free > op.direction.max_proc_per_node or
+            nthread_io_free > op.direction.max_io_proc_per_node or fmem_free > fmem):
+            op.direction.max_proc_per_node = max(op.direction.max_proc_per_node,
+                ncpu_free)
+            op.direction.max_io_proc_per_node = max(op.direction.max_io_proc_per_node,
+                nthread_io_free)
+            fmem = max(fmem, fmem_free)
+            log.debug('Giving free resources to operation {0} (direction: {1}): '
+                '{2} CPUs, {3} IO threads, and {4:.0f}% of memory per node'.format(
+                op.name, op.direction.name, op.direction.max_proc_per_node,
+                op.direction.max_io_proc_per_node, fmem * 100.0))
+        self.set_proc_resources(op, fmem, ntimes, nfiles)
 
 
     def result_callback(self, result):
         """
         Callback function for apply_async result
+
+        The result is passed to the main thread, which handles it immediately
+        in handle_result()
+        """
+        self.result_queue.put(result)
+
+
+    def handle_result(self, result):
+        """
+        Finalizes a completed operation and starts the next queued one(s)
+
+        Parameters
+        ----------
+        result : tuple
+            Result of call_generic_pipeline()
+
+        Returns
+        -------
+        stop : bool
+            True if an operation failed and cannot be restarted
+
         """
         op_name, direction_name, status = result
 
         # Identify the current operation from the direction name
         try:
-            this_op_indx = [op.direction.name for op in self.operation_list].index(direction_name)
-            this_op =  self.operation_list[this_op_indx]
+            this_op_indx = [op.direction.name for op in self.running_ops].index(direction_name)
+            this_op =  self.running_ops.pop(this_op_indx)
         except ValueError:
             log.warn('Operation {0} (direction: {1}) not in list of active '
                 'operations. This could indicate a problem with the operation'.
                 format(op_name, direction_name))
-            return
-
-        # Reallocate resources
-        if len(self.queued_ops) > 0:
-            # Give the completed op's resources to the next one in line (if any)
-            next_op = self.queued_ops.pop(0)
-            next_op.direction.hosts = this_op.direction.hosts[:]
-            next_op.setup()
+            return False
 
         # Finalize the operation
         if status == 0:
             log.info('--> Operation {0} completed (direction: '
                 '{1})'.format(op_name, direction_name))
+            runtime = time.time() - self.start_times[direction_name]
+            self.timings.append((op_name, direction_name,
+                self.cost_model.predict_runtime(this_op), runtime))
+            self.cost_model.add_timing(this_op, runtime)
             this_op.finalize()
             this_op.set_completed()
         else:
@@ -246,8 +346,38 @@ class Scheduler(object):
             else:
                 log.error('Operation {0} failed due to an error (direction: '
                     '{1})'.format(op_name, direction_name))
-                import thread
-                thread.interrupt_main()
+                return True
+
+        # Give the completed op's hosts to the next one in line (if any), along
+        # with any other resources that are now free on them
+        if len(self.queued_ops) > 0:
+            next_op = self.queued_ops.pop(0)
+            next_op.direction.hosts = this_op.direction.hosts[:]
+            self.rebalance_resources(next_op)
+            self.start_operation(next_op)
+
+        return False
+
+
+    def start_operation(self, op):
+        """
+        Sets up an operation and sends it to the pool
+
+        Parameters
+        ----------
+        op : Operation object
+            Operation to start
+
+        """
+        op.setup()
+        op.set_started()
+        self.running_ops.append(op)
+        self.start_times[op.direction.name] = time.time()
+        self.pool.apply_async(call_generic_pipeline, (op.name,
+            op.direction.name, op.pipeline_parset_file,
+            op.pipeline_config_file, op.logbasename,
+            self.genericpipeline_executable),
+            callback=self.result_callback)
 
 
     def run(self, operation_list):
@@ -264,7 +394,7 @@ class Scheduler(object):
             operation_list = [operation_list]
 
         # Finalize completed ops (so that various attributes are set correctly).
-        # The incomplete ops are finalized when complete in self.result_callback()
+        # The incomplete ops are finalized when complete in self.handle_result()
         if self.dry_run:
             completed_ops = operation_list
         else:
@@ -279,6 +409,11 @@ class Scheduler(object):
 
         # Filter out completed ops
         self.operation_list = [op for op in operation_list if not op.check_completed()]
+        if len(self.operation_list) == 0:
+            return
+        self.cost_model = CostModel(self.operation_list[0].factor_working_dir)
+        self.start_times = {}
+        self.timings = []
 
         # Run the operation(s)
         n_tries = 0
@@ -287,31 +422,30 @@ class Scheduler(object):
             with Timer(log, 'operation'):
                 # change signal-handler so that Keyboard-Interrupts go to the master thread
                 original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
-                pool = multiprocessing.Pool(processes=self.max_procs)
+                self.pool = multiprocessing.Pool(processes=self.max_procs)
                 signal.signal(signal.SIGINT, original_sigint_handler)
+                self.result_queue = Queue.Queue()
+                self.running_ops = []
                 self.queued_ops = self.operation_list[self.max_procs:]
-                process_list = []
-                for op in self.operation_list:
-                    op.setup()
-                    op.set_started()
-                    process_list.append(
-                        pool.apply_async(call_generic_pipeline, (op.name,
-                            op.direction.name, op.pipeline_parset_file,
-                            op.pipeline_config_file, op.logbasename,
-                            self.genericpipeline_executable),
-                            callback=self.result_callback)
-                        )
-                pool.close() #no more new processes will be started
+                for op in self.operation_list[:self.max_procs]:
+                    self.start_operation(op)
                 try:
-                    # We need to wait with a timeout, because otherwise all signals are blocked
-                    # *bleeep*ing python multi-threading/processing
-                    for process in process_list:
-                        while not process.ready():
-                            process.wait(30)
+                    # Handle each result as soon as it arrives. We need to wait
+                    # with a timeout, because otherwise all signals are blocked
+                    while len(self.running_ops) > 0:
+                        try:
+                            result = self.result_queue.get(True, 30)
+                        except Queue.Empty:
+                            continue
+                        if self.handle_result(result):
+                            log.error("Stopping all pipelines.")
+                            self.pool.terminate()
+                            break
                 except KeyboardInterrupt:
                     log.error("Caught an (Keyboard-)Interrupt, stopping all pipelines.")
-                    pool.terminate()
-                pool.join()
+                    self.pool.terminate()
+                self.pool.close() #no more new processes will be started
+                self.pool.join()
 
             # Check for and handle any failed ops
             if not self.success:
@@ -342,6 +476,20 @@ class Scheduler(object):
             else:
                 self.operation_list = []
 
+        self.log_timings()
 
 
-
+    def log_timings(self):
+        """
+        Logs the predicted and actual run times of the completed operations
+        """
+        if len(self.timings) == 0:
+            return
+        log.info('Predicted and actual run times of operations:')
+        for op_name, direction_name, predicted_runtime, runtime in self.timings:
+            if predicted_runtime is not None:
+                predicted = '{0:.0f} s'.format(predicted_runtime)
+            else:
+                predicted = 'n/a'
+            log.info('    {0} (direction: {1}): predicted = {2}, actual = '
+                '{3:.0f} s'.format(op_name, direction_name, predicted, runtime))
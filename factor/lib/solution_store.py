@@ -0,0 +1,536 @@
+"""
+Module that holds the SolutionStore class and functions for its cache
+
+The values of a parmdb are held in dense arrays, one per solution type (e.g.,
+'Gain:Phase' or 'TEC'), of shape (nstations, npols, ntimes, nfreqs), together
+with their axes. A store is exported from a parmdb once and saved to a cache
+file keyed by the parmdb path, size and modification time (see
+factor.lib.cache), so that the scripts that read the same parmdb in one run
+(e.g., to smooth, merge, convert and plot the selfcal solutions) load the
+arrays instead of going through the per-parm dictionaries of getValuesGrid().
+The values are written back to a parmdb only when a parmdb is needed (e.g., by
+a DPPP step).
+"""
+import os
+import shutil
+import json
+import numpy as np
+from factor.lib.cache import get_cache_file, get_file_key, write_cache_file
+
+
+def split_parm_name(name):
+    """
+    Splits a parm name into its solution type, polarization and station
+
+    For example, 'Gain:0:0:Phase:CS001HBA0' gives ('Gain:Phase', '0:0',
+    'CS001HBA0'), 'Clock:1:CS001HBA0' gives ('Clock', '1', 'CS001HBA0') and
+    'TEC:CS001HBA0' gives ('TEC', '', 'CS001HBA0')
+
+    Parameters
+    ----------
+    name : str
+        Parm name
+
+    Returns
+    -------
+    soltype : str
+        Solution type
+    pol : str
+        Polarization ('' if none)
+    station : str
+        Station name
+
+    """
+    parts = name.split(':')
+    station = parts[-1]
+    soltype = ':'.join([p for p in parts[:-1] if not p.isdigit()])
+    pol = ':'.join([p for p in parts[:-1] if p.isdigit()])
+
+    return soltype, pol, station
+
+
+def get_parm_name(soltype, pol, station):
+    """
+    Returns the parm name of a solution type, polarization and station
+
+    This is the inverse of split_parm_name(): the polarization is inserted
+    after the first part of the solution type. For example, ('Gain:Phase',
+    '0:0', 'CS001HBA0') gives 'Gain:0:0:Phase:CS001HBA0'
+
+    Parameters
+    ----------
+    soltype : str
+        Solution type
+    pol : str
+        Polarization ('' if none)
+    station : str
+        Station name
+
+    Returns
+    -------
+    name : str
+        Parm name
+
+    """
+    parts = soltype.split(':')
+    if pol != '':
+        parts = parts[:1] + [pol] + parts[1:]
+
+    return ':'.join(parts + [station])
+
+
+class SolutionStore(object):
+    """
+    Dense, columnar copy of the values of a parmdb
+
+    Parameters
+    ----------
+    parms : dict, optional
+        Dict of parm values as returned by getValuesGrid()
+
+    """
+    def __init__(self, parms=None):
+        self.soltypes = {}
+        self.other_parms = {}
+        if parms is not None:
+            self.add_parms(parms)
+
+
+    def add_parms(self, parms):
+        """
+        Adds parm values to the store
+
+        The values of the parms of a given solution type that share the time
+        and frequency axes of most of them are held in a dense array. Stations
+        and polarizations that are missing from it are filled with NaNs. Parms
+        with other axes (e.g., a station that is missing from some time chunks
+        of a merged parmdb) are held separately. Solution types that are
+        already in the store are replaced
+
+        Parameters
+        ----------
+        parms : dict
+            Dict of parm values as returned by getValuesGrid()
+
+        """
+        groups = {}
+        for name in sorted(parms.keys()):
+            soltype, pol, station = split_parm_name(name)
+            groups.setdefault(soltype, []).append((pol, station, name))
+
+        for soltype, entries in groups.items():
+            for name in list(self.other_parms.keys()):
+                if split_parm_name(name)[0] == soltype:
+                    del self.other_parms[name]
+
+            # Find the axes shared by most parms
+            axes_count = {}
+            for pol, station, name in entries:
+                key = get_axes_key(parms[name])
+                axes_count[key] = axes_count.get(key, 0) + 1
+            dense_key = max(sorted(axes_count.keys()), key=lambda k: axes_count[k])
+            dense_entries = []
+            for pol, station, name in entries:
+                if get_axes_key(parms[name]) == dense_key:
+                    dense_entries.append((pol, station, name))
+                else:
+                    self.other_parms[name] = dict([(axis, np.array(parms[name][axis],
+                        dtype=float)) for axis in ['values', 'times', 'timewidths',
+                        'freqs', 'freqwidths']])
+
+            stations = sorted(set([station for pol, station, name in dense_entries]))
+            pols = sorted(set([pol for pol, station, name in dense_entries]))
+            first = parms[dense_entries[0][2]]
+            values = np.empty((len(stations), len(pols), len(first['times']),
+                len(first['freqs'])))
+            values.fill(np.nan)
+            names = [[''] * len(pols) for station in stations]
+            for pol, station, name in dense_entries:
+                s = stations.index(station)
+                p = pols.index(pol)
+                values[s, p] = parms[name]['values']
+                names[s][p] = name
+            self.soltypes[soltype] = {'values': values, 'stations': stations,
+                'pols': pols, 'names': names,
+                'times': np.array(first['times'], dtype=float),
+                'timewidths': np.array(first['timewidths'], dtype=float),
+                'freqs': np.array(first['freqs'], dtype=float),
+                'freqwidths': np.array(first['freqwidths'], dtype=float)}
+
+
+    def get_soltypes(self):
+        """
+        Returns the solution types in the store
+        """
+        return sorted(self.soltypes.keys())
+
+
+    def get_values(self, soltype):
+        """
+        Returns the values of a solution type
+
+        Parameters
+        ----------
+        soltype : str
+            Solution type (e.g., 'Gain:Phase')
+
+        Returns
+        -------
+        values : array
+            Array of shape (nstations, npols, ntimes, nfreqs). Changes to it are
+            changes to the store. Parms with other axes than those of the array
+            are not included (see add_parms())
+
+        """
+        return self.soltypes[soltype]['values']
+
+
+    def get_axes(self, soltype):
+        """
+        Returns the axes of a solution type
+
+        Parameters
+        ----------
+        soltype : str
+            Solution type (e.g., 'Gain:Phase')
+
+        Returns
+        -------
+        axes : dict
+            Dict with the station names ('stations'), polarizations ('pols'),
+            times and frequencies and their widths ('times', 'timewidths',
+            'freqs', 'freqwidths')
+
+        """
+        return dict([(k, v) for k, v in self.soltypes[soltype].items() if
+            k not in ['values', 'names']])
+
+
+    def set_values(self, soltype, values, axes):
+        """
+        Sets the values of a solution type
+
+        A parm is made for every station and polarization of the array. If the
+        solution type is already in the store, it is replaced (including its
+        parms with other axes)
+
+        Parameters
+        ----------
+        soltype : str
+            Solution type (e.g., 'Gain:Phase')
+        values : array
+            Array of shape (nstations, npols, ntimes, nfreqs)
+        axes : dict
+            Dict of axes as returned by get_axes()
+
+        """
+        for name in list(self.other_parms.keys()):
+            if split_parm_name(name)[0] == soltype:
+                del self.other_parms[name]
+        stations = list(axes['stations'])
+        pols = list(axes['pols'])
+        names = [[get_parm_name(soltype, pol, station) for pol in pols] for
+            station in stations]
+        self.soltypes[soltype] = {'values': np.array(values, dtype=float),
+            'stations': stations, 'pols': pols, 'names': names,
+            'times': np.array(axes['times'], dtype=float),
+            'timewidths': np.array(axes['timewidths'], dtype=float),
+            'freqs': np.array(axes['freqs'], dtype=float),
+            'freqwidths': np.array(axes['freqwidths'], dtype=float)}
+
+
+    def get_names(self):
+        """
+        Returns the names of all parms in the store
+        """
+        names = []
+        for soltype in self.get_soltypes():
+            for station_names in self.soltypes[soltype]['names']:
+                names.extend([name for name in station_names if name != ''])
+        names.extend(sorted(self.other_parms.keys()))
+
+        return names
+
+
+    def to_parms(self):
+        """
+        Returns the values as a dict in the format of getValuesGrid()
+
+        The values of each parm are views of the arrays of the store
+        """
+        parms = {}
+        for soltype, sol in self.soltypes.items():
+            for s, station_names in enumerate(sol['names']):
+                for p, name in enumerate(station_names):
+                    if name == '':
+                        continue
+                    parms[name] = {'values': sol['values'][s, p],
+                        'times': sol['times'], 'timewidths': sol['timewidths'],
+                        'freqs': sol['freqs'], 'freqwidths': sol['freqwidths']}
+        for name, parm in self.other_parms.items():
+            parms[name] = dict(parm)
+
+        return parms
+
+
+    def save(self, filename, key=None):
+        """
+        Saves the store to a file
+
+        Parameters
+        ----------
+        filename : str
+            Filename of the store file (a .npz file)
+        key : tuple, optional
+            Key of the parmdb the store was made from (see factor.lib.cache.get_file_key())
+
+        """
+        meta = {'key': key, 'soltypes': [], 'other_parms': sorted(self.other_parms.keys())}
+        arrays = {}
+        for i, soltype in enumerate(self.get_soltypes()):
+            sol = self.soltypes[soltype]
+            meta['soltypes'].append({'soltype': soltype, 'stations': sol['stations'],
+                'pols': sol['pols'], 'names': sol['names']})
+            for axis in ['values', 'times', 'timewidths', 'freqs', 'freqwidths']:
+                arrays['{0}_{1}'.format(axis, i)] = sol[axis]
+        for i, name in enumerate(meta['other_parms']):
+            for axis in ['values', 'times', 'timewidths', 'freqs', 'freqwidths']:
+                arrays['other_{0}_{1}'.format(axis, i)] = self.other_parms[name][axis]
+        arrays['meta'] = np.array(json.dumps(meta))
+
+        write_cache_file(filename, lambda f: np.savez(f, **arrays))
+
+
+    def write_parmdb(self, parmdb_name, cache_dir=None, use_cache=True,
+        gap_factor=1.1):
+        """
+        Writes the store to a new parmdb
+
+        The values of each solution type are added with one call per time
+        segment between gaps (see add_values_by_segment())
+
+        Parameters
+        ----------
+        parmdb_name : str
+            Filename of output parmdb. An existing parmdb of this name is
+            overwritten
+        cache_dir : str, optional
+            Directory that holds the store files. If None, the directory of the
+            parmdb is used
+        use_cache : bool, optional
+            If True, the store is also saved as the store file of the new
+            parmdb, so that later reads of it do not need to read the parmdb
+        gap_factor : float, optional
+            Separation, in units of the time width, above which there is a gap
+            (see get_time_segments())
+
+        """
+        import lofar.parmdb
+
+        if os.path.exists(parmdb_name):
+            shutil.rmtree(parmdb_name)
+        pdb = lofar.parmdb.parmdb(parmdb_name, create=True)
+        for soltype, sol in self.soltypes.items():
+            values = {}
+            for s, station_names in enumerate(sol['names']):
+                for p, name in enumerate(station_names):
+                    if name != '':
+                        values[name] = sol['values'][s, p]
+            add_values_by_segment(pdb, values, sol['freqs'], sol['freqwidths'],
+                sol['times'], sol['timewidths'], gap_factor=gap_factor)
+        for name, parm in self.other_parms.items():
+            add_values_by_segment(pdb, {name: parm['values']}, parm['freqs'],
+                parm['freqwidths'], parm['times'], parm['timewidths'],
+                gap_factor=gap_factor)
+        pdb.flush()
+        del pdb
+
+        if use_cache:
+            self.save_for_parmdb(parmdb_name, cache_dir)
+
+
+    def save_for_parmdb(self, parmdb_name, cache_dir=None):
+        """
+        Saves the store as the store file of a parmdb
+
+        The parmdb must hold the same values as the store (e.g., because it
+        was just written from them) and must be closed
+
+        Parameters
+        ----------
+        parmdb_name : str
+            Filename of parmdb
+        cache_dir : str, optional
+            Directory that holds the store files. If None, the directory of the
+            parmdb is used
+
+        """
+        store_file = get_cache_file(parmdb_name, 'solution_store', 'npz', cache_dir)
+        self.save(store_file, get_file_key(parmdb_name))
+
+
+def get_axes_key(parm):
+    """
+    Returns a key that is equal for parms with the same time and frequency axes
+    """
+    return tuple([tuple(np.asarray(parm[axis], dtype=float).tolist()) for axis in
+        ['times', 'timewidths', 'freqs', 'freqwidths']])
+
+
+def get_time_segments(times, timewidths, gap_factor=2.0):
+    """
+    Returns the time segments that are separated by gaps
+
+    A gap is present between two successive times if they are separated by
+    more than gap_factor times the width of the first one
+
+    Parameters
+    ----------
+    times : array
+        Times of the solutions
+    timewidths : array
+        Widths of the solution times
+    gap_factor : float, optional
+        Separation, in units of the time width, above which there is a gap
+
+    Returns
+    -------
+    segments : list of tuples
+        List of (start index, end index (exclusive)) tuples, one per segment
+
+    """
+    times = np.asarray(times)
+    timewidths = np.asarray(timewidths)
+    delta_times = times[1:] - times[:-1]
+    gaps_ind = np.where(delta_times > timewidths[:-1]*gap_factor)[0] + 1
+    starts = [0] + gaps_ind.tolist()
+    ends = gaps_ind.tolist() + [len(times)]
+
+    return zip(starts, ends)
+
+
+def add_values_by_segment(pdb, values, freqs, freqwidths, times, timewidths,
+    gap_factor=2.0):
+    """
+    Adds the values of many parms to a parmdb, one call per time segment
+
+    Parms cannot be added across a gap in time (frequency gaps are not
+    allowed), so the values of all parms are added together for each
+    segment between gaps (see get_time_segments())
+
+    Parameters
+    ----------
+    pdb : parmdb object
+        Parmdb to which the values are added (it is not flushed)
+    values : dict
+        Dict of {parm name: array of shape (ntimes, nfreqs)}. All parms must
+        have the given time and frequency axes
+    freqs : array
+        Frequencies of the values
+    freqwidths : array
+        Widths of the frequencies
+    times : array
+        Times of the values
+    timewidths : array
+        Widths of the times
+    gap_factor : float, optional
+        Separation, in units of the time width, above which there is a gap
+
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    freqwidths = np.asarray(freqwidths, dtype=float)
+    times = np.asarray(times, dtype=float)
+    timewidths = np.asarray(timewidths, dtype=float)
+    for start, end in get_time_segments(times, timewidths, gap_factor):
+        parms = {}
+        for name, parm_values in values.items():
+            parms[str(name)] = {'values': np.asarray(parm_values[start:end], dtype=float),
+                'freqs': freqs, 'freqwidths': freqwidths,
+                'times': times[start:end], 'timewidths': timewidths[start:end]}
+        pdb.addValues(parms)
+
+
+def read_store_file(filename):
+    """
+    Reads a store file
+
+    Parameters
+    ----------
+    filename : str
+        Filename of the store file
+
+    Returns
+    -------
+    store : SolutionStore object
+        The store
+    key : tuple or None
+        Key of the parmdb the store was made from
+
+    """
+    store = SolutionStore()
+    data = np.load(filename)
+    try:
+        meta = json.loads(str(data['meta']))
+        for i, sol_meta in enumerate(meta['soltypes']):
+            sol = {'stations': [str(s) for s in sol_meta['stations']],
+                'pols': [str(p) for p in sol_meta['pols']],
+                'names': [[str(n) for n in station_names] for station_names in
+                sol_meta['names']]}
+            for axis in ['values', 'times', 'timewidths', 'freqs', 'freqwidths']:
+                sol[axis] = data['{0}_{1}'.format(axis, i)]
+            store.soltypes[str(sol_meta['soltype'])] = sol
+        for i, name in enumerate(meta['other_parms']):
+            store.other_parms[str(name)] = dict([(axis, data['other_{0}_{1}'.format(axis, i)])
+                for axis in ['values', 'times', 'timewidths', 'freqs', 'freqwidths']])
+    finally:
+        data.close()
+    key = meta['key']
+    if key is not None:
+        key = tuple(key)
+
+    return store, key
+
+
+def load_solutions(parmdb_name, cache_dir=None, use_cache=True):
+    """
+    Returns the solution store of a parmdb, using its store file if possible
+
+    If no up-to-date store file exists for the parmdb, the parmdb is read and
+    a new store file is saved
+
+    Parameters
+    ----------
+    parmdb_name : str
+        Filename of parmdb
+    cache_dir : str, optional
+        Directory that holds the store files. If None, the directory of the
+        parmdb is used
+    use_cache : bool, optional
+        If False, the store file is neither read nor written
+
+    Returns
+    -------
+    store : SolutionStore object
+        The solution store
+
+    """
+    if use_cache:
+        key = get_file_key(parmdb_name)
+        store_file = get_cache_file(parmdb_name, 'solution_store', 'npz', cache_dir)
+        if os.path.exists(store_file):
+            try:
+                store, cached_key = read_store_file(store_file)
+                if cached_key == key:
+                    return store
+            except Exception:
+                pass
+
+    import lofar.parmdb
+    pdb = lofar.parmdb.parmdb(parmdb_name)
+    store = SolutionStore(pdb.getValuesGrid('*'))
+    del pdb
+
+    if use_cache:
+        store.save_for_parmdb(parmdb_name, cache_dir)
+
+    return store
@@ -25,6 +25,7 @@ FacetPeelImage:  Operation
 import os
 import ast
 from factor.lib.operation import Operation
+from factor.lib.baselines import get_baseline_cache_dir
 from factor.operations.outlier_ops import OutlierPeel
 from lofarpipe.support.data_map import DataMap
 
@@ -117,8 +118,11 @@ class FacetSelfcal(Operation):
                                 'initial_selfcal_parset': initial_selfcal_parset,
                                 'selfcal_caltype': selfcal_caltype,
                                 'fourpol': fourpol,
+                                'defer_selfcal_images': self.parset['calibration_specific']['defer_selfcal_images'],
                                 'loopcount': loopcount,
-                                'smooth_amps_task': smooth_amps_task})
+                                'smooth_amps_task': smooth_amps_task,
+                                'pre_average_max_memory_gb': self.parset['cluster_specific']['pre_average_max_memory_gb'],
+                                'baseline_cache_dir': get_baseline_cache_dir(self.factor_working_dir)})
 
     def finalize(self):
         """
@@ -423,13 +423,23 @@ def get_calibration_options(parset):
     else:
         parset_dict['solve_all_correlations_flux_jy'] = 1000.0
 
+    # Defer making the pngs of the selfcal images until they are viewed with
+    # checkfactor (default = False). If True, the selfcal images are not
+    # rendered at the end of selfcal, which saves time when there are many
+    # directions
+    if 'defer_selfcal_images' in parset_dict:
+        parset_dict['defer_selfcal_images'] = parset.getboolean('calibration',
+            'defer_selfcal_images')
+    else:
+        parset_dict['defer_selfcal_images'] = False
+
     # Check for unused options
     allowed_options = ['exit_on_selfcal_failure', 'skip_selfcal_check',
         'preapply_first_cal_phases', 'target_max_selfcal_loops',
         'max_selfcal_loops', 'preaverage_flux_jy', 'multiscale_selfcal',
         'multires_selfcal', 'tec_block_mhz', 'peel_flux_jy',
         'solve_min_uv_lambda', 'spline_smooth2d',
-        'solve_all_correlations_flux_jy']
+        'solve_all_correlations_flux_jy', 'defer_selfcal_images']
     for option in given_options:
         if option not in allowed_options:
             log.warning('Option "{}" was given in the [calibration] section of the '
@@ -947,10 +957,20 @@ def get_cluster_options(parset):
     if 'dir_local_selfcal' not in parset_dict:
         parset_dict['dir_local_selfcal'] = parset_dict['dir_local']
 
+    # Maximum memory in GB that each pre-averaging job may use for the data. If
+    # set, the data are read and written in blocks to stay within this limit,
+    # otherwise they are all read into memory at once (default = None)
+    if 'pre_average_max_memory_gb' in parset_dict:
+        parset_dict['pre_average_max_memory_gb'] = parset.getfloat('cluster',
+            'pre_average_max_memory_gb')
+    else:
+        parset_dict['pre_average_max_memory_gb'] = None
+
     # Check for unused options
     allowed_options = ['ncpu', 'fmem', 'wsclean_fmem', 'ndir_per_node',
         'clusterdesc_file', 'cluster_type', 'dir_local', 'dir_local_selfcal',
-        'node_list', 'lofarroot', 'lofarpythonpath', 'nthread_io']
+        'node_list', 'lofarroot', 'lofarpythonpath', 'nthread_io',
+        'pre_average_max_memory_gb']
     for option in given_options:
         if option not in allowed_options:
             log.warning('Option "{}" was given in the [cluster] section of the '
@@ -11,7 +11,7 @@ import os
 
 
 def main(ms1, ms2, column1, column2, column_out, op='add',in_memory=True,
-    use_compression=False):
+    use_compression=False, chunked=False, rows_per_block=50000):
     """
     Add/subtract columns (column_out = column1 +/- column2)
 
@@ -34,6 +34,11 @@ def main(ms1, ms2, column1, column2, column_out, op='add',in_memory=True,
         If True, do the operation in memory rather than with taql
     use_compression : bool, optional
         If True, use Dysco compression
+    chunked : bool, optional
+        If True, do the operation in blocks of rows_per_block rows (overrides
+        in_memory)
+    rows_per_block : int, optional
+        Number of rows per block when chunked = True
 
     """
     if type(in_memory) is str:
@@ -46,35 +51,33 @@ def main(ms1, ms2, column1, column2, column_out, op='add',in_memory=True,
             use_compression = True
         else:
             use_compression = False
+    if type(chunked) is str:
+        if chunked.lower() == 'true':
+            chunked = True
+        else:
+            chunked = False
+    rows_per_block = int(rows_per_block)
 
     # Add the output column to ms1 if needed
     t1 = pt.table(ms1, readonly=False, ack=False)
-    desc = t1.getcoldesc(column1)
-    if column_out not in t1.colnames():
-        if use_compression:
-            # Set DyscoStMan to be storage manager
-            # We use a visibility bit rate of 16 and truncation of 1.5 sigma to keep the
-            # compression noise below ~ 0.01 mJy, as estimated from Fig 4 of
-            # Offringa (2016). For the weights, we use a bit rate of 12, as
-            # recommended in Sec 4.4 of Offringa (2016)
-            desc['name'] = column_out
-            dmi = {
-                'SPEC': {
-                    'dataBitCount': np.uint32(16),
-                    'distribution': 'TruncatedGaussian',
-                    'distributionTruncation': 1.5,
-                    'normalization': 'RF',
-                    'weightBitCount': np.uint32(12)},
-                'NAME': '{}_dm'.format(column_out),
-                'SEQNR': 1,
-                'TYPE': 'DyscoStMan'}
-            desc['option'] = 1 # make a Direct column
-            t1.addcols(desc, dmi)
-        else:
-            desc['name'] = column_out
-            t1.addcols(desc)
+    add_output_column(t1, column1, column_out, use_compression)
 
-    if in_memory:
+    if chunked:
+        # Add or subtract columns in blocks of rows
+        if op.lower() not in ['add', 'subtract', 'subtract12', 'subtract21']:
+            print('Operation not understood. Must be either "add" or "subtract[12,21]"')
+            sys.exit(1)
+        if ms1 == ms2:
+            t2 = t1
+        else:
+            t2 = pt.table(ms2, ack=False)
+        add_subtract_blocks(t1, t2, column1, column2, column_out, op.lower(),
+            use_compression, rows_per_block)
+        if t2 is not t1:
+            t2.close()
+        t1.flush()
+        t1.close()
+    elif in_memory:
         # Add or subtract columns in memory
         data1 = t1.getcol(column1)
         if ms1 == ms2:
@@ -129,6 +132,114 @@ def main(ms1, ms2, column1, column2, column_out, op='add',in_memory=True,
                 ms1, ms2, column_out, column1, op_sym, column2))
 
 
+def add_output_column(t, column_in, column_out, use_compression=False, t_in=None):
+    """
+    Adds an output column with the description of column_in, if needed
+
+    Parameters
+    ----------
+    t : table
+        Table to which the output column is added
+    column_in : str
+        Name of column whose description is used
+    column_out : str
+        Name of output column
+    use_compression : bool, optional
+        If True, use Dysco compression
+    t_in : table, optional
+        Table that holds column_in. If None, t is used
+
+    """
+    if column_out in t.colnames():
+        return
+    if t_in is None:
+        t_in = t
+    desc = t_in.getcoldesc(column_in)
+    desc['name'] = column_out
+    if use_compression:
+        # Set DyscoStMan to be storage manager
+        # We use a visibility bit rate of 16 and truncation of 1.5 sigma to keep the
+        # compression noise below ~ 0.01 mJy, as estimated from Fig 4 of
+        # Offringa (2016). For the weights, we use a bit rate of 12, as
+        # recommended in Sec 4.4 of Offringa (2016)
+        dmi = {
+            'SPEC': {
+                'dataBitCount': np.uint32(16),
+                'distribution': 'TruncatedGaussian',
+                'distributionTruncation': 1.5,
+                'normalization': 'RF',
+                'weightBitCount': np.uint32(12)},
+            'NAME': '{}_dm'.format(column_out),
+            'SEQNR': 1,
+            'TYPE': 'DyscoStMan'}
+        desc['option'] = 1 # make a Direct column
+        t.addcols(desc, dmi)
+    else:
+        t.addcols(desc)
+
+
+def add_subtract_blocks(t1, t2, column1, column2, column_out, op, use_compression,
+    rows_per_block):
+    """
+    Add/subtract columns in blocks of rows
+
+    Each block is read into preallocated buffers and the result is computed in
+    place in the column-1 buffer
+
+    Parameters
+    ----------
+    t1 : table
+        Table from which column 1 is taken and to which the output is written
+    t2 : table
+        Table from which column 2 is taken (may be t1)
+    column1 : str
+        Name of column 1
+    column2 : str
+        Name of column 2
+    column_out : str
+        Name of output column (written to t1)
+    op : str
+        Operation to perform: 'add', 'subtract12', or 'subtract21'
+    use_compression : bool
+        If True, set flagged values to NaN (needed for Dysco compression)
+    rows_per_block : int
+        Number of rows per block
+
+    """
+    nrows = t1.nrows()
+    if nrows == 0:
+        return
+    rows_per_block = max(1, min(rows_per_block, nrows))
+    cell = t1.getcell(column1, 0)
+    data1_buf = np.empty((rows_per_block,) + cell.shape, dtype=cell.dtype)
+    data2_buf = np.empty((rows_per_block,) + cell.shape, dtype=t2.getcell(column2, 0).dtype)
+    if use_compression:
+        flags_buf = np.empty((rows_per_block,) + cell.shape, dtype=bool)
+
+    for startrow in range(0, nrows, rows_per_block):
+        nrow = min(rows_per_block, nrows - startrow)
+        data1 = data1_buf[:nrow]
+        data2 = data2_buf[:nrow]
+        t1.getcolnp(column1, data1, startrow=startrow, nrow=nrow)
+        t2.getcolnp(column2, data2, startrow=startrow, nrow=nrow)
+
+        if use_compression:
+            # Replace flagged values with NaNs before compression
+            flags = flags_buf[:nrow]
+            t1.getcolnp('FLAG', flags, startrow=startrow, nrow=nrow)
+            data1[flags] = np.nan
+            data2[flags] = np.nan
+
+        if op == 'add':
+            np.add(data1, data2, out=data1)
+        elif op == 'subtract12' or op == 'subtract':
+            np.subtract(data1, data2, out=data1)
+        else:
+            np.subtract(data2, data1, out=data1)
+
+        t1.putcol(column_out, data1, startrow=startrow, nrow=nrow)
+
+
 if __name__ == '__main__':
     descriptiontext = "Add/subtract columns (column_out = column1 +/- column2).\n"
 
@@ -140,6 +251,11 @@ if __name__ == '__main__':
     parser.add_argument('column_out', help='name of the output column (written to ms1)')
     parser.add_argument('op', help='operation: "add" or "subtract"')
     parser.add_argument('in_memory', help='do operation in memory')
+    parser.add_argument('-c', '--chunked', help='do operation in blocks of rows',
+        action='store_true', default=False)
+    parser.add_argument('-b', '--rows_per_block', help='number of rows per block',
+        type=int, default=50000)
     args = parser.parse_args()
 
-    main(args.ms1, args.ms2, args.column1, args.column2, args.column_out, args.op, args.in_memory)
+    main(args.ms1, args.ms2, args.column1, args.column2, args.column_out, args.op, args.in_memory,
+        chunked=args.chunked, rows_per_block=args.rows_per_block)
@@ -9,7 +9,9 @@ import sys
 import os
 import pickle
 import glob
+import shutil
 from factor.lib.polygon import Polygon
+from factor.lib.image_io import open_fits, get_row_tiles, get_polygon_mask
 from astropy.io import fits as pyfits
 from astropy import wcs
 
@@ -84,32 +86,19 @@ def main(input_image_file, vertices_file, output_image_file, blank_value='zero',
     poly = Polygon(xvert, yvert)
 
     for input_image, output_image in zip(input_image_files, output_image_files):
-        hdu = pyfits.open(input_image, memmap=False)
+        # Blank the output image in place, in tiles of rows, so that the
+        # image is never held in memory
+        if os.path.abspath(input_image) != os.path.abspath(output_image):
+            shutil.copyfile(input_image, output_image)
+        hdu = open_fits(output_image, readonly=False)
         data = hdu[0].data
 
-        # Find limits of facet poly and blank pixels outside them
-        xmin = max(int(np.min(xvert)) - 2, 0)
-        xmax = min(int(np.max(xvert)) + 2, data.shape[2])
-        ymin = max(int(np.min(yvert)) - 2, 0)
-        ymax = min(int(np.max(yvert)) + 2, data.shape[3])
-        data[0, 0, :, :ymin] = blank_val
-        data[0, 0, :, ymax:] = blank_val
-        data[0, 0, :xmin, :] = blank_val
-        data[0, 0, xmax:, :] = blank_val
-
-        # Find distance to nearest poly edge and blank those that
-        # are outside the facet (dist < 0)
-        pix_ind = np.indices((xmax-xmin, ymax-ymin))
-        pix_ind[0] += xmin
-        pix_ind[1] += ymin
-        dist = poly.is_inside(pix_ind[0], pix_ind[1])
-        outside_ind = np.where(dist < 0.0)
-        if len(outside_ind[0]) > 0:
-            data[0, 0, pix_ind[0][outside_ind], pix_ind[1][outside_ind]] = blank_val
-
-        hdu[0].data = data
-        hdu.writeto(output_image, clobber=True)
-
+        # Blank pixels that are outside the facet (pixels on the edge of the
+        # facet are kept)
+        for r0, r1 in get_row_tiles(data.shape[2]):
+            inside = get_polygon_mask(poly, r0, r1, data.shape[3])
+            data[0, 0, r0:r1][~inside] = blank_val
+        hdu.close()
 
 if __name__ == '__main__':
     descriptiontext = "Blank regions of an image.\n"
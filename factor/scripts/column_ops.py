@@ -0,0 +1,215 @@
+#! /usr/bin/env python
+"""
+Script to evaluate several add/subtract column expressions in a single pass
+"""
+import argparse
+from argparse import RawTextHelpFormatter
+import casacore.tables as pt
+import numpy as np
+import re
+import sys
+from factor.scripts.add_subtract_columns import add_output_column
+
+
+def main(ms1, expressions, ms2=None, use_compression=False, rows_per_block=50000):
+    """
+    Evaluate add/subtract column expressions in a single pass over an MS
+
+    The expressions have the form 'OUT = A - B + t2.C', where columns prefixed
+    with 't2.' are taken from ms2 and all other columns from ms1. Each input
+    column is read only once per block, however many expressions use it. All
+    expressions are evaluated on the input values as they were before the
+    call, even if an output column is also used as an input
+
+    Parameters
+    ----------
+    ms1 : str
+        Name of MS file that receives the output columns
+    expressions : str or list
+        List of expressions, or string of expressions separated by ';'
+    ms2 : str, optional
+        Name of MS file from which the 't2.' columns are taken. If None, ms1
+        is used
+    use_compression : bool, optional
+        If True, use Dysco compression for new output columns
+    rows_per_block : int, optional
+        Number of rows per block
+
+    """
+    if type(use_compression) is str:
+        if use_compression.lower() == 'true':
+            use_compression = True
+        else:
+            use_compression = False
+    rows_per_block = int(rows_per_block)
+    if type(ms2) is str and ms2.lower() == 'none':
+        ms2 = None
+
+    try:
+        parsed_expressions = parse_expressions(expressions)
+    except ValueError as e:
+        print(str(e))
+        sys.exit(1)
+
+    t1 = pt.table(ms1, readonly=False, ack=False)
+    if ms2 is None or ms2 == ms1:
+        t2 = t1
+    else:
+        t2 = pt.table(ms2, ack=False)
+    tables = [t1, t2]
+
+    # Add the output columns to ms1 if needed, using the description of the
+    # first input column of each expression
+    for column_out, terms in parsed_expressions:
+        sign, tindx, column = terms[0]
+        add_output_column(t1, column, column_out, use_compression, t_in=tables[tindx])
+
+    column_ops_blocks(tables, parsed_expressions, use_compression, rows_per_block)
+
+    if t2 is not t1:
+        t2.close()
+    t1.flush()
+    t1.close()
+
+
+def parse_expressions(expressions):
+    """
+    Parses add/subtract column expressions
+
+    Parameters
+    ----------
+    expressions : str or list
+        List of expressions, or string of expressions separated by ';'
+
+    Returns
+    -------
+    parsed_expressions : list
+        List of (column_out, terms) tuples, where terms is a list of (sign,
+        table index, column) tuples. The table index is 0 for ms1 and 1 for
+        ms2
+
+    """
+    if type(expressions) is str:
+        expressions = expressions.strip('[]').split(';')
+    name = r'(?:t2\.)?[A-Za-z_][A-Za-z0-9_]*'
+    term_pattern = re.compile(r'([+-]?)({0})'.format(name))
+    rhs_pattern = re.compile(r'^[+-]?{0}(?:[+-]{0})*$'.format(name))
+
+    parsed_expressions = []
+    for expression in expressions:
+        expression = expression.strip(' \'\"')
+        if expression == '':
+            continue
+        if expression.count('=') != 1:
+            raise ValueError('Expression "{}" not understood. Must be of the form '
+                '"OUT = A - B + t2.C"'.format(expression))
+        column_out, rhs = [s.replace(' ', '') for s in expression.split('=')]
+        if (not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', column_out) or
+            not rhs_pattern.match(rhs)):
+            raise ValueError('Expression "{}" not understood. Must be of the form '
+                '"OUT = A - B + t2.C"'.format(expression))
+        terms = []
+        for sign, column in term_pattern.findall(rhs):
+            if column.startswith('t2.'):
+                terms.append((sign != '-', 1, column[3:]))
+            else:
+                terms.append((sign != '-', 0, column))
+        parsed_expressions.append((column_out, terms))
+
+    if len(parsed_expressions) == 0:
+        raise ValueError('No expressions given')
+
+    return parsed_expressions
+
+
+def column_ops_blocks(tables, parsed_expressions, use_compression, rows_per_block):
+    """
+    Evaluates add/subtract column expressions in blocks of rows
+
+    Each input column is read once per block into a preallocated buffer and
+    the outputs of all expressions are computed from these buffers
+
+    Parameters
+    ----------
+    tables : list
+        List of [t1, t2] tables. The outputs are written to t1 (t2 may be t1)
+    parsed_expressions : list
+        List of (column_out, terms) tuples (see parse_expressions())
+    use_compression : bool
+        If True, set flagged values to NaN (needed for Dysco compression)
+    rows_per_block : int
+        Number of rows per block
+
+    """
+    t1 = tables[0]
+    nrows = t1.nrows()
+    if nrows == 0:
+        return
+    rows_per_block = max(1, min(rows_per_block, nrows))
+
+    # Find the input columns, each of which is read only once per block
+    inputs = []
+    for column_out, terms in parsed_expressions:
+        for sign, tindx, column in terms:
+            if (tindx, column) not in inputs:
+                inputs.append((tindx, column))
+
+    input_buf = {}
+    for tindx, column in inputs:
+        cell = tables[tindx].getcell(column, 0)
+        input_buf[(tindx, column)] = np.empty((rows_per_block,) + cell.shape,
+            dtype=cell.dtype)
+    output_buf = []
+    for column_out, terms in parsed_expressions:
+        output_buf.append(np.empty_like(input_buf[terms[0][1:]]))
+    if use_compression:
+        flags_buf = np.empty(input_buf[inputs[0]].shape, dtype=bool)
+
+    columns_out = [column_out for column_out, terms in parsed_expressions]
+    for startrow in range(0, nrows, rows_per_block):
+        nrow = min(rows_per_block, nrows - startrow)
+        input_data = dict((k, v[:nrow]) for k, v in input_buf.items())
+        output_data = [v[:nrow] for v in output_buf]
+
+        for (tindx, column), data in input_data.items():
+            tables[tindx].getcolnp(column, data, startrow=startrow, nrow=nrow)
+        if use_compression:
+            # Replace flagged values with NaNs before compression
+            flags = flags_buf[:nrow]
+            t1.getcolnp('FLAG', flags, startrow=startrow, nrow=nrow)
+            for data in input_data.values():
+                data[flags] = np.nan
+
+        for (column_out, terms), out in zip(parsed_expressions, output_data):
+            sign, tindx, column = terms[0]
+            if sign:
+                np.copyto(out, input_data[(tindx, column)])
+            else:
+                np.negative(input_data[(tindx, column)], out=out)
+            for sign, tindx, column in terms[1:]:
+                if sign:
+                    np.add(out, input_data[(tindx, column)], out=out)
+                else:
+                    np.subtract(out, input_data[(tindx, column)], out=out)
+
+        for column_out, out in zip(columns_out, output_data):
+            t1.putcol(column_out, out, startrow=startrow, nrow=nrow)
+
+
+if __name__ == '__main__':
+    descriptiontext = "Evaluate add/subtract column expressions in a single pass.\n"
+
+    parser = argparse.ArgumentParser(description=descriptiontext, formatter_class=RawTextHelpFormatter)
+    parser.add_argument('ms1', help='name of MS file that receives the output columns')
+    parser.add_argument('expressions', help='expressions separated by ";" (e.g. '
+        '"OUT1 = A - B; OUT2 = A + t2.C")')
+    parser.add_argument('-m', '--ms2', help='name of MS file for the "t2." columns',
+        default=None)
+    parser.add_argument('-z', '--use_compression', help='use Dysco compression',
+        action='store_true', default=False)
+    parser.add_argument('-b', '--rows_per_block', help='number of rows per block',
+        type=int, default=50000)
+    args = parser.parse_args()
+
+    main(args.ms1, args.expressions, ms2=args.ms2, use_compression=args.use_compression,
+        rows_per_block=args.rows_per_block)
@@ -8,6 +8,7 @@ import lofar.parmdb as lp
 import numpy as np
 import sys
 import os
+from factor.lib.solution_store import add_values_by_segment, load_solutions, SolutionStore
 
 
 def main(fast_parmdb, slow_parmdb, output_file, freqstep=1, preapply_parmdb=None):
@@ -30,17 +31,21 @@ def main(fast_parmdb, slow_parmdb, output_file, freqstep=1, preapply_parmdb=None
     """
     freqstep = int(freqstep)
 
+    # Read the solutions on their own grids, using their store files if
+    # possible. The parmdbs are still opened to get the values on the final
+    # grid below
+    fast_solstore = load_solutions(fast_parmdb)
+    fast_soldict = fast_solstore.to_parms()
+    slow_soldict = load_solutions(slow_parmdb).to_parms()
     fast_pdb = lp.parmdb(fast_parmdb)
-    fast_soldict = fast_pdb.getValuesGrid('*')
     slow_pdb = lp.parmdb(slow_parmdb)
-    slow_soldict = slow_pdb.getValuesGrid('*')
     output_pdb = lp.parmdb(output_file, create=True)
     if preapply_parmdb is not None:
+        preapply_soldict = load_solutions(preapply_parmdb).to_parms()
         preapply_pdb = lp.parmdb(preapply_parmdb)
-        preapply_soldict = preapply_pdb.getValuesGrid('*')
 
     # Get various quantities over which we must iterate
-    station_names = list(set([s.split(':')[-1] for s in fast_pdb.getNames()]))
+    station_names = list(set([s.split(':')[-1] for s in fast_solstore.get_names()]))
     fast_times = fast_soldict['CommonScalarPhase:{s}'.format(s=station_names[0])]['times']
     fast_timewidths = fast_soldict['CommonScalarPhase:{s}'.format(s=station_names[0])]['timewidths']
     fast_timestep = np.mean(fast_timewidths)
@@ -97,16 +102,8 @@ def main(fast_parmdb, slow_parmdb, output_file, freqstep=1, preapply_parmdb=None
     slow_soldict = slow_pdb.getValues('*', final_freqs, final_freqwidths, fast_times,
         fast_timewidths, asStartEnd=False)
 
-    # Identify any gaps in time (frequency gaps are not allowed), as we need to handle
-    # each section separately if gaps are present
-    delta_times = fast_times[1:] - fast_times[:-1]
-    gaps = np.where(delta_times > fast_timewidths[:-1]*2.)
-    if len(gaps[0]) > 0:
-        gaps_ind = gaps[0] + 1
-    else:
-        gaps_ind = []
-
     # Add various phase and amp corrections together
+    values = {}
     for station in station_names:
         fast_phase = np.copy(fast_soldict['CommonScalarPhase:{s}'.format(s=station)]['values'])
         tec = np.copy(fast_soldict['TEC:{s}'.format(s=station)]['values'])
@@ -133,23 +130,25 @@ def main(fast_parmdb, slow_parmdb, output_file, freqstep=1, preapply_parmdb=None
             total_phase = np.where(np.logical_or(fast_phase == 0.0, tec_phase == 0.0), np.nan, total_phase)
             total_amp = np.where(np.logical_or(fast_phase == 0.0, tec_phase == 0.0), np.nan, total_amp)
 
-            g_start = 0
-            for g in gaps_ind:
-                # If time gaps exist, add them one-by-one (except for last one)
-                output_pdb.addValues('Gain:'+pol+':Phase:{}'.format(station), total_phase[g_start:g], final_freqs, final_freqwidths,
-                    fast_times[g_start:g], fast_timewidths[g_start:g], asStartEnd=False)
-                output_pdb.addValues('Gain:'+pol+':Ampl:{}'.format(station), total_amp[g_start:g], final_freqs, final_freqwidths,
-                    fast_times[g_start:g], fast_timewidths[g_start:g], asStartEnd=False)
-                g_start = g
-
-            # Add remaining time slots
-            output_pdb.addValues('Gain:'+pol+':Phase:{}'.format(station), total_phase[g_start:], final_freqs, final_freqwidths,
-                fast_times[g_start:], fast_timewidths[g_start:], asStartEnd=False)
-            output_pdb.addValues('Gain:'+pol+':Ampl:{}'.format(station), total_amp[g_start:], final_freqs, final_freqwidths,
-                fast_times[g_start:], fast_timewidths[g_start:], asStartEnd=False)
+            values['Gain:'+pol+':Phase:{}'.format(station)] = total_phase
+            values['Gain:'+pol+':Ampl:{}'.format(station)] = total_amp
+
+    # Write all values at once for each section between gaps in time
+    add_values_by_segment(output_pdb, values, final_freqs, final_freqwidths,
+        fast_times, fast_timewidths)
 
     # Write values
     output_pdb.flush()
+    del output_pdb
+
+    # Save the store file of the output parmdb, which is read by the step that
+    # makes the preapply parmdb from it
+    parms = {}
+    for name, parm_values in values.items():
+        parms[name] = {'values': parm_values, 'freqs': final_freqs,
+            'freqwidths': final_freqwidths, 'times': fast_times,
+            'timewidths': fast_timewidths}
+    SolutionStore(parms).save_for_parmdb(output_file)
 
 
 if __name__ == '__main__':
@@ -5,9 +5,11 @@ Script to copy a column between MS files
 import argparse
 from argparse import RawTextHelpFormatter
 import casacore.tables as pt
+import multiprocessing
 import numpy
 import sys
 import os
+import time
 
 
 def copy_column_to_ms(ms, inputcol, outputcol, ms_from=None, use_compression=False):
@@ -71,10 +73,15 @@ def copy_column_to_ms(ms, inputcol, outputcol, ms_from=None, use_compression=Fal
     t.close()
 
 
-def copy_column_to_bands(mslist, ms_from, inputcol, outputcol):
+def copy_column_to_bands(mslist, ms_from, inputcol, outputcol, nprocs=1,
+    max_memory_gb=4.0):
     """
     Copies one column from an MS file to multiple MS files (bands)
 
+    The MS file is read in blocks of rows by a single reader, and the channel
+    slice of each band is written by a pool of workers (one task per band per
+    block) while the next block is read
+
     Parameters
     ----------
     mslist : list
@@ -85,26 +92,58 @@ def copy_column_to_bands(mslist, ms_from, inputcol, outputcol):
         Column name to copy from
     outputcol : str
         Column name to copy to
+    nprocs : int, optional
+        Number of worker processes
+    max_memory_gb : float, optional
+        Approximate maximum memory in GB to use for the data in flight
 
     """
-    datain = pt.table(ms_from)
-    data = datain.getcol(inputcol, nrow=1)
-    numberofchans = numpy.int(numpy.shape(data)[1])
-    chanperms = numberofchans/numpy.int(len(mslist))
+    starttime = time.time()
+    datain = pt.table(ms_from, ack=False)
+    nrows = datain.nrows()
+    cell = datain.getcell(inputcol, 0)
+    numberofchans = cell.shape[0]
+    chanperms = numberofchans // len(mslist)
+    rows_per_block = get_rows_per_block(cell, nrows, max_memory_gb)
+
+    bands = [(ms_id, ms) for ms_id, ms in enumerate(mslist) if os.path.isdir(ms)]
+    pool = get_pool(nprocs, len(bands))
+    pending = None
+    nbytes = 0
+    for startrow in range(0, nrows, rows_per_block):
+        nrow = min(rows_per_block, nrows - startrow)
+        data = datain.getcol(inputcol, startrow=startrow, nrow=nrow)
+        nbytes += data.nbytes
+        tasks = [(ms, outputcol, data[:, chanperms*ms_id:chanperms*(ms_id+1), :],
+            startrow, nrow) for ms_id, ms in bands]
 
-    for ms_id, ms in enumerate(mslist):
-        if os.path.isdir(ms):
-            data = datain.getcolslice(inputcol, [chanperms*ms_id,0], [(chanperms*(ms_id+1))-1,3])
-            dataout = pt.table(ms, readonly=False)
-            dataout.putcol(outputcol, data)
-            dataout.flush()
-            dataout.close()
+        # Wait for the writes of the previous block to finish, so that at most
+        # two blocks are in memory
+        if pending is not None:
+            pending.get()
+        if pool is not None:
+            pending = pool.map_async(write_band_block, tasks)
+        else:
+            for task in tasks:
+                write_band_block(task)
+    if pending is not None:
+        pending.get()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    datain.close()
+    report_throughput(nbytes, starttime)
 
 
-def copy_column_from_bands(mslist, ms_to, inputcol, outputcol):
+def copy_column_from_bands(mslist, ms_to, inputcol, outputcol, nprocs=1,
+    max_memory_gb=4.0):
     """
     Copies one column from multiple MS files (bands) to a single MS file
 
+    The bands are read in blocks of rows by a pool of workers (one task per
+    band per block), and a single writer writes the channel slices of each
+    block to the MS file while the next block is read
+
     Note: the bands are assumed to be ordered by frequency, with a nonexisting
     file (e.g., 'dummy.ms') denoting missing bands
 
@@ -118,24 +157,165 @@ def copy_column_from_bands(mslist, ms_to, inputcol, outputcol):
         Column name to copy from
     outputcol : str
         Column name to copy to
+    nprocs : int, optional
+        Number of worker processes
+    max_memory_gb : float, optional
+        Approximate maximum memory in GB to use for the data in flight
 
     """
-    dataout = pt.table(ms_to, readonly=False)
-    data = dataout.getcol(outputcol, nrow=1)
-    numberofchans = numpy.int(numpy.shape(data)[1])
-    chanperms = numberofchans/numpy.int(len(mslist))
+    starttime = time.time()
+    dataout = pt.table(ms_to, readonly=False, ack=False)
+    nrows = dataout.nrows()
+    cell = dataout.getcell(outputcol, 0)
+    numberofchans = cell.shape[0]
+    chanperms = numberofchans // len(mslist)
+    rows_per_block = get_rows_per_block(cell, nrows, max_memory_gb)
 
-    for ms_id, ms in enumerate(mslist):
-        if os.path.isdir(ms):
-            datain = pt.table(ms, readonly=True)
-            data = datain.getcol(inputcol)
-            dataout.putcolslice(outputcol, data, [chanperms*ms_id,0], [(chanperms*(ms_id+1))-1,3])
-            datain.close()
+    bands = [(ms_id, ms) for ms_id, ms in enumerate(mslist) if os.path.isdir(ms)]
+    pool = get_pool(nprocs, len(bands))
+    blocks = [(startrow, min(rows_per_block, nrows - startrow)) for startrow in
+        range(0, nrows, rows_per_block)]
+
+    def read_block(startrow, nrow):
+        tasks = [(ms, inputcol, startrow, nrow) for ms_id, ms in bands]
+        if pool is not None:
+            return pool.map_async(read_band_block, tasks)
+        else:
+            return [read_band_block(task) for task in tasks]
+
+    # Read the next block while the current one is written, so that at most
+    # two blocks are in memory
+    nbytes = 0
+    pending = read_block(*blocks[0]) if blocks else None
+    for i, (startrow, nrow) in enumerate(blocks):
+        if pool is not None:
+            results = pending.get()
+        else:
+            results = pending
+        if i+1 < len(blocks):
+            pending = read_block(*blocks[i+1])
+        for (ms_id, ms), data in zip(bands, results):
+            dataout.putcolslice(outputcol, data, [chanperms*ms_id, 0],
+                [(chanperms*(ms_id+1))-1, cell.shape[1]-1], startrow=startrow,
+                nrow=nrow)
+            nbytes += data.nbytes
+    if pool is not None:
+        pool.close()
+        pool.join()
     dataout.flush()
     dataout.close()
+    report_throughput(nbytes, starttime)
+
+
+def write_band_block(task):
+    """
+    Writes a block of rows to a band
+
+    Parameters
+    ----------
+    task : tuple
+        Tuple of (MS file, column name, data, start row, number of rows)
+
+    """
+    ms, column, data, startrow, nrow = task
+    t = pt.table(ms, readonly=False, ack=False)
+    t.putcol(column, numpy.ascontiguousarray(data), startrow=startrow, nrow=nrow)
+    t.flush()
+    t.close()
+
+
+def read_band_block(task):
+    """
+    Reads a block of rows from a band
+
+    Parameters
+    ----------
+    task : tuple
+        Tuple of (MS file, column name, start row, number of rows)
+
+    Returns
+    -------
+    data : array
+        Data of the block
+
+    """
+    ms, column, startrow, nrow = task
+    t = pt.table(ms, ack=False)
+    data = t.getcol(column, startrow=startrow, nrow=nrow)
+    t.close()
+    return data
+
+
+def get_rows_per_block(cell, nrows, max_memory_gb):
+    """
+    Returns the number of rows per block for a given memory limit
+
+    Two blocks are in flight at a time, and each block is copied once more
+    when it is passed to or from a worker process
+
+    Parameters
+    ----------
+    cell : array
+        Data of a single row
+    nrows : int
+        Total number of rows
+    max_memory_gb : float
+        Approximate maximum memory in GB to use
+
+    Returns
+    -------
+    rows_per_block : int
+        Number of rows per block
+
+    """
+    bytes_per_row = max(1, cell.nbytes)
+    rows_per_block = int(max_memory_gb * 1024**3 / (4 * bytes_per_row))
+
+    return max(1, min(rows_per_block, nrows))
+
+
+def get_pool(nprocs, nbands):
+    """
+    Returns a pool of worker processes, or None if only one is needed
+
+    Parameters
+    ----------
+    nprocs : int
+        Number of worker processes requested
+    nbands : int
+        Number of bands
+
+    Returns
+    -------
+    pool : Pool or None
+        Pool of min(nprocs, nbands) workers
+
+    """
+    nprocs = min(nprocs, nbands)
+    if nprocs <= 1:
+        return None
+    return multiprocessing.Pool(nprocs)
+
+
+def report_throughput(nbytes, starttime):
+    """
+    Prints the amount of data copied and the throughput
+
+    Parameters
+    ----------
+    nbytes : int
+        Number of bytes copied
+    starttime : float
+        Time at which the copy started
+
+    """
+    elapsed = max(time.time() - starttime, 1e-6)
+    print('Copied {0:.1f} MB in {1:.1f} s ({2:.1f} MB/s)'.format(nbytes/1024.0**2,
+        elapsed, nbytes/1024.0**2/elapsed))
 
 
-def main(ms_from, ms_to, column_from, column_to, do_copy=True, use_compression=False):
+def main(ms_from, ms_to, column_from, column_to, do_copy=True, use_compression=False,
+    nprocs=1, max_memory_gb=4.0):
     """
     Copy a column between MS files
 
@@ -154,6 +334,10 @@ def main(ms_from, ms_to, column_from, column_to, do_copy=True, use_compression=F
         If False, the copy is NOT done (used to skip a copy step in a pipeline)
     use_compression : bool, optional
         If True, use Dysco compression
+    nprocs : int, optional
+        Number of worker processes to use when copying to or from bands
+    max_memory_gb : float, optional
+        Approximate maximum memory in GB to use when copying to or from bands
 
     """
     if type(do_copy) is str:
@@ -166,6 +350,8 @@ def main(ms_from, ms_to, column_from, column_to, do_copy=True, use_compression=F
             use_compression = True
         else:
             use_compression = False
+    nprocs = int(nprocs)
+    max_memory_gb = float(max_memory_gb)
 
     if not do_copy:
         print('Copy skipped (do_copy = False)')
@@ -187,10 +373,12 @@ def main(ms_from, ms_to, column_from, column_to, do_copy=True, use_compression=F
 
     if type(ms_to) is list:
         # List means call copy_column_to_bands()
-        copy_column_to_bands(ms_to, ms_from, column_from, column_to)
+        copy_column_to_bands(ms_to, ms_from, column_from, column_to, nprocs,
+            max_memory_gb)
     elif type(ms_from) is list:
         # List means call copy_column_from_bands()
-        copy_column_from_bands(ms_from, ms_to, column_from, column_to)
+        copy_column_from_bands(ms_from, ms_to, column_from, column_to, nprocs,
+            max_memory_gb)
     else:
         if ms_to == ms_from:
             ms_from = None
@@ -206,7 +394,11 @@ if __name__ == '__main__':
     parser.add_argument('column_from', help='name of the column to copy from')
     parser.add_argument('column_to', help='name of the column to copy to')
     parser.add_argument('do_copy', help='Copy is done only if True')
+    parser.add_argument('-n', '--nprocs', help='number of worker processes for bands',
+        type=int, default=1)
+    parser.add_argument('-m', '--max_memory_gb', help='maximum memory in GB for bands',
+        type=float, default=4.0)
     args = parser.parse_args()
 
     main(args.ms_from, args.ms_to, args.column_from, args.column_to,
-        do_copy=args.do_copy)
+        do_copy=args.do_copy, nprocs=args.nprocs, max_memory_gb=args.max_memory_gb)
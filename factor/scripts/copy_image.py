@@ -8,6 +8,7 @@ import sys
 import shutil
 import os
 import glob
+from factor.lib.image_stats import copy_image_stats
 
 
 def main(image, counter, indx):
@@ -38,6 +39,10 @@ def main(image, counter, indx):
         os.remove(image_copy)
     shutil.copyfile(image, image_copy)
 
+    # Save the statistics of the image as those of the copy, so that the copy
+    # is not read again when it is compared with the image of the next loop
+    copy_image_stats(image, image_copy)
+
     # Copy the model image to allow visualization of auto-masked regions
     try:
         mask = image.replace('image.fits', 'model.fits')
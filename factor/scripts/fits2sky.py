@@ -50,6 +50,58 @@ def convert_radec_str(ra, dec):
     return sra, sdec
 
 
+def get_flux_cut(fluxes, min_peak_flux_jy, max_residual_jy, min_sources=50):
+    """
+    Returns the flux cut that gives the desired residual
+
+    The cut starts at min_peak_flux_jy and is raised in steps of 10% until the
+    total absolute flux of the sources at or below it reaches max_residual_jy,
+    or until fewer than min_sources sources remain above it. All steps are
+    evaluated at once from a single sort of the fluxes
+
+    Parameters
+    ----------
+    fluxes : array
+        Source fluxes in Jy
+    min_peak_flux_jy : float
+        Initial flux cut in Jy
+    max_residual_jy : float
+        Maximum acceptible total residual absolute flux in Jy
+    min_sources : int, optional
+        Minimum number of sources to keep regardless of the residual
+
+    Returns
+    -------
+    min_peak_flux_jy : float
+        Flux cut in Jy. Sources with absolute fluxes above it are kept
+
+    """
+    abs_fluxes = np.sort(np.abs(fluxes))
+    if len(abs_fluxes) == 0:
+        return min_peak_flux_jy
+
+    # Make the sequence of cuts by repeated multiplication (as the cut would be
+    # raised one step at a time), up to a cut that removes all sources
+    nsteps = 1
+    if abs_fluxes[-1] >= min_peak_flux_jy and min_peak_flux_jy > 0.0:
+        nsteps += int(np.ceil(np.log(abs_fluxes[-1] / min_peak_flux_jy) / np.log(1.1))) + 1
+    cuts = np.cumprod(np.array([min_peak_flux_jy] + [1.1] * nsteps))
+
+    # For each cut, find the number of sources kept and the residual flux
+    nremoved = np.searchsorted(abs_fluxes, cuts.astype(abs_fluxes.dtype), side='right')
+    residuals = np.concatenate([[0.0], np.cumsum(abs_fluxes)])[nremoved]
+    nkept = len(abs_fluxes) - nremoved
+
+    # The cut is raised while the residual is below the maximum, and stops at
+    # the first raised cut that keeps fewer than min_sources sources
+    stop = residuals >= max_residual_jy
+    stop[1:] |= nkept[1:] < min_sources
+    if not np.any(stop):
+        return cuts[-1]
+
+    return cuts[np.argmax(stop)]
+
+
 def main(fits_model_root, ms_file, skymodel, fits_mask=None, min_peak_flux_jy=0.0001,
     max_residual_jy=0.0, interp='linear'):
     """
@@ -140,51 +192,47 @@ def main(fits_model_root, ms_file, skymodel, fits_mask=None, min_peak_flux_jy=0.
 
     # Interpolate the fluxes to the frequency of the MS
     nsources = len(nonzero_ind[0])
-    fluxes = []
-    names = []
-    ras = []
-    decs = []
-    for i in range(nsources):
-        index = [nonzero_ind[j][i] for j in range(4)]
-        index.reverse() # change to WCS coords
-        ras.append(w.wcs_pix2world(np.array([index]), 0, ra_dec_order=True)[0][0])
-        decs.append(w.wcs_pix2world(np.array([index]), 0, ra_dec_order=True)[0][1])
-        names.append('cc{}'.format(i))
-        index.reverse() # change back to image coords
-        flux_array = np.array([im[tuple(index)] for im in model_images])
+    if nsources > 0:
+        # Convert all pixel positions at once (WCS coordinates are in the
+        # reverse order of the image indices)
+        pix = np.array(nonzero_ind).T[:, ::-1]
+        radec = w.wcs_pix2world(pix, 0, ra_dec_order=True)
+        ras = radec[:, 0]
+        decs = radec[:, 1]
+        flux_arrays = model_images[(slice(None),) + tuple(nonzero_ind)]
 
         # If MS frequency lies outside range, just use nearest freq
         if ms_freq < freqs[0]:
-            flux = flux_array[0]
+            fluxes = flux_arrays[0]
         elif ms_freq > freqs[-1]:
-            flux = flux_array[-1]
+            fluxes = flux_arrays[-1]
         else:
             # Otherwise interpolate
-            flux = scipy.interpolate.interp1d(freqs, flux_array, kind=interp)(ms_freq)
-        fluxes.append(flux)
-
-    # Remove sources until we reach the desired residual
-    if len(fluxes) > 0:
-        total_flux = np.sum(np.abs(fluxes))
-        keep_ind = np.where(np.abs(fluxes) > min_peak_flux_jy)
-        while (total_flux - np.sum(np.abs(np.array(fluxes)[keep_ind]))) < max_residual_jy:
-            min_peak_flux_jy *= 1.1
-            keep_ind = np.where(np.abs(fluxes) > min_peak_flux_jy)
-            if len(keep_ind[0]) < 50:
-                # keep up to 50 sources regardless of the residual
-                break
-        fluxes = np.array(fluxes)[keep_ind]
-        ras = np.array(ras)[keep_ind]
-        decs = np.array(decs)[keep_ind]
-        names = np.array(names)[keep_ind]
+            fluxes = scipy.interpolate.interp1d(freqs, flux_arrays, kind=interp,
+                axis=0)(ms_freq)
+
+        # Remove sources until we reach the desired residual
+        min_peak_flux_jy = get_flux_cut(fluxes, min_peak_flux_jy, max_residual_jy)
+        keep_ind = np.where(np.abs(fluxes) > min_peak_flux_jy)[0]
+        fluxes = fluxes[keep_ind]
+        ras = ras[keep_ind]
+        decs = decs[keep_ind]
+        names = ['cc{}'.format(i) for i in keep_ind]
+    else:
+        fluxes = []
+        ras = []
+        decs = []
+        names = []
 
     # Write sky model
     with open(skymodel, 'w') as outfile:
         outfile.write('FORMAT = Name, Type, Ra, Dec, I, Q, U, V, ReferenceFrequency\n')
+        lines = []
         for name, ra, dec, flux in zip(names, ras, decs, fluxes):
             ra_str, dec_str = convert_radec_str(ra, dec)
-            outfile.write('{0}, POINT, {1}, {2}, {3}, 0.0, 0.0, 0.0, {4}\n'
+            lines.append('{0}, POINT, {1}, {2}, {3}, 0.0, 0.0, 0.0, {4}\n'
                 .format(name, ra_str, dec_str, flux, ms_freq))
+        outfile.writelines(lines)
 
 
 if __name__ == '__main__':
@@ -12,7 +12,7 @@ import pickle
 import numpy as np
 import sys
 import os
-from factor.lib.polygon import Polygon
+from factor.lib.polygon import Polygon, rasterize, sexagesimal2deg
 from factor.scripts import blank_image
 
 
@@ -34,54 +34,46 @@ def read_vertices(filename, cal_only=False):
         return direction_dict['vertices']
 
 
-def read_casa_polys(filename, image):
-    """
-    Reads casa region file and returns polys
+def parse_casa_regions(lines):
     """
-    with open(filename, 'r') as f:
-        lines = f.readlines()
+    Parses the lines of a CASA region file
 
-    polys = []
+    The RA and Dec strings of all regions are converted to degrees at once
+
+    Parameters
+    ----------
+    lines : list of str
+        Lines of region file
+
+    Returns
+    -------
+    regions : list of dicts
+        List of regions. Each region is a dict with the region type ('poly',
+        'box' or 'ellipse') and the RA and Dec of its vertices (or, for an
+        ellipse, of its center) in degrees. Ellipses also have the full
+        semimajor and semiminor axes in degrees ('a_deg', 'b_deg') and the
+        position angle ('pa', 0 or 90)
+
+    """
+    regions = []
+    ra_strs = []
+    dec_strs = []
     for line in lines:
-        if line.startswith('poly'):
+        if line.startswith('poly') or line.startswith('box'):
             poly_str_temp = line.split('[[')[1]
             poly_str = poly_str_temp.split(']]')[0]
             poly_str_list = poly_str.split('], [')
-            ra = []
-            dec = []
+            if line.startswith('poly'):
+                region = {'type': 'poly'}
+            else:
+                region = {'type': 'box'}
+            region['start'] = len(ra_strs)
             for pos in poly_str_list:
                 RAstr, Decstr = pos.split(',')
-                ra.append(Angle(RAstr, unit='hourangle').to('deg').value)
-                dec.append(Angle(Decstr.replace('.', ':', 2), unit='deg').to('deg').value)
-            poly_vertices = [np.array(ra), np.array(dec)]
-
-            # Convert to image-plane polygon
-            xvert = []
-            yvert = []
-            for RAvert, Decvert in zip(np.array(ra), np.array(dec)):
-                try:
-                    pixels = image.topixel([0, 1, Decvert*np.pi/180.0,
-                                               RAvert*np.pi/180.0])
-                except:
-                    pixels = image.topixel([1, 1, Decvert*np.pi/180.0,
-                                               RAvert*np.pi/180.0])
-                # remove points that are too close to each other
-                if len(xvert)>0:
-                    dist = (xvert[-1]-pixels[2])**2 + (yvert[-1]-pixels[3])**2
-                    if dist < .5:
-                        continue
-                xvert.append(pixels[2]) # x -> Dec
-                yvert.append(pixels[3]) # y -> RA
-            # check if first and last points are too close
-            dist = (xvert[-1]-xvert[0])**2 + (yvert[-1]-yvert[0])**2
-            if dist < .5:
-                xvert.pop()
-                yvert.pop()
-            # check if segments intersect
-            newpolygon = Polygon(xvert, yvert)
-            if newpolygon.check_intersections() > 0:
-                raise ValueError("Found intersections in manually defined polygon! Aborting.")
-            polys.append(newpolygon)
+                ra_strs.append(RAstr)
+                dec_strs.append(Decstr)
+            region['end'] = len(ra_strs)
+            regions.append(region)
 
         elif line.startswith('ellipse'):
             ell_str_temp = line.split('[[')[1]
@@ -99,88 +91,149 @@ def read_casa_polys(filename, image):
 
             # Ellipse center
             RAstr, Decstr = ell_str_list[0].split(',')
-            ra_center = Angle(RAstr, unit='hourangle').to('deg').value
-            dec_center = Angle(Decstr.replace('.', ':', 2), unit='deg').to('deg').value
-            try:
-                pixels = image.topixel([0, 1, dec_center*np.pi/180.0,
-                    ra_center*np.pi/180.0])
-            except:
-                pixels = image.topixel([1, 1, dec_center*np.pi/180.0,
-                    ra_center*np.pi/180.0])
-            x_center = pixels[2] # x -> Dec
-            y_center = pixels[3] # y -> RA
+            region = {'type': 'ellipse', 'pa': pa, 'start': len(ra_strs),
+                'end': len(ra_strs) + 1}
+            ra_strs.append(RAstr)
+            dec_strs.append(Decstr)
 
             # Ellipse semimajor and semiminor axes
             a_str, b_str = ell_str_list[1].split(',')
-            a_deg = float(a_str.split('arcsec')[0])/3600.0
-            b_deg = float(b_str.split('arcsec')[0])/3600.0
-            try:
-                pixels1 = image.topixel([0, 1, (dec_center-a_deg/2.0)*np.pi/180.0,
-                    ra_center*np.pi/180.0])
-            except:
-                pixels1 = image.topixel([1, 1, (dec_center-a_deg/2.0)*np.pi/180.0,
-                    ra_center*np.pi/180.0])
-            a_pix1 = pixels1[2]
-            try:
-                pixels2 = image.topixel([0, 1, (dec_center+a_deg/2.0)*np.pi/180.0,
-                    ra_center*np.pi/180.0])
-            except:
-                pixels2 = image.topixel([1, 1, (dec_center+a_deg/2.0)*np.pi/180.0,
-                    ra_center*np.pi/180.0])
-            a_pix2 = pixels2[2]
-            a_pix = abs(a_pix2 - a_pix1)
-            ex = []
-            ey = []
-            for th in range(0, 360, 1):
-                if pa == 0:
-                    # semimajor axis is along x-axis
-                    ex.append(a_pix * np.cos(th * np.pi / 180.0)
-                        + x_center) # x -> Dec
-                    ey.append(a_pix * b_deg / a_deg * np.sin(th * np.pi / 180.0) + y_center) # y -> RA
-                elif pa == 90:
-                    # semimajor axis is along y-axis
-                    ex.append(a_pix * b_deg / a_deg * np.cos(th * np.pi / 180.0)
-                        + x_center) # x -> Dec
-                    ey.append(a_pix * np.sin(th * np.pi / 180.0) + y_center) # y -> RA
+            region['a_deg'] = float(a_str.split('arcsec')[0])/3600.0
+            region['b_deg'] = float(b_str.split('arcsec')[0])/3600.0
+            regions.append(region)
+
+        elif line.startswith('#'):
+            pass
+
+        else:
+            print('Only CASA regions of type "poly", "box", or "ellipse" are supported')
+            sys.exit(1)
+
+    # Convert all positions at once
+    ra_deg = sexagesimal2deg(ra_strs, True)
+    if ra_deg is None:
+        ra_deg = Angle([r.strip() for r in ra_strs], unit='hourangle').to('deg').value
+    dec_deg = sexagesimal2deg(dec_strs, False)
+    if dec_deg is None:
+        dec_deg = Angle([d.strip().replace('.', ':', 2) for d in dec_strs],
+            unit='deg').to('deg').value
+    for region in regions:
+        region['ra'] = np.atleast_1d(ra_deg[region['start']:region['end']])
+        region['dec'] = np.atleast_1d(dec_deg[region['start']:region['end']])
+        del region['start'], region['end']
+
+    return regions
+
+
+def radec2pix(image, ra, dec):
+    """
+    Converts RA and Dec in degrees to image pixel coordinates
+
+    Parameters
+    ----------
+    image : casacore.images image() object
+        Image
+    ra : array
+        RA values in degrees
+    dec : array
+        Dec values in degrees
+
+    Returns
+    -------
+    x : array
+        x pixel coordinates (along Dec)
+    y : array
+        y pixel coordinates (along RA)
+
+    """
+    x = []
+    y = []
+    for RAvert, Decvert in zip(ra, dec):
+        try:
+            pixels = image.topixel([0, 1, Decvert*np.pi/180.0,
+                                       RAvert*np.pi/180.0])
+        except:
+            pixels = image.topixel([1, 1, Decvert*np.pi/180.0,
+                                       RAvert*np.pi/180.0])
+        x.append(pixels[2]) # x -> Dec
+        y.append(pixels[3]) # y -> RA
+
+    return np.array(x), np.array(y)
+
+
+def read_casa_polys(filename, image):
+    """
+    Reads casa region file and returns polys
+    """
+    with open(filename, 'r') as f:
+        lines = f.readlines()
+
+    polys = []
+    for region in parse_casa_regions(lines):
+        ra = region['ra']
+        dec = region['dec']
+        if region['type'] == 'poly':
+            # Convert to image-plane polygon
+            xpix, ypix = radec2pix(image, ra, dec)
+
+            # remove points that are too close to each other
+            xvert = []
+            yvert = []
+            for x, y in zip(xpix, ypix):
+                if len(xvert)>0:
+                    dist = (xvert[-1]-x)**2 + (yvert[-1]-y)**2
+                    if dist < .5:
+                        continue
+                xvert.append(x)
+                yvert.append(y)
+            # check if first and last points are too close
+            dist = (xvert[-1]-xvert[0])**2 + (yvert[-1]-yvert[0])**2
+            if dist < .5:
+                xvert.pop()
+                yvert.pop()
+            # check if segments intersect
+            newpolygon = Polygon(xvert, yvert)
+            intersections = newpolygon.find_intersections()
+            if len(intersections) > 0:
+                raise ValueError('Found intersections in manually defined polygon '
+                    '(between sides {0})! Aborting.'.format(', '.join(['{0}-{1} and '
+                    '{2}-{3}'.format(a, a+1, b, b+1) for a, b in intersections])))
+            polys.append(newpolygon)
+
+        elif region['type'] == 'ellipse':
+            ra_center = ra[0]
+            dec_center = dec[0]
+            a_deg = region['a_deg']
+            b_deg = region['b_deg']
+            pa = region['pa']
+            xpix, ypix = radec2pix(image, [ra_center, ra_center, ra_center],
+                [dec_center, dec_center-a_deg/2.0, dec_center+a_deg/2.0])
+            x_center = xpix[0] # x -> Dec
+            y_center = ypix[0] # y -> RA
+            a_pix = abs(xpix[2] - xpix[1])
+            th = np.arange(0, 360, 1) * np.pi / 180.0
+            if pa == 0:
+                # semimajor axis is along x-axis
+                ex = a_pix * np.cos(th) + x_center # x -> Dec
+                ey = a_pix * b_deg / a_deg * np.sin(th) + y_center # y -> RA
+            else:
+                # semimajor axis is along y-axis
+                ex = a_pix * b_deg / a_deg * np.cos(th) + x_center # x -> Dec
+                ey = a_pix * np.sin(th) + y_center # y -> RA
             polys.append(Polygon(ex, ey))
 
-        elif line.startswith('box'):
-            poly_str_temp = line.split('[[')[1]
-            poly_str = poly_str_temp.split(']]')[0]
-            poly_str_list = poly_str.split('], [')
-            ra = []
-            dec = []
-            for pos in poly_str_list:
-                RAstr, Decstr = pos.split(',')
-                ra.append(Angle(RAstr, unit='hourangle').to('deg').value)
-                dec.append(Angle(Decstr.replace('.', ':', 2), unit='deg').to('deg').value)
+        elif region['type'] == 'box':
+            ra = list(ra)
+            dec = list(dec)
             ra.insert(1, ra[0])
             dec.insert(1, dec[1])
             ra.append(ra[2])
             dec.append(dec[0])
-            poly_vertices = [np.array(ra), np.array(dec)]
 
             # Convert to image-plane polygon
-            xvert = []
-            yvert = []
-            for RAvert, Decvert in zip(np.array(ra), np.array(dec)):
-                try:
-                    pixels = image.topixel([0, 1, Decvert*np.pi/180.0,
-                                               RAvert*np.pi/180.0])
-                except:
-                    pixels = image.topixel([1, 1, Decvert*np.pi/180.0,
-                                               RAvert*np.pi/180.0])
-                xvert.append(pixels[2]) # x -> Dec
-                yvert.append(pixels[3]) # y -> RA
+            xvert, yvert = radec2pix(image, ra, dec)
             polys.append(Polygon(xvert, yvert))
 
-        elif line.startswith('#'):
-            pass
-
-        else:
-            print('Only CASA regions of type "poly", "box", or "ellipse" are supported')
-            sys.exit(1)
-
     return polys
 
 
@@ -267,13 +320,157 @@ def vertices_to_poly(vertices, ref_im):
     return Polygon(xvert, yvert)
 
 
+def get_rms_map(data, rmsbox, clipsig=3.0, niter=5):
+    """
+    Returns a map of the rms of an image about zero
+
+    The rms is computed in boxes of the given size, centered on a grid with the
+    given step, with iterative sigma clipping, and is then interpolated
+    bilinearly onto the image pixels. Non-finite pixels are ignored
+
+    Parameters
+    ----------
+    data : 2-D array
+        Image data
+    rmsbox : tuple of ints
+        Box width and step in pixels
+    clipsig : float, optional
+        Number of sigma at which to clip
+    niter : int, optional
+        Number of clipping iterations
+
+    Returns
+    -------
+    rms_map : 2-D array
+        Map of the rms, with the same shape as the image
+
+    """
+    ny, nx = data.shape
+    size = max(1, min(int(rmsbox[0]), ny, nx))
+    step = max(1, int(rmsbox[1]))
+    ystarts = list(range(0, ny-size+1, step))
+    if ystarts[-1] != ny-size:
+        ystarts.append(ny-size)
+    xstarts = list(range(0, nx-size+1, step))
+    if xstarts[-1] != nx-size:
+        xstarts.append(nx-size)
+
+    # Compute the rms of one row of boxes at a time, using a strided view of
+    # the boxes so that they are clipped together
+    rms_grid = np.empty((len(ystarts), len(xstarts)))
+    for i, y0 in enumerate(ystarts):
+        rows = np.ascontiguousarray(data[y0:y0+size], dtype=np.float64)
+        windows = np.lib.stride_tricks.as_strided(rows, shape=(nx-size+1, size, size),
+            strides=(rows.strides[1], rows.strides[0], rows.strides[1]))
+        boxes = windows[xstarts].reshape(len(xstarts), -1)
+        sq = boxes**2
+        valid = np.isfinite(boxes)
+        sq[~valid] = 0.0
+        sel = valid
+        for j in range(niter+1):
+            n = np.sum(sel, axis=1)
+            rms = np.sqrt(np.sum(np.where(sel, sq, 0.0), axis=1) / np.maximum(n, 1))
+            rms[n == 0] = np.nan
+            if j < niter:
+                sel = valid & (sq <= (clipsig * rms[:, np.newaxis])**2)
+        rms_grid[i] = rms
+
+    # Replace the rms of fully blanked boxes so that they do not affect the
+    # interpolation near the edge of the blanked region
+    bad = ~np.isfinite(rms_grid)
+    if np.all(bad):
+        return np.zeros(data.shape)
+    rms_grid[bad] = np.median(rms_grid[~bad])
+
+    ycen = np.array(ystarts) + (size - 1) / 2.0
+    xcen = np.array(xstarts) + (size - 1) / 2.0
+    yindx = np.interp(np.arange(ny), ycen, np.arange(len(ycen)))
+    xindx = np.interp(np.arange(nx), xcen, np.arange(len(xcen)))
+    y0 = np.minimum(yindx.astype(int), len(ycen) - 2).clip(0)
+    x0 = np.minimum(xindx.astype(int), len(xcen) - 2).clip(0)
+    y1 = np.minimum(y0 + 1, len(ycen) - 1)
+    x1 = np.minimum(x0 + 1, len(xcen) - 1)
+    fy = (yindx - y0)[:, np.newaxis]
+    fx = (xindx - x0)[np.newaxis, :]
+    rms_map = ((1.0 - fy) * ((1.0 - fx) * rms_grid[y0][:, x0] + fx * rms_grid[y0][:, x1]) +
+        fy * ((1.0 - fx) * rms_grid[y1][:, x0] + fx * rms_grid[y1][:, x1]))
+
+    return rms_map
+
+
+def get_minpix_isl(header):
+    """
+    Returns the minimum island size in pixels used by PyBDSM by default
+
+    This is one third of the beam area in pixels, but at least 6 pixels. If
+    the image has no beam information, 6 is returned
+
+    Parameters
+    ----------
+    header : FITS header
+        Header of image
+
+    Returns
+    -------
+    minpix_isl : int
+        Minimum island size in pixels
+
+    """
+    try:
+        pixel_area = abs(header['CDELT1'] * header['CDELT2'])
+        beam_area = 1.1331 * header['BMAJ'] * header['BMIN'] / pixel_area
+    except (KeyError, ZeroDivisionError):
+        return 6
+
+    return max(6, int(beam_area / 3.0))
+
+
+def count_islands(snr_map, threshisl, threshpix, minpix_isl):
+    """
+    Counts the islands of an image for the given thresholds
+
+    An island is a group of connected pixels (including diagonal neighbors)
+    with signal-to-noise ratio above threshisl. It is counted if it has at
+    least minpix_isl pixels and its peak signal-to-noise ratio is above
+    threshpix
+
+    Parameters
+    ----------
+    snr_map : 2-D array
+        Signal-to-noise ratio map (image / rms_map)
+    threshisl : float
+        Island threshold in sigma
+    threshpix : float
+        Peak threshold in sigma
+    minpix_isl : int
+        Minimum island size in pixels
+
+    Returns
+    -------
+    nisl : int
+        Number of islands
+
+    """
+    from scipy import ndimage
+
+    with np.errstate(invalid='ignore'):
+        active = snr_map > threshisl
+    labels, nlabels = ndimage.label(active, structure=np.ones((3, 3)))
+    if nlabels == 0:
+        return 0
+    sizes = np.bincount(labels.ravel())[1:]
+    peaks = ndimage.maximum(snr_map, labels, np.arange(1, nlabels+1))
+
+    return int(np.sum((sizes >= minpix_isl) & (np.array(peaks) > threshpix)))
+
+
 def main(image_name, mask_name, atrous_do=False, threshisl=0.0, threshpix=0.0, rmsbox=None,
          rmsbox_bright=(35, 7), iterate_threshold=False, adaptive_rmsbox=False, img_format='fits',
          threshold_format='float', trim_by=0.0, vertices_file=None, atrous_jmax=6,
          pad_to_size=None, skip_source_detection=False, region_file=None, nsig=1.0,
          reference_ra_deg=None, reference_dec_deg=None, cellsize_deg=0.000417,
          use_adaptive_threshold=False, make_blank_image=False, adaptive_thresh=150.0,
-         exclude_cal_region=False):
+         exclude_cal_region=False, reuse_rms_map=False):
     """
     Make a clean mask and return clean threshold
 
@@ -340,6 +537,13 @@ def main(image_name, mask_name, atrous_do=False, threshisl=0.0, threshpix=0.0, r
     exclude_cal_region : bool, optional
         If True, and a vertices_file is given, the calibrator region is also
         exclude from the output mask
+    reuse_rms_map : bool, optional
+        If True, the adaptive threshold and the threshold of iterate_threshold
+        are found from an rms map that is computed once (with a box of size
+        rmsbox, or (60, 20) if rmsbox is None) and from islands found by
+        connected-component labelling. PyBDSM is then run only once, with the
+        final thresholds, so the mask for a given threshold is the same as
+        without this option
 
     Returns
     -------
@@ -405,6 +609,12 @@ def main(image_name, mask_name, atrous_do=False, threshisl=0.0, threshpix=0.0, r
         else:
             exclude_cal_region = False
 
+    if type(reuse_rms_map) is str:
+        if reuse_rms_map.lower() == 'true':
+            reuse_rms_map = True
+        else:
+            reuse_rms_map = False
+
     if make_blank_image:
         print('Making empty template image...')
         if not skip_source_detection:
@@ -434,7 +644,34 @@ def main(image_name, mask_name, atrous_do=False, threshisl=0.0, threshpix=0.0, r
                 blank_value='nan')
             image_name += '.blanked'
 
-        if use_adaptive_threshold:
+        if reuse_rms_map and (use_adaptive_threshold or iterate_threshold):
+            # Compute the rms map once. It does not depend on the thresholds, so
+            # only the islands need to be found again for each threshold
+            hdu = pyfits.open(image_name, memmap=False)
+            data = np.squeeze(hdu[0].data)
+            minpix_isl = get_minpix_isl(hdu[0].header)
+            hdu.close()
+            if rmsbox is not None:
+                rms_map = get_rms_map(data, rmsbox)
+            else:
+                rms_map = get_rms_map(data, (60, 20))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                snr_map = data / rms_map
+
+        if use_adaptive_threshold and reuse_rms_map:
+            # Estimate new thresh_isl from min pixel value's sigma, but don't let
+            # it get higher than 1/2 of the peak's sigma
+            max_neg_pos = np.unravel_index(np.nanargmin(data), data.shape)
+            max_pos_pos = np.unravel_index(np.nanargmax(data), data.shape)
+            threshisl_neg = 2.0 * abs(data[max_neg_pos]) / rms_map[max_neg_pos]
+            max_sigma = abs(data[max_pos_pos]) / rms_map[max_pos_pos]
+            if threshisl_neg > max_sigma / 2.0:
+                threshisl_neg = max_sigma / 2.0
+
+            # Use the new threshold only if it is larger than the user-specified one
+            if threshisl_neg > threshisl:
+                threshisl = threshisl_neg
+        elif use_adaptive_threshold:
             # Get an estimate of the rms
             img = bdsm.process_image(image_name, mean_map='zero', rms_box=rmsbox,
                                      thresh_pix=threshpix, thresh_isl=threshisl,
@@ -464,7 +701,21 @@ def main(image_name, mask_name, atrous_do=False, threshisl=0.0, threshpix=0.0, r
             stop_at = 'isl'
         else:
             stop_at = None
-        if iterate_threshold:
+        if iterate_threshold and reuse_rms_map:
+            # Start with given threshold and lower it until we get at least one
+            # island, then run PyBDSM once with the final threshold
+            while count_islands(snr_map, threshisl, threshpix, minpix_isl) == 0:
+                if threshpix / 1.2 < 5.0:
+                    break
+                threshpix /= 1.2
+                threshisl /= 1.2
+            img = bdsm.process_image(image_name, mean_map='zero', rms_box=rmsbox,
+                                     thresh_pix=threshpix, thresh_isl=threshisl,
+                                     atrous_do=atrous_do, thresh='hard',
+                                     adaptive_rms_box=adaptive_rmsbox, adaptive_thresh=adaptive_thresh,
+                                     rms_box_bright=rmsbox_bright, rms_map=True, quiet=True,
+                                     atrous_jmax=atrous_jmax, stop_at=stop_at)
+        elif iterate_threshold:
             # Start with given threshold and lower it until we get at least one island
             nisl = 0
             while nisl == 0:
@@ -558,16 +809,11 @@ def main(image_name, mask_name, atrous_do=False, threshisl=0.0, threshpix=0.0, r
         if region_file is not None and region_file != '[]':
             # Merge the CASA regions with the mask
             casa_polys = read_casa_polys(region_file.strip('[]"'), new_mask)
-            for poly in casa_polys:
-                # Find unmasked regions
-                unmasked_ind = np.where(data[0, 0] == 0)
 
-                # Find distance to nearest poly edge and mask those that
-                # are inside the casa region (dist > 0)
-                dist = poly.is_inside(unmasked_ind[0], unmasked_ind[1])
-                inside_ind = np.where(dist > 0.0)
-                if len(inside_ind[0]) > 0:
-                    data[0, 0, unmasked_ind[0][inside_ind], unmasked_ind[1][inside_ind]] = 1
+            # Mask pixels that are inside any of the casa regions (pixels on
+            # the edge of a region are not masked)
+            inside = rasterize(casa_polys, data[0, 0].shape, include_boundary=False)
+            data[0, 0][inside] = 1
 
         if vertices_file is not None:
             # Modify the clean mask to exclude regions outside of the polygon
@@ -577,22 +823,14 @@ def main(image_name, mask_name, atrous_do=False, threshisl=0.0, threshpix=0.0, r
                 cal_vertices = read_vertices(vertices_file, cal_only=True)
                 cal_poly = vertices_to_poly(cal_vertices, new_mask)
 
-            # Find masked regions
-            masked_ind = np.where(data[0, 0])
-
-            # Find distance to nearest poly edge and unmask those that
-            # are outside the facet (dist < 0) and inside the calibrator region
-            # (cal_dist > 0)
-            dist = poly.is_inside(masked_ind[0], masked_ind[1])
-            outside_ind = np.where(dist < 0.0)
-            if len(outside_ind[0]) > 0:
-                data[0, 0, masked_ind[0][outside_ind], masked_ind[1][outside_ind]] = 0
+            # Unmask pixels that are outside the facet (pixels on the edge of
+            # the facet are kept) and inside the calibrator region (pixels on
+            # the edge of the region are kept)
+            inside = poly.rasterize(data[0, 0].shape)
+            data[0, 0][~inside] = 0
             if exclude_cal_region:
-                masked_ind = np.where(data[0, 0])
-                cal_dist = cal_poly.is_inside(masked_ind[0], masked_ind[1])
-                inside_ind = np.where(cal_dist > 0.0)
-                if len(inside_ind[0]) > 0:
-                    data[0, 0, masked_ind[0][inside_ind], masked_ind[1][inside_ind]] = 0
+                cal_inside = cal_poly.rasterize(data[0, 0].shape, include_boundary=False)
+                data[0, 0][cal_inside] = 0
 
         if trim_by > 0.0:
             sh = np.shape(data)
@@ -648,6 +886,7 @@ if __name__ == '__main__':
     parser.add_argument('-j', '--atrous_jmax', help='Max wavelet scale', type=int, default=3)
     parser.add_argument('-z', '--pad_to_size', help='pad mask to this size', type=int, default=None)
     parser.add_argument('-s', '--skip_source_detection', help='skip source detection', type=bool, default=False)
+    parser.add_argument('--reuse_rms_map', help='find thresholds from a single rms map', type=bool, default=False)
 
     args = parser.parse_args()
     erg = main(args.image_name, args.mask_name, atrous_do=args.atrous_do,
@@ -658,5 +897,5 @@ if __name__ == '__main__':
                threshold_format=args.threshold_format, trim_by=args.trim_by,
                vertices_file=args.vertices_file, atrous_jmax=args.atrous_jmax,
                pad_to_size=args.pad_to_size, skip_source_detection=args.skip_source_detection,
-               region_file=args.region_file)
+               region_file=args.region_file, reuse_rms_map=args.reuse_rms_map)
     print erg
@@ -7,169 +7,28 @@ from argparse import RawTextHelpFormatter
 import sys
 import os
 import numpy
-import astropy.io.fits
 import subprocess
 import logging
 import warnings
 import glob
+import shutil
+import tempfile
+import multiprocessing
+import itertools
+from factor.lib.image_stats import get_image_stats
+from factor.lib.image_io import open_fits, create_fits, get_row_tiles
 warnings.filterwarnings("ignore") # Needed to suppress excessive output from matplotlib 1.5 that hangs the pipeline
 
 
-def meanclip(indata, clipsig=4.0, maxiter=10, converge_num=0.001, verbose=0):
-   """
-   Computes an iteratively sigma-clipped mean on a
-   data set. Clipping is done about median, but mean
-   is returned.
-   .. note:: MYMEANCLIP routine from ACS library.
-   :History:
-       * 21/10/1998 Written by RSH, RITSS
-       * 20/01/1999 Added SUBS, fixed misplaced paren on float call, improved doc. RSH
-       * 24/11/2009 Converted to Python. PLL.
-   Examples
-   --------
-   >>> mean, sigma = meanclip(indata)
-   Parameters
-   ----------
-   indata: array_like
-       Input data.
-   clipsig: float
-       Number of sigma at which to clip.
-   maxiter: int
-       Ceiling on number of clipping iterations.
-   converge_num: float
-       If the proportion of rejected pixels is less than
-       this fraction, the iterations stop.
-   verbose: {0, 1}
-       Print messages to screen?
-   Returns
-   -------
-   mean: float
-       N-sigma clipped mean.
-   sigma: float
-       Standard deviation of remaining pixels.
-   """
-   # Flatten array
-   skpix = indata.reshape( indata.size, )
-
-   ct = indata.size
-   iter = 0; c1 = 1.0 ; c2 = 0.0
-
-   while (c1 >= c2) and (iter < maxiter):
-       lastct = ct
-       medval = numpy.median(skpix)
-       sig = numpy.std(skpix)
-       wsm = numpy.where( abs(skpix-medval) < clipsig*sig )
-       ct = len(wsm[0])
-       if ct > 0:
-           skpix = skpix[wsm]
-
-       c1 = abs(ct - lastct)
-       c2 = converge_num * lastct
-       iter += 1
-   # End of while loop
-
-   mean  = numpy.mean( skpix )
-   sigma = robust_sigma( skpix )
-
-   if verbose:
-       prf = 'MEANCLIP:'
-       print '%s %.1f-sigma clipped mean' % (prf, clipsig)
-       print '%s Mean computed in %i iterations' % (prf, iter)
-       print '%s Mean = %.6f, sigma = %.6f' % (prf, mean, sigma)
-
-   return mean, sigma
-
-
-def find_imagenoise(data):
-  mean, rms =  meanclip(data)
-  return rms
-
-
-def robust_sigma(in_y, zero=0):
-    """
-    Calculate a resistant estimate of the dispersion of
-    a distribution. For an uncontaminated distribution,
-    this is identical to the standard deviation.
-    Use the median absolute deviation as the initial
-    estimate, then weight points using Tukey Biweight.
-    See, for example, Understanding Robust and
-    Exploratory Data Analysis, by Hoaglin, Mosteller
-    and Tukey, John Wiley and Sons, 1983.
-    .. note:: ROBUST_SIGMA routine from IDL ASTROLIB.
-    Examples
-    --------
-    >>> result = robust_sigma(in_y, zero=1)
-    Parameters
-    ----------
-    in_y : array_like
-        Vector of quantity for which the dispersion is
-        to be calculated
-    zero : int
-        If set, the dispersion is calculated w.r.t. 0.0
-        rather than the central value of the vector. If
-        Y is a vector of residuals, this should be set.
-    Returns
-    -------
-    out_val : float
-        Dispersion value. If failed, returns -1.
-    """
-    # Flatten array
-    y = in_y.ravel()
-
-    eps = 1.0E-20
-    c1 = 0.6745
-    c2 = 0.80
-    c3 = 6.0
-    c4 = 5.0
-    c_err = -1.0
-    min_points = 3
-
-    if zero:
-        y0 = 0.0
-    else:
-        y0 = numpy.median(y)
-
-    dy    = y - y0
-    del_y = abs( dy )
-
-    # First, the median absolute deviation MAD about the median:
-
-    mad = numpy.median( del_y ) / c1
-
-    # If the MAD=0, try the MEAN absolute deviation:
-    if mad < eps:
-        mad = del_y.mean() / c2
-    if mad < eps:
-        return 0.0
-
-    # Now the biweighted value:
-    u  = dy / (c3 * mad)
-    uu = u * u
-    q  = numpy.where(uu <= 1.0)
-    count = len(q[0])
-    if count < min_points:
-        module_logger.warn('ROBUST_SIGMA: This distribution is TOO WEIRD! '
-                           'Returning {}'.format(c_err))
-        return c_err
-
-    numerator = numpy.sum( (y[q] - y0)**2.0 * (1.0 - uu[q])**4.0 )
-    n    = y.size
-    den1 = numpy.sum( (1.0 - uu[q]) * (1.0 - c4 * uu[q]) )
-    siggma = n * numerator / ( den1 * (den1 - 1.0) )
-
-    if siggma > 0:
-        out_val = numpy.sqrt( siggma )
-    else:
-        out_val = 0.0
-
-    return out_val
-
-
 def main(imagefiles, maskfiles=None, imagenoise=None, interactive=False,
-    facet_name=None):
+    facet_name=None, ncores=1, max_size=None, defer=False):
     """
     Makes a png of the input images and masks
 
+    The images and masks are downsampled to the resolution of the figure
+    before they are plotted. In non-interactive mode, the pngs are rendered
+    in parallel
+
     Parameters
     ----------
     imagefiles : list or str
@@ -185,16 +44,36 @@ def main(imagefiles, maskfiles=None, imagenoise=None, interactive=False,
         each input image
     facet_name : str, optional
         Facet name for figure window
+    ncores : int, optional
+        Number of processes to use to render the pngs in non-interactive mode
+    max_size : int, optional
+        Maximum size in pixels of the images that are plotted. Larger images
+        are downsampled by an integer factor to fit. If None, the size of the
+        figure (or subplot) in pixels is used
+    defer : bool, optional
+        If True, nothing is rendered (the images can instead be viewed on
+        demand with checkfactor)
 
     """
+    if type(defer) is str:
+        if defer.lower() == 'true':
+            defer = True
+        else:
+            defer = False
+    if defer:
+        return
+    ncores = int(ncores)
+    if max_size is not None:
+        max_size = int(max_size)
+
     if interactive:
         from matplotlib import pyplot as plt
         from matplotlib.gridspec import GridSpec
         from matplotlib.ticker import NullFormatter
+        import aplpy
     else:
         import matplotlib
         matplotlib.use('Agg')
-    import aplpy
 
     # Set logging level to ERROR to suppress extraneous info from aplpy
     logging.root.setLevel(logging.ERROR)
@@ -219,13 +98,8 @@ def main(imagefiles, maskfiles=None, imagenoise=None, interactive=False,
 
     # find image noise
     if imagenoise is None:
-        imagenoises = []
-        for fitsimagename in imagefiles:
-            hdulist = astropy.io.fits.open(fitsimagename)
-            data = hdulist[0].data
-            imagenoises.append(find_imagenoise(data))
-            hdulist.close()
-        imagenoise = min(imagenoises)
+        imagenoise = min([get_image_stats(fitsimagename)['rms'] for
+            fitsimagename in imagefiles])
 
     # Set up plot(s)
     if interactive:
@@ -250,6 +124,9 @@ def main(imagefiles, maskfiles=None, imagenoise=None, interactive=False,
         else:
             fig.canvas.set_window_title('Selfcal Images (scaling noise = {0} mJy/beam)'.format(round(imagenoise*1e3, 3)))
         gs = GridSpec(Nr, Nc, wspace=0.0, hspace=0.0)
+        if max_size is None:
+            max_size = int(numpy.ceil(float(xsize) / Nc * fig.dpi))
+        temp_dir = tempfile.mkdtemp()
         row1_colindx = 0
         row2_colindx = 0
         row3_colindx = 0
@@ -329,7 +206,8 @@ def main(imagefiles, maskfiles=None, imagenoise=None, interactive=False,
             ax.xaxis.set_major_formatter(NullFormatter())
             ax.yaxis.set_major_formatter(NullFormatter())
 
-            f = aplpy.FITSFigure(fitsimagename, figure=fig, slices=[0, 0],
+            plotimagename, factor = get_plot_file(fitsimagename, max_size, temp_dir)
+            f = aplpy.FITSFigure(plotimagename, figure=fig, slices=[0, 0],
                 subplot=(Nr, Nc, subplotindx))
             f.show_colorscale(vmax=16*imagenoise, vmin=-6*imagenoise, cmap='bone')
             f.tick_labels.hide()
@@ -345,11 +223,18 @@ def main(imagefiles, maskfiles=None, imagenoise=None, interactive=False,
             f.grid.set_alpha(0.5)
             f.grid.set_linewidth(0.2)
             if mask is not None:
-                f.show_contour(mask, colors='red', levels=[0.1*imagenoise], filled=False, smooth=3,
-                    alpha=0.6, linewidths=1)
+                plotmaskname, factor = get_plot_file(mask, max_size, temp_dir, method='max')
+                f.show_contour(plotmaskname, colors='red', levels=[0.1*imagenoise], filled=False,
+                    smooth=get_contour_smoothing(factor), alpha=0.6, linewidths=1)
+        shutil.rmtree(temp_dir)
         fig.show()
     else:
+        if max_size is None:
+            # Default figure size of aplpy (10 x 9 inches) at the dpi of the pngs
+            max_size = 1000
+        temp_dir = tempfile.mkdtemp()
         image_infixes = ['image02', 'image12', 'image22', 'image32', 'image42']
+        tasks = []
         for fitsimagename, mask in zip(imagefiles, maskfiles):
             outplotname = fitsimagename.replace('.fits', '.png')
             for im in image_infixes:
@@ -359,24 +244,167 @@ def main(imagefiles, maskfiles=None, imagenoise=None, interactive=False,
                         title = im + '_iter{}'.format(iter)
                     else:
                         title = im
-            f = aplpy.FITSFigure(fitsimagename, slices=[0, 0])
-            f.show_colorscale(vmax=16*imagenoise, vmin=-6*imagenoise, cmap='bone')
-            f.set_title(title+' (scaling noise = {} mJy/beam)'.format(round(imagenoise*1e3, 3)))
-            f.add_beam()
-            f.beam.set_frame(True)
-            f.beam.set_color('white')
-            f.beam.set_edgecolor('black')
-            f.beam.set_linewidth(1.)
-            f.add_grid()
-            f.grid.set_color('white')
-            f.grid.set_alpha(0.5)
-            f.grid.set_linewidth(0.2)
-            f.add_colorbar()
-            f.colorbar.set_axis_label_text('Flux (Jy beam$^{-1}$)')
-            if mask is not None:
-                f.show_contour(mask, colors='red', levels=[0.1*imagenoise], filled=False, smooth=3,
-                    alpha=0.6, linewidths=1)
-            f.save(outplotname, dpi=100, format='png')
+            tasks.append((fitsimagename, mask, outplotname, title, imagenoise,
+                max_size, temp_dir))
+        if ncores > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(ncores, len(tasks)))
+            results = pool.imap_unordered(render_image, tasks)
+        else:
+            pool = None
+            results = itertools.imap(render_image, tasks)
+        for result in results:
+            pass
+        if pool is not None:
+            pool.close()
+            pool.join()
+        shutil.rmtree(temp_dir)
+
+
+def render_image(task):
+    """
+    Renders a png of an image (with the Agg backend)
+
+    Parameters
+    ----------
+    task : tuple
+        Tuple of (filename of image, filename of mask (or None), filename of
+        output png, title, image noise in Jy/beam, maximum size in pixels of
+        the plotted image, directory for the downsampled images)
+
+    """
+    fitsimagename, mask, outplotname, title, imagenoise, max_size, temp_dir = task
+    import matplotlib
+    matplotlib.use('Agg')
+    import aplpy
+    logging.root.setLevel(logging.ERROR)
+
+    plotimagename, factor = get_plot_file(fitsimagename, max_size, temp_dir)
+    f = aplpy.FITSFigure(plotimagename, slices=[0, 0])
+    f.show_colorscale(vmax=16*imagenoise, vmin=-6*imagenoise, cmap='bone')
+    f.set_title(title+' (scaling noise = {} mJy/beam)'.format(round(imagenoise*1e3, 3)))
+    f.add_beam()
+    f.beam.set_frame(True)
+    f.beam.set_color('white')
+    f.beam.set_edgecolor('black')
+    f.beam.set_linewidth(1.)
+    f.add_grid()
+    f.grid.set_color('white')
+    f.grid.set_alpha(0.5)
+    f.grid.set_linewidth(0.2)
+    f.add_colorbar()
+    f.colorbar.set_axis_label_text('Flux (Jy beam$^{-1}$)')
+    if mask is not None:
+        plotmaskname, factor = get_plot_file(mask, max_size, temp_dir, method='max')
+        f.show_contour(plotmaskname, colors='red', levels=[0.1*imagenoise], filled=False,
+            smooth=get_contour_smoothing(factor), alpha=0.6, linewidths=1)
+    f.save(outplotname, dpi=100, format='png')
+    f.close()
+
+
+def get_contour_smoothing(factor):
+    """
+    Returns the smoothing scale for contours of an image downsampled by factor
+
+    The original scale of 3 pixels is kept for images that are not
+    downsampled. Downsampled images are not smoothed further, as their pixels
+    already span at least the original scale
+    """
+    if factor < 3:
+        return 3
+    else:
+        return None
+
+
+def get_plot_file(filename, max_size, temp_dir, method='mean'):
+    """
+    Returns the filename of the image to plot, downsampling it if needed
+
+    Parameters
+    ----------
+    filename : str
+        Filename of FITS image
+    max_size : int
+        Maximum size in pixels of the image to plot
+    temp_dir : str
+        Directory in which to write the downsampled image
+    method : str, optional
+        Method used to combine the pixels of each block: 'mean' or 'max'
+
+    Returns
+    -------
+    plotfilename : str
+        Filename of the image to plot
+    factor : int
+        Downsampling factor (1 if the image was not downsampled)
+
+    """
+    outfile = os.path.join(temp_dir, os.path.basename(filename))
+    factor = downsample_fits(filename, outfile, max_size, method=method)
+    if factor > 1:
+        return outfile, factor
+    else:
+        return filename, factor
+
+
+def downsample_fits(infile, outfile, max_size, method='mean', rows_per_tile=1024):
+    """
+    Downsamples the last two axes of a FITS image by an integer factor
+
+    The image is read in tiles of rows. Pixels beyond the last full block are
+    dropped and the WCS is adjusted so that the sky positions are unchanged
+
+    Parameters
+    ----------
+    infile : str
+        Filename of input FITS image
+    outfile : str
+        Filename of output FITS image. It is only written if the image is
+        downsampled
+    max_size : int
+        Maximum size in pixels of the output image
+    method : str, optional
+        Method used to combine the pixels of each block: 'mean' or 'max' (use
+        'max' for images that are contoured, so that compact emission is kept).
+        Blanked (NaN) pixels are ignored
+    rows_per_tile : int, optional
+        Number of rows per tile
+
+    Returns
+    -------
+    factor : int
+        Downsampling factor (1 if the image was not downsampled)
+
+    """
+    hdulist_in = open_fits(infile)
+    data_in = hdulist_in[0].data
+    ny, nx = data_in.shape[-2:]
+    factor = int(numpy.ceil(max(ny, nx) / float(max_size)))
+    if factor <= 1:
+        hdulist_in.close()
+        return 1
+
+    header = hdulist_in[0].header.copy()
+    for i in [1, 2]:
+        header['CDELT{}'.format(i)] *= factor
+        header['CRPIX{}'.format(i)] = (header['CRPIX{}'.format(i)] - 0.5) / factor + 0.5
+    ny_out = ny // factor
+    nx_out = nx // factor
+    shape_out = data_in.shape[:-2] + (ny_out, nx_out)
+    hdulist_out = create_fits(outfile, header, shape_out, dtype=numpy.dtype('>f4'))
+    data_out = hdulist_out[0].data
+    rows_per_tile = max(1, rows_per_tile // factor) * factor
+    for r0, r1 in get_row_tiles(ny_out * factor, rows_per_tile):
+        tile = numpy.array(data_in[..., r0:r1, :nx_out*factor], dtype=numpy.float32)
+        blocks = tile.reshape(tile.shape[:-2] + ((r1 - r0) // factor, factor, nx_out, factor))
+        if method == 'max':
+            reduced = numpy.nanmax(numpy.nanmax(blocks, axis=-1), axis=-2)
+        else:
+            reduced = numpy.nanmean(numpy.nanmean(blocks, axis=-1), axis=-2)
+        data_out[..., r0//factor:r1//factor, :] = reduced
+    hdulist_out.close()
+    hdulist_in.close()
+
+    return factor
 
 
 if __name__ == '__main__':
@@ -388,7 +416,11 @@ if __name__ == '__main__':
     parser.add_argument('imagenoise', help='noise for scaling (Jy/beam)', type=float, default=None)
     parser.add_argument('interactive', help='use interactive mode', type=bool, default=False)
     parser.add_argument('facet_name', help='name of facet', type=str, default=None)
+    parser.add_argument('--ncores', help='number of processes used to render the pngs', type=int, default=1)
+    parser.add_argument('--max_size', help='maximum size in pixels of the plotted images', type=int, default=None)
+    parser.add_argument('--defer', help='do not render; view on demand with checkfactor', action='store_true', default=False)
     args = parser.parse_args()
 
     main(args.imagefiles, maskfiles=args.maskfiles, imagenoise=args.imagenoise,
-        interactive=args.interactive, facet_name=args.facet_name)
+        interactive=args.interactive, facet_name=args.facet_name,
+        ncores=args.ncores, max_size=args.max_size, defer=args.defer)
@@ -8,10 +8,12 @@ import os
 import casacore.tables as pt
 import lofar.parmdb as pdb
 import sys
-import numpy as np
+import shutil
+from factor.lib.parmdb_merge import read_parmdbs, concat_in_time, add_parms
+from factor.lib.solution_store import SolutionStore
 
 
-def main(input_mslist, parmdb_name, outparmdb, clobber=True):
+def main(input_mslist, parmdb_name, outparmdb, clobber=True, ncores=None):
     """
     Merges parmdbs in time into a single parmdb
 
@@ -28,6 +30,8 @@ def main(input_mslist, parmdb_name, outparmdb, clobber=True):
         Name of output merged parmdb
     clobber : bool, optional
         If True, overwrite existing output file
+    ncores : int, optional
+        Number of parmdbs to read at once. If None, the number of CPUs is used
 
     """
     if type(input_mslist) is str:
@@ -40,31 +44,27 @@ def main(input_mslist, parmdb_name, outparmdb, clobber=True):
             clobber = True
         else:
             clobber = False
+    if ncores is not None:
+        ncores = int(ncores)
 
     if os.path.exists(outparmdb):
         if clobber:
-            os.system('rm -rf {0}'.format(outparmdb))
+            shutil.rmtree(outparmdb)
         else:
             return
+
+    # Read all parmdbs and concatenate their values in time, then write the
+    # merged values in bulk
+    parms = concat_in_time(read_parmdbs(inparmdbs, ncores=ncores))
     pdb_concat = pdb.parmdb(outparmdb, create=True)
 
-    for i, inparmdb in enumerate(inparmdbs):
-        pdb_add = pdb.parmdb(inparmdb)
-        parms = pdb_add.getValuesGrid('*')
-        for parmname in pdb_add.getNames():
-            flagged = np.where(np.logical_or(parms[parmname]['values'] == 0.0,
-                np.isnan(parms[parmname]['values'])))
-            parms[parmname]['values'][flagged] = np.nan
-            ValueHolder = pdb_concat.makeValue(values=parms[parmname]['values'],
-                                               sfreq=parms[parmname]['freqs'],
-                                               efreq=parms[parmname]['freqwidths'],
-                                               stime=parms[parmname]['times'],
-                                               etime=parms[parmname]['timewidths'],
-                                               asStartEnd=False)
-            pdb_concat.addValues(parmname, ValueHolder)
-        pdb_concat.flush()
-        pdb_add = False
-    pdb_concat = False
+    add_parms(pdb_concat, parms)
+    pdb_concat.flush()
+    del pdb_concat
+
+    # Save the store file of the merged parmdb, which is read by the steps
+    # that smooth, merge and convert the solutions
+    SolutionStore(parms).save_for_parmdb(outparmdb)
 
 
 if __name__ == '__main__':
@@ -75,6 +75,8 @@ if __name__ == '__main__':
     parser.add_argument('parmdb_name', help='name of parmdbs to merge')
     parser.add_argument('outparmdb', help='output parmdb')
     parser.add_argument('-c', '--clobber', help='clobber existing file?', type=bool, default=True)
+    parser.add_argument('-n', '--ncores', help='number of parmdbs to read at once', type=int, default=None)
 
     args = parser.parse_args()
-    main(args.mslist, args.parmdb_name, args.outparmdb, clobber=args.clobber)
+    main(args.mslist, args.parmdb_name, args.outparmdb, clobber=args.clobber,
+        ncores=args.ncores)
@@ -8,7 +8,8 @@ import os
 import lofar.parmdb as pdb
 import casacore.tables as pt
 import shutil
-import numpy as np
+from factor.lib.parmdb_merge import flag_parms, add_parms
+from factor.lib.solution_store import load_solutions, SolutionStore
 
 
 def main(parmdb_p, parmdb_a, parmdb_out, clobber=True):
@@ -40,26 +41,22 @@ def main(parmdb_p, parmdb_a, parmdb_out, clobber=True):
         else:
             return
 
-    os.system('cp -r {0} {1}'.format(parmdb_p,parmdb_out))
+    # Read the phase and gain solutions, using their store files if possible
+    parms_p = load_solutions(parmdb_p).to_parms()
+    parms_a = flag_parms(load_solutions(parmdb_a).to_parms())
 
-    ## Copy over the Gains
-    pdb_out = pdb.parmdb(parmdb_out)
-    pdb_a = pdb.parmdb(parmdb_a)
-    parms = pdb_a.getValuesGrid('*')
-    for parmname in pdb_a.getNames():
-        # Set flagged solutions to NaN
-        flagged = np.where(np.logical_or(parms[parmname]['values'] == 0.0,
-            np.isnan(parms[parmname]['values'])))
-        parms[parmname]['values'][flagged] = np.nan
-        ValueHolder = pdb_out.makeValue(values=parms[parmname]['values'],
-                                        sfreq=parms[parmname]['freqs'],
-                                        efreq=parms[parmname]['freqwidths'],
-                                        stime=parms[parmname]['times'],
-                                        etime=parms[parmname]['timewidths'],
-                                        asStartEnd=False)
+    shutil.copytree(parmdb_p, parmdb_out)
 
-        pdb_out.addValues(parmname,ValueHolder)
+    ## Copy over the Gains (with flagged solutions set to NaN) in bulk
+    pdb_out = pdb.parmdb(parmdb_out)
+    add_parms(pdb_out, parms_a)
     pdb_out.flush()
+    del pdb_out
+
+    # Save the store file of the merged parmdb, which is read by the step that
+    # plots the solutions
+    parms_p.update(parms_a)
+    SolutionStore(parms_p).save_for_parmdb(parmdb_out)
 
 
 if __name__ == '__main__':
@@ -10,10 +10,15 @@ from casacore import quanta
 import numpy as np
 from astropy.io import fits as pyfits
 import os
+import copy
+import shutil
+import itertools
+import multiprocessing
 from factor.directions import mask_vertices
+from factor.lib.image_io import get_row_tiles, write_casa_tile
 
 
-def main(images, outfits, maxwidth=0):
+def main(images, outfits, maxwidth=0, ncores=1, rows_per_chunk=1024):
     """
     Creates mosaic
 
@@ -28,11 +33,18 @@ def main(images, outfits, maxwidth=0):
     maxwidth : int, optional
         Maximum number of pixels to consider for the width of the mosaic
         [default 0 = unlimited] This can be helpful at high declination.
+    ncores : int, optional
+        Number of facet images to regrid in parallel
+    rows_per_chunk : int, optional
+        Number of rows of the mosaic to write at once
 
     """
     if type(images) is str:
         images = images.strip('[]').split(',')
         images = [im.strip() for im in images]
+    maxwidth = int(maxwidth)
+    ncores = int(ncores)
+    rows_per_chunk = int(rows_per_chunk)
 
     formstr = '{0:45s}  {1:s}  {2:s} {3:s} {4:s}'
     print formstr.format("-----","------------","-------","-------","-------")
@@ -66,18 +78,7 @@ def main(images, outfits, maxwidth=0):
 
     # Get image frames for input images
     for im in images:
-        image = pim.image(im)
-        sptcoords = image.coordinates().get_coordinate('spectral')
-        nc = sptcoords.get_axis_size()
-
-        # Get Stokes axis. Ensure we are working with the Stokes parameter requested.
-        stkcoords = image.coordinates().get_coordinate('stokes')
-        if stkcoords.get_axis_size() == 1:
-            assert(stkcoords.get_stokes()[0] == 'I')
-        else:
-            stks = stkcoords.get_stokes().index('I')
-            image = image.subimage(blc=(0, stks), trc=(nc-1, stks), dropdegenerate=False)
-        ns = 1
+        image, nc = open_stokes_i_image(im)
 
         dircoords = image.coordinates().get_coordinate('direction')
         nx = dircoords.get_axis_size(axis=1)
@@ -117,29 +118,51 @@ def main(images, outfits, maxwidth=0):
     ma['direction'].set_increment([decinc[np.argmin(np.abs(decinc))],rainc[np.argmin(np.abs(rainc))]])
     ma['direction'].set_referencevalue([master_dec[len(master_dec)/2],master_ra[len(master_ra)/2]])
 
-    # Initialize the arrays for the output image, sensitivity, and weights
-    master_im = np.zeros((len(master_dec),len(master_ra)))
+    # Initialize the output image as a memory-mapped array, so that the full
+    # mosaic is never held in memory
+    master_shape = (len(master_dec), len(master_ra))
+    master_file = outfits + '.mosaic_tmp'
+    master_im = np.memmap(master_file, dtype=np.float64, mode='w+', shape=master_shape)
+    master_im[:] = 0.0
 
-    # Reproject the images onto the master grid, weight and normalize
-    for im in pims:
-        im = im.regrid([2,3],ma,outshape=(int(nc),int(ns),len(master_dec),len(master_ra)))
-        master_im += np.squeeze(im.getdata())
+    # Reproject the images onto their footprints on the master grid and add
+    # them to the mosaic
+    ma_dict = ma.dict()
+    tasks = [(im, ma_dict, master_shape) for im in images]
+    if ncores > 1:
+        pool = multiprocessing.Pool(min(ncores, len(tasks)))
+        results = pool.imap_unordered(regrid_facet, tasks)
+    else:
+        pool = None
+        results = itertools.imap(regrid_facet, tasks)
+    for result in results:
+        if result is None:
+            continue
+        (y0, y1, x0, x1), data = result
+        master_im[y0:y1, x0:x1] += data
+    if pool is not None:
+        pool.close()
+        pool.join()
 
-    blank=np.ones_like(master_im)*np.nan
-    master_im=np.where(master_im,master_im,blank)
+    # Open new casa image for mosaic and write it in chunks of rows, blanking
+    # pixels not covered by any facet
+    mosaic_image = outfits + '.mosaic_image'
+    new_pim = pim.image(mosaic_image, shape=(1, 1, len(master_dec), len(master_ra)),
+        coordsys=ma, overwrite=True)
+    for y0, y1 in get_row_tiles(master_shape[0], rows_per_chunk):
+        chunk = np.array(master_im[y0:y1, :])
+        chunk[chunk == 0] = np.nan
+        write_casa_tile(new_pim, chunk[np.newaxis, np.newaxis, :, :], y0)
+    del master_im
+    os.remove(master_file)
 
-    # Write fits files
-    arrax = np.zeros( (1,1, len(master_im[:,0]), len(master_im[0,:])) )
-    arrax[0,0,:,:] = master_im
-
-    # Open new casa image for mosaic
-    new_pim = pim.image('',shape=(1,1, len(master_dec),len(master_ra)), coordsys=ma)
-    new_pim.putdata(arrax)
     # Write fits
     new_pim.tofits(outfits, overwrite=True)
+    del new_pim
+    shutil.rmtree(mosaic_image)
 
     # need to add new beam info (not sure if this is possible with casacore)
-    hdu = pyfits.open(outfits, mode='update', memmap=False)
+    hdu = pyfits.open(outfits, mode='update', memmap=True)
     header = hdu[0].header
     header['BMAJ'] = mean_psf_fwhm[0]
     header['BMIN'] = mean_psf_fwhm[1]
@@ -147,9 +170,137 @@ def main(images, outfits, maxwidth=0):
     header['BUNIT'] = pims[-1].info()['unit']
     header['RESTFRQ'] = mean_frequency
     header['RESTFREQ'] = mean_frequency
-    newhdu = pyfits.PrimaryHDU(data=hdu[0].data, header=header)
-    newhdu.writeto(outfits,clobber=True)
+    hdu.close()
+
+
+def open_stokes_i_image(filename):
+    """
+    Opens an image and selects its Stokes I plane
+
+    Parameters
+    ----------
+    filename : str
+        Filename of image
+
+    Returns
+    -------
+    image : casacore.images image() object
+        Stokes I image
+    nc : int
+        Number of channels
+
+    """
+    image = pim.image(filename)
+    sptcoords = image.coordinates().get_coordinate('spectral')
+    nc = sptcoords.get_axis_size()
+
+    # Get Stokes axis. Ensure we are working with the Stokes parameter requested.
+    stkcoords = image.coordinates().get_coordinate('stokes')
+    if stkcoords.get_axis_size() == 1:
+        assert(stkcoords.get_stokes()[0] == 'I')
+    else:
+        stks = stkcoords.get_stokes().index('I')
+        image = image.subimage(blc=(0, stks), trc=(nc-1, stks), dropdegenerate=False)
+
+    return image, nc
+
+
+def get_footprint(image, data, ma_dict, master_shape, margin=2):
+    """
+    Returns the footprint of the nonzero region of a facet image on the master grid
+
+    Parameters
+    ----------
+    image : casacore.images image() object
+        Facet image
+    data : array
+        Data of the facet image
+    ma_dict : dict
+        Coordinate system of the master grid
+    master_shape : tuple of int
+        Shape (ndec, nra) of the master grid
+    margin : int, optional
+        Number of pixels to add on each side (for the interpolation)
+
+    Returns
+    -------
+    facet_box : tuple of int or None
+        Box (y0, y1, x0, x1) of the nonzero region of the facet image, or None
+        if the image is empty
+    master_box : tuple of int or None
+        Box (y0, y1, x0, x1) of the footprint on the master grid, or None if it
+        is outside the master grid
+
+    """
+    plane = data[0, 0]
+    nonzero = np.where(plane != 0)
+    if len(nonzero[0]) == 0:
+        return None, None
+    facet_box = (max(nonzero[0].min() - margin, 0), min(nonzero[0].max() + margin + 1,
+        plane.shape[0]), max(nonzero[1].min() - margin, 0), min(nonzero[1].max() +
+        margin + 1, plane.shape[1]))
+
+    # Convert points along the edges of the box to world coordinates and then
+    # to pixel coordinates of the master grid
+    y0, y1, x0, x1 = facet_box
+    edge_y = np.linspace(y0, y1 - 1, 20)
+    edge_x = np.linspace(x0, x1 - 1, 20)
+    edge_points = ([(y, x0) for y in edge_y] + [(y, x1 - 1) for y in edge_y] +
+        [(y0, x) for x in edge_x] + [(y1 - 1, x) for x in edge_x])
+    master_ref = pim.image('', shape=(1, 1, 1, 1),
+        coordsys=pim.coordinatesystem(ma_dict))
+    master_pix = []
+    for y, x in edge_points:
+        world = image.toworld([0, 0, y, x])
+        master_pix.append(master_ref.topixel(world)[2:])
+    master_pix = np.array(master_pix)
+    master_box = (max(int(np.floor(master_pix[:, 0].min())) - margin, 0),
+        min(int(np.ceil(master_pix[:, 0].max())) + margin + 1, master_shape[0]),
+        max(int(np.floor(master_pix[:, 1].min())) - margin, 0),
+        min(int(np.ceil(master_pix[:, 1].max())) + margin + 1, master_shape[1]))
+    if master_box[1] <= master_box[0] or master_box[3] <= master_box[2]:
+        return facet_box, None
+
+    return facet_box, master_box
+
+
+def regrid_facet(task):
+    """
+    Regrids a facet image onto its footprint on the master grid
+
+    Parameters
+    ----------
+    task : tuple
+        Tuple of (filename of facet image, coordinate system dict of master grid,
+        shape of master grid)
+
+    Returns
+    -------
+    result : tuple or None
+        Tuple of (footprint box (y0, y1, x0, x1) on the master grid, regridded
+        data), or None if the facet does not overlap the master grid
+
+    """
+    filename, ma_dict, master_shape = task
+    image, nc = open_stokes_i_image(filename)
+    data = image.getdata()
+    facet_box, master_box = get_footprint(image, data, ma_dict, master_shape)
+    if master_box is None:
+        return None
+
+    # Make the coordinate system of the footprint by shifting the reference
+    # pixel of the master grid
+    y0, y1, x0, x1 = master_box
+    cs = pim.coordinatesystem(copy.deepcopy(ma_dict))
+    refpix = cs['direction'].get_referencepixel()
+    cs['direction'].set_referencepixel([refpix[0] - y0, refpix[1] - x0])
+
+    fy0, fy1, fx0, fx1 = facet_box
+    sub_image = image.subimage(blc=(0, 0, fy0, fx0), trc=(nc-1, 0, fy1-1, fx1-1),
+        dropdegenerate=False)
+    regridded = sub_image.regrid([2, 3], cs, outshape=(int(nc), 1, y1-y0, x1-x0))
 
+    return master_box, np.squeeze(regridded.getdata(), axis=(0, 1))
 
 if __name__ == '__main__':
     descriptiontext = "Create a mosaic from facet images.\n"
@@ -4,11 +4,11 @@ Script to pad WSClean model images
 """
 import argparse
 from argparse import RawTextHelpFormatter
-from astropy.io import fits as pyfits
 import numpy as np
 import glob
 import sys
 import os
+from factor.lib.image_io import open_fits, pad_fits
 
 
 def get_optimum_size(size):
@@ -77,10 +77,9 @@ def main(root, scalefactor=1.5):
     scalefactor = float(scalefactor)
 
     for infile in model_images:
-        hdu = pyfits.open(infile)
-        imdata = hdu[0].data[0, 0]
-
-        (xsize, ysize) = imdata.shape
+        hdu = open_fits(infile)
+        (xsize, ysize) = hdu[0].data.shape[-2:]
+        hdu.close()
         assert(xsize == ysize)
         print 'size is', xsize
 
@@ -101,13 +100,8 @@ def main(root, scalefactor=1.5):
         print 'padding to', padsize
         print 'offset is', offset
 
-        newdata=np.zeros((1, 1, padsize, padsize))
-
-        newdata[0, 0, offset:offset+xsize, offset:offset+xsize] = imdata
-        hdu[0].data = newdata
-        hdu[0].header['CRPIX1'] += offset
-        hdu[0].header['CRPIX2'] += offset
-        hdu.writeto(infile, clobber=True)
+        # Pad in tiles of rows, so that the image is never held in memory
+        pad_fits(infile, infile, padsize)
 
     return {'padsize': '{0} {0}'.format(padsize)}
 
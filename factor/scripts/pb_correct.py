@@ -7,13 +7,12 @@ from argparse import RawTextHelpFormatter
 from astropy.io import fits as pf
 import astropy.wcs as pywcs
 import os
-import sys
 import numpy as np
 import scipy.ndimage
 from scipy import interpolate
 
 
-def main(mosaicfits, pbfits, outroot):
+def main(mosaicfits, pbfits, outroot, interpolation='nearest', rows_per_tile=256):
     """
     Corrects mosaic image with primary beam
 
@@ -25,8 +24,15 @@ def main(mosaicfits, pbfits, outroot):
         Filename of zeroed avgpb image
     outroot : str
         Filename root of output files (outroot.pbcor.fits and outroot.pbcut.fits)
+    interpolation : str, optional
+        Interpolation used to resample the avgpb image: 'nearest' or 'bilinear'
+    rows_per_tile : int, optional
+        Number of image rows to resample at once
 
     """
+    rows_per_tile = int(rows_per_tile)
+    if interpolation not in ['nearest', 'bilinear']:
+        raise Exception, "interpolation must be 'nearest' or 'bilinear'"
     pb_rescaled_fits = mosaicfits.replace('.fits', '') + '.pb.fits'
 
     if not os.path.exists(mosaicfits):
@@ -78,11 +84,9 @@ def main(mosaicfits, pbfits, outroot):
     if len(pbS) == 4:
         print "dim 4"
         pbnc, pbnf, pbny, pbnx = pbS
-        ndim = 4
     elif len(pbS) == 2:
         print "dim 2"
         pbny, pbnx = pbS
-        ndim = 2
     else:
         raise Exception, "I don't know how to handle an image with this shape: "+str(pbS)
 
@@ -96,69 +100,9 @@ def main(mosaicfits, pbfits, outroot):
 
     if rescale:
         # resample the pb image on the input image grid
-        pbcordat_resampled = np.nan*np.ones_like(mosaicdat)
-
-        if ndim == 4:
-            print "resampling pb image... this may take a while"
-            # loop by column
-            prog = 0
-            for xi in range(nx):
-                if 100*xi/nx > prog:
-                    prog = 100*xi/nx
-                    if prog%10 == 0:
-                        #print prog ,
-                        sys.stdout.write(str(prog))
-                        sys.stdout.flush()
-                    else:
-                        #print '.',
-                        sys.stdout.write('.')
-                        sys.stdout.flush()
-                c = np.zeros(ny)
-                f = np.zeros(ny)
-                x = xi*np.ones(ny)
-                y = np.arange(ny)
-                pixcrd = np.array([x, y, c, f]).transpose()
-                ra, dec, c, f = wcsout.wcs_pix2world(pixcrd, 0).transpose()
-                worldcrd = np.array([ra, dec, c*0, f*0]).transpose()
-                pbx, pby, pbc, pbf = pbwcs.wcs_world2pix(worldcrd, 0).transpose()
-                pbx = np.array(pbx, dtype=int)
-                pby = np.array(pby, dtype=int)
-
-                for i in range(ny):
-                    # outside the pb coverage
-                    if (pbx[i] < 0) or (pby[i] < 0 ) or (pbx[i] >= pbnx ) or (pby[i] >= pbny):
-                        pass
-                    else:
-                        pbcordat_resampled[0,0,y[i],x[i]] = pbcordat[0,0,pby[i],pbx[i]]
-
-        elif ndim == 2:
-            print "resampling pb image... this may take a while"
-            # loop by column
-            prog = 0
-            for xi in range(nx):
-                if 100*xi/nx > prog:
-                    prog = 100*xi/nx
-                    if prog%10 == 0:
-                        sys.stdout.write(str(prog))
-                        sys.stdout.flush()
-                    else:
-                        sys.stdout.write('.')
-                        sys.stdout.flush()
-                x = xi*np.ones(ny)
-                y = np.arange(ny)
-                pixcrd = np.array([x, y]).transpose()
-                ra, dec = wcsout.wcs_pix2world(pixcrd, 0).transpose()
-                worldcrd = np.array([ra, dec]).transpose()
-                pbx, pby = pbwcs.wcs_world2pix(worldcrd, 0).transpose()
-                pbx = np.array(pbx, dtype=int)
-                pby = np.array(pby, dtype=int)
-
-                for i in range(ny):
-                    # outside the pb coverage
-                    if (pbx[i] < 0) or (pby[i] < 0 ) or (pbx[i] >= pbnx ) or (pby[i] >= pbny):
-                        pass
-                    else:
-                        pbcordat_resampled[y[i],x[i]] = pbcordat[pbx[i],pby[i]]
+        print "resampling pb image..."
+        pbcordat_resampled = resample_pb(pbcordat, pbwcs, mosaicdat.shape, wcsout,
+            interpolation, rows_per_tile, mosaicdat.dtype)
 
     Pcut = 0.4  # cut at Pcut power point of PB
     if rescale:
@@ -182,12 +126,93 @@ def main(mosaicfits, pbfits, outroot):
     pf.writeto(mosaicpbcutfits, mosaiccut, header=mosaichead)
 
 
+def resample_pb(pbcordat, pbwcs, shape, wcsout, interpolation='nearest',
+    rows_per_tile=256, dtype=float):
+    """
+    Resamples the avgpb image onto the grid of the mosaic image
+
+    The pixel coordinates of the mosaic are transformed to pixel coordinates
+    of the avgpb image in tiles of rows, so that only the coordinates of one
+    tile are held in memory at a time
+
+    Parameters
+    ----------
+    pbcordat : array
+        Data of avgpb image (2 or 4 dimensions)
+    pbwcs : WCS object
+        WCS of avgpb image
+    shape : tuple of int
+        Shape of mosaic image (2 or 4 dimensions)
+    wcsout : WCS object
+        WCS of mosaic image
+    interpolation : str, optional
+        Interpolation to use: 'nearest' (the pixel in which the avgpb
+        coordinates fall, after truncation) or 'bilinear'
+    rows_per_tile : int, optional
+        Number of rows of the mosaic image to resample at once
+    dtype : dtype, optional
+        Data type of the resampled image
+
+    Returns
+    -------
+    pbcordat_resampled : array
+        Resampled avgpb image (NaN outside the coverage of the avgpb image)
+
+    """
+    pbcordat_resampled = np.nan*np.ones(shape, dtype=dtype)
+    ny, nx = shape[-2:]
+    ndim = len(pbcordat.shape)
+    if ndim == 4:
+        pbplane = pbcordat[0, 0]
+    else:
+        pbplane = pbcordat
+    pbny, pbnx = pbplane.shape
+    if len(shape) == 4:
+        outplane = pbcordat_resampled[0, 0]
+    else:
+        outplane = pbcordat_resampled
+
+    for y0 in range(0, ny, rows_per_tile):
+        y1 = min(y0 + rows_per_tile, ny)
+        y, x = np.mgrid[y0:y1, 0:nx]
+        x = x.ravel().astype(float)
+        y = y.ravel().astype(float)
+        if ndim == 4:
+            c = np.zeros(len(x))
+            pixcrd = np.array([x, y, c, c]).transpose()
+            ra, dec, c, f = wcsout.wcs_pix2world(pixcrd, 0).transpose()
+            worldcrd = np.array([ra, dec, c*0, f*0]).transpose()
+            pbx, pby, pbc, pbf = pbwcs.wcs_world2pix(worldcrd, 0).transpose()
+        else:
+            pixcrd = np.array([x, y]).transpose()
+            ra, dec = wcsout.wcs_pix2world(pixcrd, 0).transpose()
+            worldcrd = np.array([ra, dec]).transpose()
+            pbx, pby = pbwcs.wcs_world2pix(worldcrd, 0).transpose()
+
+        if interpolation == 'nearest':
+            pbx = np.array(pbx, dtype=int)
+            pby = np.array(pby, dtype=int)
+            inside = (pbx >= 0) & (pby >= 0) & (pbx < pbnx) & (pby < pbny)
+            values = pbplane[pby[inside], pbx[inside]]
+        else:
+            inside = ((pbx >= 0) & (pby >= 0) & (pbx <= pbnx - 1) &
+                (pby <= pbny - 1))
+            values = scipy.ndimage.map_coordinates(pbplane, [pby[inside],
+                pbx[inside]], order=1, mode='nearest')
+        tile = outplane[y0:y1]
+        tile[(y[inside] - y0).astype(int), x[inside].astype(int)] = values
+
+    return pbcordat_resampled
+
+
 if __name__ == '__main__':
     descriptiontext = "Apply a primary-beam correction to a mosaic image.\n"
     parser = argparse.ArgumentParser(description=descriptiontext, formatter_class=RawTextHelpFormatter)
     parser.add_argument('mosaicfits', help='filenames of mosaic image')
     parser.add_argument('pbfits', help='filenames of pbcor image')
     parser.add_argument('outroot', help='Output root name of corrected mosaic fits file')
+    parser.add_argument('-i', '--interpolation', help='interpolation of pb image: '
+        '"nearest" or "bilinear"', default='nearest')
 
     args = parser.parse_args()
-    main(args.mosaicfits, args.pbfits, args.outroot)
+    main(args.mosaicfits, args.pbfits, args.outroot, interpolation=args.interpolation)
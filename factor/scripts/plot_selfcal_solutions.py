@@ -2,7 +2,6 @@
 """
 Script to apply a primary-beam correction to a mosaic image
 """
-import lofar.parmdb as lp
 import numpy as np
 import sys, os
 import matplotlib as mpl
@@ -10,6 +9,7 @@ mpl.use('Agg')
 import matplotlib.pyplot as plt
 import argparse
 from argparse import RawTextHelpFormatter
+from factor.lib.solution_store import load_solutions
 
 mpl.rc('font',size =8 )
 mpl.rc('figure.subplot',left=0.05, bottom=0.05, right=0.95, top=0.95 )
@@ -55,10 +55,37 @@ def scaletimes(t):
     return t
 
 
+def get_station_values(solstore, soltype, pol, stations):
+    """
+    Returns the values of a solution type for one polarization and the given
+    stations
+
+    Parameters
+    ----------
+    solstore : SolutionStore object
+        Solution store
+    soltype : str
+        Solution type (e.g., 'Gain:Phase')
+    pol : str
+        Polarization ('' if none)
+    stations : list
+        Station names
+
+    Returns
+    -------
+    values : array
+        Array of shape (nstations, ntimes, nfreqs)
+
+    """
+    axes = solstore.get_axes(soltype)
+    station_ind = [axes['stations'].index(station) for station in stations]
+
+    return solstore.get_values(soltype)[station_ind, axes['pols'].index(pol)]
+
+
 def solplot_scalarphase(parmdb, imageroot, refstationi, plot_international=False):
-    parmdbmtable = lp.parmdb(parmdb)
-    soldict = parmdbmtable.getValuesGrid('*')
-    names = parmdbmtable.getNames()
+    solstore = load_solutions(parmdb)
+    names = solstore.get_names()
 
     'Gain:1:1:Phase:RS508HBA'
     stationsnames = np.array([name.split(':')[-1] for name in names])
@@ -67,9 +94,9 @@ def solplot_scalarphase(parmdb, imageroot, refstationi, plot_international=False
         stationsnames = np.array([name for name in stationsnames if name[0] in ['C','R'] ])
     Nstat = len(stationsnames)
 
-    refstation = stationsnames[refstationi]
-    phase_ref = soldict['CommonScalarPhase:{s}'.format(s=refstation)]['values']
-    times= soldict['CommonScalarPhase:{s}'.format(s=refstation)]['times']
+    phases = get_station_values(solstore, 'CommonScalarPhase', '', stationsnames)
+    phase_ref = phases[refstationi]
+    times = solstore.get_axes('CommonScalarPhase')['times']
     num_channels = phase_ref.shape[1]
 
     Nr = int(Nstat)
@@ -79,7 +106,7 @@ def solplot_scalarphase(parmdb, imageroot, refstationi, plot_international=False
         f, ax = plt.subplots(Nr, Nc, sharex=True, sharey=True, figsize=(12,72))
         axs = ax.reshape((Nr*Nc,1))
         for istat, station in enumerate(stationsnames):
-            phase = soldict['CommonScalarPhase:{s}'.format(s=station)]['values'][:, chan_indx]
+            phase = phases[istat][:, chan_indx]
             phase_ref_chan = phase_ref[:, chan_indx]
 
             # don't plot flagged phases
@@ -99,25 +126,21 @@ def solplot_scalarphase(parmdb, imageroot, refstationi, plot_international=False
 
         f.savefig(imageroot+"_scalarphase_channel{}.png".format(chan_indx),dpi=100)
         plt.close(f)
-    parmdbmtable = False
-    del(soldict)
 
 
 def solplot_tec(parmdb, imageroot, refstationi, plot_international=False, freq=None):
-    parmdbmtable = lp.parmdb(parmdb)
-    soldict = parmdbmtable.getValuesGrid('*')
-
-    names = parmdbmtable.getNames()
+    solstore = load_solutions(parmdb)
+    names = solstore.get_names()
     stationsnames = np.array([name.split(':')[-1] for name in names])
     stationsnames = np.unique(stationsnames)
     if not plot_international:
         stationsnames = np.array([name for name in stationsnames if name[0] in ['C','R'] ])
     Nstat = len(stationsnames)
 
-    refstation = stationsnames[refstationi]
-    times = soldict['TEC:{s}'.format(s=refstation)]['times']
+    tecs = get_station_values(solstore, 'TEC', '', stationsnames)
+    times = solstore.get_axes('TEC')['times']
     times = scaletimes(times)
-    tec_ref = soldict['TEC:{s}'.format(s=refstation)]['values']
+    tec_ref = tecs[refstationi]
     num_channels = tec_ref.shape[1]
 
     Nr = int(Nstat)
@@ -129,7 +152,7 @@ def solplot_tec(parmdb, imageroot, refstationi, plot_international=False, freq=N
         ymin = 2
         ymax = 0
         for istat, station in enumerate(stationsnames):
-            tec = soldict['TEC:{s}'.format(s=station)]['values'][:, chan_indx]
+            tec = tecs[istat][:, chan_indx]
             tec_ref_chan = tec_ref[:, chan_indx]
 
             tec = np.ma.masked_where(np.logical_or(tec==0, np.isnan(tec)), tec)
@@ -146,26 +169,24 @@ def solplot_tec(parmdb, imageroot, refstationi, plot_international=False, freq=N
 
         f.savefig(imageroot+"_tec_channel{}.png".format(chan_indx),dpi=100)
         plt.close(f)
-    parmdbmtable = False
-    del(soldict)
 
 
 def solplot_tec_scalarphase(parmdb, imageroot, refstationi, plot_international=False, freq=None):
-    parmdbmtable = lp.parmdb(parmdb)
-    soldict = parmdbmtable.getValuesGrid('*')
-
-    names = parmdbmtable.getNames()
+    solstore = load_solutions(parmdb)
+    names = solstore.get_names()
     stationsnames = np.array([name.split(':')[-1] for name in names])
     stationsnames = np.unique(stationsnames)
     if not plot_international:
         stationsnames = np.array([name for name in stationsnames if name[0] in ['C','R'] ])
     Nstat = len(stationsnames)
 
-    refstation = stationsnames[refstationi]
-    times = soldict['CommonScalarPhase:{s}'.format(s=refstation)]['times']
+    phases = get_station_values(solstore, 'CommonScalarPhase', '', stationsnames)
+    tecs = get_station_values(solstore, 'TEC', '', stationsnames)
+    axes = solstore.get_axes('CommonScalarPhase')
+    times = axes['times']
     times = scaletimes(times)
-    phase_ref = soldict['CommonScalarPhase:{s}'.format(s=refstation)]['values']
-    tec_ref = soldict['TEC:{s}'.format(s=refstation)]['values']
+    phase_ref = phases[refstationi]
+    tec_ref = tecs[refstationi]
     num_channels = phase_ref.shape[1]
 
     Nr = int(Nstat)
@@ -178,11 +199,11 @@ def solplot_tec_scalarphase(parmdb, imageroot, refstationi, plot_international=F
         ymax = 0
 
         for istat, station in enumerate(stationsnames):
-            phase = soldict['CommonScalarPhase:{s}'.format(s=station)]['values'][:, chan_indx]
-            tec = soldict['TEC:{s}'.format(s=station)]['values'][:, chan_indx]
+            phase = phases[istat][:, chan_indx]
+            tec = tecs[istat][:, chan_indx]
             phase_ref_chan = phase_ref[:, chan_indx]
             tec_ref_chan = tec_ref[:, chan_indx]
-            freq = soldict['CommonScalarPhase:{s}'.format(s=station)]['freqs'][chan_indx]
+            freq = axes['freqs'][chan_indx]
 
             phase = np.ma.masked_where(np.logical_or(phase==0, np.isnan(phase)), phase)
             if len(times) > 1000:
@@ -201,14 +222,11 @@ def solplot_tec_scalarphase(parmdb, imageroot, refstationi, plot_international=F
 
         f.savefig(imageroot+"_tec_scalarphase_channel{}.png".format(chan_indx),dpi=100)
         plt.close(f)
-    parmdbmtable = False
-    del(soldict)
 
 
 def solplot_clock(parmdb, imageroot, refstationi, plot_international=False):
-    parmdbmtable = lp.parmdb(parmdb)
-    soldict = parmdbmtable.getValuesGrid('*')
-    names = parmdbmtable.getNames()
+    solstore = load_solutions(parmdb)
+    names = solstore.get_names()
 
     'Gain:1:1:Phase:RS508HBA'
     stationsnames = np.array([name.split(':')[-1] for name in names])
@@ -217,9 +235,9 @@ def solplot_clock(parmdb, imageroot, refstationi, plot_international=False):
         stationsnames = np.array([name for name in stationsnames if name[0] in ['C','R'] ])
     Nstat = len(stationsnames)
 
-    refstation = stationsnames[refstationi]
-    #phase_ref = soldict['Clock:{s}'.format(s=refstation)]['values']
-    times= soldict['Clock:1:{s}'.format(s=refstation)]['times']
+    clocks00 = get_station_values(solstore, 'Clock', '0', stationsnames)
+    clocks11 = get_station_values(solstore, 'Clock', '1', stationsnames)
+    times = solstore.get_axes('Clock')['times']
 
     Nr = int(np.ceil(np.sqrt(Nstat)))
     Nc = int(np.ceil(np.float(Nstat)/Nr))
@@ -228,8 +246,8 @@ def solplot_clock(parmdb, imageroot, refstationi, plot_international=False):
     ymin = 2
     ymax = 0
     for istat, station in enumerate(stationsnames):
-        clock00 = soldict['Clock:0:{s}'.format(s=station)]['values']
-        clock11 = soldict['Clock:1:{s}'.format(s=station)]['values']
+        clock00 = clocks00[istat]
+        clock11 = clocks11[istat]
 
         if len(clock00) > 0:
             ymax = max(np.max(clock00),ymax)
@@ -250,13 +268,10 @@ def solplot_clock(parmdb, imageroot, refstationi, plot_international=False):
 
     f.savefig(imageroot+"_clock.png",dpi=100)
     plt.close(f)
-    parmdbmtable = False
-    del(soldict)
 
 def solplot_phase_phasors(parmdb, imageroot, refstationi, plot_international=False, fourpol=False):
-    parmdbmtable = lp.parmdb(parmdb)
-    soldict = parmdbmtable.getValuesGrid('*')
-    names = parmdbmtable.getNames()
+    solstore = load_solutions(parmdb)
+    names = solstore.get_names()
 
     'Gain:1:1:Phase:RS508HBA'
     stationsnames = np.array([name.split(':')[-1] for name in names])
@@ -265,15 +280,18 @@ def solplot_phase_phasors(parmdb, imageroot, refstationi, plot_international=Fal
         stationsnames = np.array([name for name in stationsnames if name[0] in ['C','R'] ])
     Nstat = len(stationsnames)
 
-    refstation = stationsnames[refstationi]
-    phase11_ref = soldict['Gain:1:1:Phase:{s}'.format(s=refstation)]['values']
-    phase00_ref = soldict['Gain:0:0:Phase:{s}'.format(s=refstation)]['values']
+    phases11 = get_station_values(solstore, 'Gain:Phase', '1:1', stationsnames)
+    phases00 = get_station_values(solstore, 'Gain:Phase', '0:0', stationsnames)
+    phase11_ref = phases11[refstationi]
+    phase00_ref = phases00[refstationi]
 
     if fourpol:
-        phase10_ref = soldict['Gain:1:0:Phase:{s}'.format(s=refstation)]['values']
-        phase01_ref = soldict['Gain:0:1:Phase:{s}'.format(s=refstation)]['values']
+        phases10 = get_station_values(solstore, 'Gain:Phase', '1:0', stationsnames)
+        phases01 = get_station_values(solstore, 'Gain:Phase', '0:1', stationsnames)
+        phase10_ref = phases10[refstationi]
+        phase01_ref = phases01[refstationi]
 
-    times= soldict['Gain:1:1:Phase:{s}'.format(s=refstation)]['times']
+    times = solstore.get_axes('Gain:Phase')['times']
     num_channels = phase11_ref.shape[1]
 
     Nr = int(np.ceil(np.sqrt(Nstat)))
@@ -283,8 +301,8 @@ def solplot_phase_phasors(parmdb, imageroot, refstationi, plot_international=Fal
         f, ax = plt.subplots(Nr, Nc, sharex=True, sharey=True, figsize=(16,12))
         axs = ax.reshape((Nr*Nc,1))
         for istat, station in enumerate(stationsnames):
-            phase11 = soldict['Gain:1:1:Phase:{s}'.format(s=station)]['values'][:, chan_indx]
-            phase00 = soldict['Gain:0:0:Phase:{s}'.format(s=station)]['values'][:, chan_indx]
+            phase11 = phases11[istat][:, chan_indx]
+            phase00 = phases00[istat][:, chan_indx]
             phase00_ref_chan = phase00_ref[:, chan_indx]
             phase11_ref_chan = phase11_ref[:, chan_indx]
 
@@ -293,8 +311,8 @@ def solplot_phase_phasors(parmdb, imageroot, refstationi, plot_international=Fal
             phase11 = np.ma.masked_where(np.logical_or(phase11==0, np.isnan(phase11)), phase11)
 
             if fourpol:
-	        phase10 = soldict['Gain:1:0:Phase:{s}'.format(s=station)]['values'][:, chan_indx]
-                phase01 = soldict['Gain:0:1:Phase:{s}'.format(s=station)]['values'][:, chan_indx]
+                phase10 = phases10[istat][:, chan_indx]
+                phase01 = phases01[istat][:, chan_indx]
                 phase01_ref_chan = phase01_ref[:, chan_indx]
                 phase10_ref_chan = phase10_ref[:, chan_indx]
 
@@ -321,16 +339,12 @@ def solplot_phase_phasors(parmdb, imageroot, refstationi, plot_international=Fal
 
         f.savefig(imageroot+"_phase_channel{}.png".format(chan_indx),dpi=100)
         plt.close(f)
-    parmdbmtable = False
-    del(soldict)
 
 
 def solplot_phase(parmdb, imageroot, refstationi, norm_amp_lim=False, median_amp=False, plot_international=False, fourpol=False):
 
-    parmdbmtable = lp.parmdb(parmdb)
-
-    soldict = parmdbmtable.getValuesGrid('*')
-    names = parmdbmtable.getNames()
+    solstore = load_solutions(parmdb)
+    names = solstore.get_names()
 
     'Gain:1:1:Phase:RS508HBA'
     stationsnames = np.array([name.split(':')[-1] for name in names])
@@ -339,14 +353,17 @@ def solplot_phase(parmdb, imageroot, refstationi, norm_amp_lim=False, median_amp
         stationsnames = np.array([name for name in stationsnames if name[0] in ['C','R'] ])
     Nstat = len(stationsnames)
 
-    refstation = stationsnames[refstationi]
-    times = soldict['Gain:1:1:Real:{s}'.format(s=refstation)]['times']
+    times = solstore.get_axes('Gain:Real')['times']
     times = scaletimes(times)
 
-    real11_ref = soldict['Gain:1:1:Real:{s}'.format(s=refstation)]['values']
-    real00_ref = soldict['Gain:0:0:Real:{s}'.format(s=refstation)]['values']
-    imag11_ref = soldict['Gain:1:1:Imag:{s}'.format(s=refstation)]['values']
-    imag00_ref = soldict['Gain:0:0:Imag:{s}'.format(s=refstation)]['values']
+    reals11 = get_station_values(solstore, 'Gain:Real', '1:1', stationsnames)
+    reals00 = get_station_values(solstore, 'Gain:Real', '0:0', stationsnames)
+    imags11 = get_station_values(solstore, 'Gain:Imag', '1:1', stationsnames)
+    imags00 = get_station_values(solstore, 'Gain:Imag', '0:0', stationsnames)
+    real11_ref = reals11[refstationi]
+    real00_ref = reals00[refstationi]
+    imag11_ref = imags11[refstationi]
+    imag00_ref = imags00[refstationi]
     num_channels = real11_ref.shape[1]
 
     valscorr00 = real00_ref +1.j*imag00_ref
@@ -356,10 +373,14 @@ def solplot_phase(parmdb, imageroot, refstationi, norm_amp_lim=False, median_amp
     phase11_ref = np.angle(valscorr11)
 
     if fourpol:
-            real10_ref = soldict['Gain:1:0:Real:{s}'.format(s=refstation)]['values']
-            real01_ref = soldict['Gain:0:1:Real:{s}'.format(s=refstation)]['values']
-            imag10_ref = soldict['Gain:1:0:Imag:{s}'.format(s=refstation)]['values']
-            imag01_ref = soldict['Gain:0:1:Imag:{s}'.format(s=refstation)]['values']
+            reals10 = get_station_values(solstore, 'Gain:Real', '1:0', stationsnames)
+            reals01 = get_station_values(solstore, 'Gain:Real', '0:1', stationsnames)
+            imags10 = get_station_values(solstore, 'Gain:Imag', '1:0', stationsnames)
+            imags01 = get_station_values(solstore, 'Gain:Imag', '0:1', stationsnames)
+            real10_ref = reals10[refstationi]
+            real01_ref = reals01[refstationi]
+            imag10_ref = imags10[refstationi]
+            imag01_ref = imags01[refstationi]
 
             valscorr10 = real10_ref +1.j*imag10_ref
             valscorr01 = real01_ref +1.j*imag01_ref
@@ -376,10 +397,10 @@ def solplot_phase(parmdb, imageroot, refstationi, norm_amp_lim=False, median_amp
         axsp = axp.reshape((Nr*Nc,1))
         for istat, station in enumerate(stationsnames):
 
-            real11 = soldict['Gain:1:1:Real:{s}'.format(s=station)]['values'][:, chan_indx]
-            real00 = soldict['Gain:0:0:Real:{s}'.format(s=station)]['values'][:, chan_indx]
-            imag11 = soldict['Gain:1:1:Imag:{s}'.format(s=station)]['values'][:, chan_indx]
-            imag00 = soldict['Gain:0:0:Imag:{s}'.format(s=station)]['values'][:, chan_indx]
+            real11 = reals11[istat][:, chan_indx]
+            real00 = reals00[istat][:, chan_indx]
+            imag11 = imags11[istat][:, chan_indx]
+            imag00 = imags00[istat][:, chan_indx]
 
             valscorr00 = real00 +1.j*imag00
             valscorr11 = real11 +1.j*imag11
@@ -388,10 +409,10 @@ def solplot_phase(parmdb, imageroot, refstationi, norm_amp_lim=False, median_amp
             phase11_ref_chan = phase11_ref[:, chan_indx]
 
             if fourpol:
-	        real10 = soldict['Gain:1:0:Real:{s}'.format(s=station)]['values'][:, chan_indx]
-                real01 = soldict['Gain:0:1:Real:{s}'.format(s=station)]['values'][:, chan_indx]
-                imag10 = soldict['Gain:1:0:Imag:{s}'.format(s=station)]['values'][:, chan_indx]
-                imag01 = soldict['Gain:0:1:Imag:{s}'.format(s=station)]['values'][:, chan_indx]
+                real10 = reals10[istat][:, chan_indx]
+                real01 = reals01[istat][:, chan_indx]
+                imag10 = imags10[istat][:, chan_indx]
+                imag01 = imags01[istat][:, chan_indx]
 
                 valscorr01 = real01 +1.j*imag01
                 valscorr10 = real10 +1.j*imag10
@@ -430,15 +451,12 @@ def solplot_phase(parmdb, imageroot, refstationi, norm_amp_lim=False, median_amp
 
         fp.savefig(imageroot+"_phase_channel{}.png".format(chan_indx),dpi=100)
         plt.close(fp)
-    parmdbmtable = False
-    del(soldict)
 
 
 def solplot_amp(parmdb, imageroot, refstationi, norm_amp_lim=False, median_amp=False, plot_international=False, fourpol=False):
 
-    parmdbmtable = lp.parmdb(parmdb)
-    soldict = parmdbmtable.getValuesGrid('*')
-    names = parmdbmtable.getNames()
+    solstore = load_solutions(parmdb)
+    names = solstore.get_names()
 
     'Gain:1:1:Phase:RS508HBA'
     stationsnames = np.array([name.split(':')[-1] for name in names])
@@ -447,21 +465,28 @@ def solplot_amp(parmdb, imageroot, refstationi, norm_amp_lim=False, median_amp=F
         stationsnames = np.array([name for name in stationsnames if name[0] in ['C','R'] ])
     Nstat = len(stationsnames)
 
-    refstation = stationsnames[refstationi]
-    times = soldict['Gain:1:1:Real:{s}'.format(s=refstation)]['times']
+    times = solstore.get_axes('Gain:Real')['times']
     times = scaletimes(times)
 
-    real11_ref = soldict['Gain:1:1:Real:{s}'.format(s=refstation)]['values']
-    real00_ref = soldict['Gain:0:0:Real:{s}'.format(s=refstation)]['values']
-    imag11_ref = soldict['Gain:1:1:Imag:{s}'.format(s=refstation)]['values']
-    imag00_ref = soldict['Gain:0:0:Imag:{s}'.format(s=refstation)]['values']
+    reals11 = get_station_values(solstore, 'Gain:Real', '1:1', stationsnames)
+    reals00 = get_station_values(solstore, 'Gain:Real', '0:0', stationsnames)
+    imags11 = get_station_values(solstore, 'Gain:Imag', '1:1', stationsnames)
+    imags00 = get_station_values(solstore, 'Gain:Imag', '0:0', stationsnames)
+    real11_ref = reals11[refstationi]
+    real00_ref = reals00[refstationi]
+    imag11_ref = imags11[refstationi]
+    imag00_ref = imags00[refstationi]
 
 
     if fourpol:
-      real10_ref = soldict['Gain:1:0:Real:{s}'.format(s=refstation)]['values']
-      real01_ref = soldict['Gain:0:1:Real:{s}'.format(s=refstation)]['values']
-      imag10_ref = soldict['Gain:1:0:Imag:{s}'.format(s=refstation)]['values']
-      imag01_ref = soldict['Gain:0:1:Imag:{s}'.format(s=refstation)]['values']
+      reals10 = get_station_values(solstore, 'Gain:Real', '1:0', stationsnames)
+      reals01 = get_station_values(solstore, 'Gain:Real', '0:1', stationsnames)
+      imags10 = get_station_values(solstore, 'Gain:Imag', '1:0', stationsnames)
+      imags01 = get_station_values(solstore, 'Gain:Imag', '0:1', stationsnames)
+      real10_ref = reals10[refstationi]
+      real01_ref = reals01[refstationi]
+      imag10_ref = imags10[refstationi]
+      imag01_ref = imags01[refstationi]
       valscorr10 = real10_ref +1.j*imag10_ref
       valscorr01 = real01_ref +1.j*imag01_ref
       amp01_ref = np.abs(valscorr01)
@@ -486,10 +511,10 @@ def solplot_amp(parmdb, imageroot, refstationi, norm_amp_lim=False, median_amp=F
         ymax = 0
         for istat, station in enumerate(stationsnames):
 
-            real11 = soldict['Gain:1:1:Real:{s}'.format(s=station)]['values'][:, chan_indx]
-            real00 = soldict['Gain:0:0:Real:{s}'.format(s=station)]['values'][:, chan_indx]
-            imag11 = soldict['Gain:1:1:Imag:{s}'.format(s=station)]['values'][:, chan_indx]
-            imag00 = soldict['Gain:0:0:Imag:{s}'.format(s=station)]['values'][:, chan_indx]
+            real11 = reals11[istat][:, chan_indx]
+            real00 = reals00[istat][:, chan_indx]
+            imag11 = imags11[istat][:, chan_indx]
+            imag00 = imags00[istat][:, chan_indx]
 
             valscorr00 = real00 +1.j*imag00
             valscorr11 = real11 +1.j*imag11
@@ -500,10 +525,10 @@ def solplot_amp(parmdb, imageroot, refstationi, norm_amp_lim=False, median_amp=F
             amp11 = np.abs(valscorr11)
 
             if fourpol:
-                real10 = soldict['Gain:1:0:Real:{s}'.format(s=station)]['values'][:, chan_indx]
-                real01 = soldict['Gain:0:1:Real:{s}'.format(s=station)]['values'][:, chan_indx]
-                imag10 = soldict['Gain:1:0:Imag:{s}'.format(s=station)]['values'][:, chan_indx]
-                imag01 = soldict['Gain:0:1:Imag:{s}'.format(s=station)]['values'][:, chan_indx]
+                real10 = reals10[istat][:, chan_indx]
+                real01 = reals01[istat][:, chan_indx]
+                imag10 = imags10[istat][:, chan_indx]
+                imag01 = imags01[istat][:, chan_indx]
 
                 valscorr01 = real01 +1.j*imag01
                 valscorr10 = real10 +1.j*imag10
@@ -581,8 +606,6 @@ def solplot_amp(parmdb, imageroot, refstationi, norm_amp_lim=False, median_amp=F
 
         fa.savefig(imageroot+"_amp_channel{}.png".format(chan_indx),dpi=100)
         plt.close(fa)
-    parmdbmtable = False
-    del(soldict)
 
 
 def main(parmdb, imageroot, freq=150.0, plot_tec=True, plot_tec_scalarphase=True, plot_amp=True,
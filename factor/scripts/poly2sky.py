@@ -7,7 +7,6 @@ from argparse import RawTextHelpFormatter
 from astropy.io import fits
 from astropy import wcs
 from astropy.coordinates import Angle
-from astropy.table import Table
 import numpy as np
 from numpy.polynomial.polynomial import polyval
 import casacore.tables as pt
@@ -15,6 +14,7 @@ import re
 import sys
 import os
 import glob
+from factor.lib.polygon import sexagesimal2deg
 
 
 def ra2hhmmss(deg):
@@ -162,6 +162,126 @@ def processSpectralTerms(terms):
     return terms
 
 
+def read_components(filename, columns):
+    """
+    Reads a WSClean component list
+
+    The file is parsed line by line (see processLine()). Each column is
+    converted to int or float values if all its non-empty entries can be
+    converted, and is kept as strings otherwise
+
+    Parameters
+    ----------
+    filename : str
+        Filename of component list
+    columns : list of str
+        Names of the columns
+
+    Returns
+    -------
+    ref_freq : float
+        Reference frequency of the spectral terms in Hz
+    data : dict
+        Dict with a list of values for each column
+
+    """
+    ref_freq = None
+    rows = []
+    ncols = len(columns)
+    with open(filename) as f:
+        for line in f:
+            if line.startswith("# ReferenceFrequency"):
+                ref_freq = float(line.split('=')[1].strip())
+                continue
+            if line.strip() == '':
+                continue
+            outline = processLine(line, ncols)
+            if outline is not None:
+                rows.append([v.strip() for v in outline.split(',')[:ncols]])
+
+    data = {}
+    for i, column in enumerate(columns):
+        values = [row[i] for row in rows]
+        for converter in (int, float):
+            try:
+                data[column] = [converter(v) if v != '' else v for v in values]
+                break
+            except ValueError:
+                pass
+        else:
+            data[column] = values
+
+    return ref_freq, data
+
+
+def get_spectral_terms(terms_list):
+    """
+    Returns an array of polynomial spectral terms
+
+    Parameters
+    ----------
+    terms_list : list
+        List of spectral terms of each component (see processSpectralTerms())
+
+    Returns
+    -------
+    terms : array
+        Array of terms with shape (nterms, ncomponents). Components with fewer
+        terms than others are padded with zeros, which does not change the
+        value of their polynomial
+
+    """
+    terms_list = [np.atleast_1d(processSpectralTerms(t)) for t in terms_list]
+    nterms = max([len(t) for t in terms_list])
+    terms = np.zeros((nterms, len(terms_list)))
+    for i, t in enumerate(terms_list):
+        terms[:len(t), i] = t
+
+    return terms
+
+
+def get_in_mask(mask, w, ra, dec):
+    """
+    Returns whether positions fall in a mask
+
+    Parameters
+    ----------
+    mask : array
+        Mask image data
+    w : WCS object
+        WCS of mask image
+    ra : list
+        RA values (strings in makesourcedb format or floats in degrees)
+    dec : list
+        Dec values (strings in makesourcedb format or floats in degrees)
+
+    Returns
+    -------
+    in_mask : array of bool
+        False for each position that falls on a mask pixel < 1 or outside the
+        mask image, and True otherwise
+
+    """
+    npos = len(ra)
+    ra_deg = sexagesimal2deg(ra, True)
+    if ra_deg is None:
+        ra_deg = RA2Angle(ra).value
+    dec_deg = sexagesimal2deg(dec, False)
+    if dec_deg is None:
+        dec_deg = Dec2Angle(dec).value
+    pix = w.wcs_world2pix(np.array([ra_deg, dec_deg, [0]*npos, [0]*npos]).T, 0)
+
+    # Round half away from zero, as round() does
+    xpix = (np.sign(pix[:, 0]) * np.floor(np.abs(pix[:, 0]) + 0.5)).astype(int)
+    ypix = (np.sign(pix[:, 1]) * np.floor(np.abs(pix[:, 1]) + 0.5)).astype(int)
+    in_image = ((xpix >= 0) & (xpix < mask.shape[3]) & (ypix >= 0) &
+        (ypix < mask.shape[2]))
+    in_mask = np.zeros(npos, dtype=bool)
+    in_mask[in_image] = ~(mask[0, 0, ypix[in_image], xpix[in_image]] < 1)
+
+    return in_mask
+
+
 def main(model_root, ms_file, skymodel, fits_mask=None, min_peak_flux_jy=0.0001,
     max_residual_jy=0.0):
     """
@@ -203,19 +323,9 @@ def main(model_root, ms_file, skymodel, fits_mask=None, min_peak_flux_jy=0.0001,
     sw.close()
 
     # Read in sky model
-    ncols = 8
-    outlines = ['Name, Type, Ra, Dec, SpectralTerms, MajorAxis, MinorAxis, Orientation']
-    polymodel = model_root + '-components.txt'
-    with open(polymodel) as f:
-        for line in f:
-            if line.startswith("# ReferenceFrequency"):
-                ref_freq = float(line.split('=')[1].strip())
-            else:
-                outline = processLine(line, ncols)
-                if outline is not None:
-                    outlines.append(outline)
-    data = Table.read(outlines, format='ascii', guess=False, delimiter=',',
-        header_start=0, data_start=1)
+    columns = ['Name', 'Type', 'Ra', 'Dec', 'SpectralTerms', 'MajorAxis',
+        'MinorAxis', 'Orientation']
+    ref_freq, data = read_components(model_root + '-components.txt', columns)
 
     # Find model images and read in frequencies
     fits_models = glob.glob(model_root+'-00*-model.fits')
@@ -237,44 +347,39 @@ def main(model_root, ms_file, skymodel, fits_mask=None, min_peak_flux_jy=0.0001,
     sky_freq = min(freqs, key=lambda x:abs(x-ms_freq))
 
     # Check if fits mask is empty
+    keep = range(len(data['Name']))
     if fits_mask is not None:
         if fits_mask.lower() == 'empty':
             # Handle case in which no sources were found during masking
-            data = []
-            mask = None
-        else:
+            keep = []
+        elif len(keep) > 0:
+            # Discard components not in the mask
             mask = fits.getdata(fits_mask, 0, ignore_missing_end=True)
             hdr = fits.getheader(fits_mask, 0, ignore_missing_end=True)
             w = wcs.WCS(hdr)
-    else:
-        mask = None
-
-    # Discard components not in the mask, if given
-    if mask is not None:
-        pix = w.wcs_world2pix(np.array([RA2Angle(data['Ra'].tolist()),
-            Dec2Angle(data['Dec'].tolist()), [0]*len(data), [0]*len(data)]).T, 0)
-        not_in_mask = []
-        for i, p in enumerate(pix):
-            if mask[0, 0, int(round(p[1])), int(round(p[0]))] < 1:
-                not_in_mask.append(i)
-        data.remove_rows(not_in_mask)
+            in_mask = get_in_mask(mask, w, data['Ra'], data['Dec'])
+            keep = np.where(in_mask)[0]
+
+    # Evaluate the fluxes of all components at once
+    if len(keep) > 0:
+        terms = get_spectral_terms([data['SpectralTerms'][k] for k in keep])
+        fluxes = polyval(sky_freq/ref_freq, terms)
 
     # Write sky model
     with open(skymodel, 'w') as outfile:
         outfile.write('FORMAT = Name, Type, Ra, Dec, I, Q, U, V, ReferenceFrequency, '
             'MajorAxis, MinorAxis, Orientation\n')
-        for i, s in enumerate(data):
-            polyterms = processSpectralTerms(s['SpectralTerms'])
-            flux = polyval(sky_freq/ref_freq, polyterms)
+        lines = []
+        for i, k in enumerate(keep):
             name = 'cc{}'.format(i)
-            if s['Type'] == 'POINT':
-                outfile.write('{0}, POINT, {1}, {2}, {3}, 0.0, 0.0, 0.0, {4}, , , \n'
-                    .format(name, s['Ra'], s['Dec'], flux, ms_freq))
-            elif s['Type'] == 'GAUSSIAN':
-                outfile.write('{0}, GAUSSIAN, {1}, {2}, {3}, 0.0, 0.0, 0.0, {4}, {5}, {6}, {7}\n'
-                    .format(name, s['Ra'], s['Dec'], flux, ms_freq,
-                    s['MajorAxis'], s['MinorAxis'], s['Orientation']))
-
+            if data['Type'][k] == 'POINT':
+                lines.append('{0}, POINT, {1}, {2}, {3}, 0.0, 0.0, 0.0, {4}, , , \n'
+                    .format(name, data['Ra'][k], data['Dec'][k], fluxes[i], ms_freq))
+            elif data['Type'][k] == 'GAUSSIAN':
+                lines.append('{0}, GAUSSIAN, {1}, {2}, {3}, 0.0, 0.0, 0.0, {4}, {5}, {6}, {7}\n'
+                    .format(name, data['Ra'][k], data['Dec'][k], fluxes[i], ms_freq,
+                    data['MajorAxis'][k], data['MinorAxis'][k], data['Orientation'][k]))
+        outfile.writelines(lines)
 
 if __name__ == '__main__':
     descriptiontext = "Make a makesourcedb sky model from WSClean fits model images.\n"
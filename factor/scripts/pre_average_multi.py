@@ -10,14 +10,25 @@ import sys
 import os
 import itertools
 import pickle
+from multiprocessing.pool import ThreadPool
 from scipy.ndimage.filters import gaussian_filter1d as gfilter
 import casacore.tables as pt
 import lofar.parmdb
 from astropy.stats import median_absolute_deviation
+from factor.lib import baselines
+
+# Truncation (in units of stddev) of the Gaussian kernel used by gfilter, which
+# sets the overlap needed between blocks in the streaming engine
+STREAMING_KERNEL_TRUNCATE = 4.0
+
+# Approximate number of bytes needed per visibility (data, weight and flag
+# buffers, plus the temporary arrays of the smoothing) in the streaming engine
+STREAMING_BYTES_PER_CELL = 128
 
 
 def main(ms_input, parmdb_input, input_colname, output_data_colname, output_weights_colname,
-    target_rms_rad, minutes_per_block=10.0, baseline_file=None, verbose=True):
+    target_rms_rad, minutes_per_block=10.0, baseline_file=None, verbose=True,
+    engine='vectorized', max_memory_gb=4.0, nthreads=1, baseline_cache_dir=None):
     """
     Pre-average data using a sliding Gaussian kernel on the weights
 
@@ -36,6 +47,28 @@ def main(ms_input, parmdb_input, input_colname, output_data_colname, output_weig
         Name of the column in the MS into which the averaged data weights are written
     target_rms_rad : float (str)
         The target RMS for the phase noise in the input parmDBs. (Or whatever???)
+    minutes_per_block : float, optional
+        Length in minutes of the time blocks used to find the ionfactor
+    baseline_file : str, optional
+        Pickle file with the dict of baseline lengths. If given,
+        baseline_cache_dir is ignored
+    verbose : bool, optional
+        If True, print progress
+    engine : str, optional
+        Averaging engine: 'vectorized' (baselines sorted once and smoothed in
+        batches), 'loop' (original baseline-by-baseline loop), or 'streaming'
+        (as 'vectorized', but reading and writing the data in blocks of rows to
+        limit memory usage). All give identical results
+    max_memory_gb : float (str), optional
+        Memory budget in GB for the data blocks when engine = 'streaming'
+    nthreads : int (str), optional
+        Number of threads used to smooth the baselines in parallel (not used
+        when engine = 'loop')
+    baseline_cache_dir : str, optional
+        Directory with the cache of baseline lengths. The baseline lengths are
+        read from the cache file that matches the ANTENNA table of the input
+        MSs (the file is made if it does not yet exist). If None (and
+        baseline_file is None), the baseline lengths are always computed
     """
 
     # convert input to needed types
@@ -47,17 +80,26 @@ def main(ms_input, parmdb_input, input_colname, output_data_colname, output_weig
 
     if type(target_rms_rad) is str:
         target_rms_rad = float(target_rms_rad)
-    if baseline_file is None:
+    if type(max_memory_gb) is str:
+        max_memory_gb = float(max_memory_gb)
+    if type(nthreads) is str:
+        nthreads = int(nthreads)
+    if baseline_file is not None:
+        if not os.path.exists(baseline_file):
+            print('Cannot find baseline_file. Exiting...')
+            sys.exit(1)
+        with open(baseline_file, 'rb') as f:
+            baseline_dict = pickle.load(f)
+    elif baseline_cache_dir is not None:
+        if verbose:
+            print('Reading baseline lengths from cache...')
+        check_antenna_tables(ms_list)
+        baseline_dict = baselines.get_cached_baseline_lengths(ms_list[0],
+            baseline_cache_dir)
+    else:
         if verbose:
             print('Calculating baseline lengths...')
         baseline_dict = get_baseline_lengths(ms_list)
-    elif os.path.exists(baseline_file):
-        f = open('baseline_file', 'r')
-        baseline_dict = pickle.load(f)
-        f.close()
-    else:
-        print('Cannot find baseline_file. Exiting...')
-        sys.exit(1)
 
     # Iterate through time chunks and find the lowest ionfactor
     start_times = []
@@ -100,47 +142,31 @@ def main(ms_input, parmdb_input, input_colname, output_data_colname, output_weig
         print('Using ionfactor = {}'.format(ionfactor_min))
         print('Averaging...')
     BLavg_multi(sorted_ms_dict, baseline_dict, input_colname, output_data_colname,
-        output_weights_colname, ionfactor_min)
+        output_weights_colname, ionfactor_min, engine=engine,
+        max_memory_gb=max_memory_gb, nthreads=nthreads)
 
 
 def get_baseline_lengths(ms_list, check_antennas=True):
     """
     Returns dict of baseline lengths in km for all baselines in input dataset
     """
+    if check_antennas:
+        check_antenna_tables(ms_list)
+    return baselines.get_baseline_lengths(ms_list[0])
+
+
+def check_antenna_tables(ms_list):
+    """
+    Checks that all MSs have the same ANTENNA table
+    """
     anttab = pt.table(ms_list[0]+'::ANTENNA', ack=False)
     antnames = anttab.getcol('NAME')
     anttab.close()
-    if check_antennas:
-        for ms_file in ms_list[1:]:
-            anttab = pt.table(ms_file+'::ANTENNA', ack=False)
-            if not all([a == b for a, b in zip(antnames, anttab.getcol('NAME'))]):
-                raise ValueError('pre_average_multi: Measurement sets "'+ms_list[0]+'" and "'+ms_file+'" have different ANTENNA tables!')
-            anttab.close()
-    # concatenate the UW-data from all MSs
-    t = pt.table(ms_list[0], ack=False)
-    ant1 = t.getcol('ANTENNA1')
-    ant2 = t.getcol('ANTENNA2')
-    all_uvw = t.getcol('UVW')
-    t.close()
     for ms_file in ms_list[1:]:
-        t = pt.table(ms_list[0], ack=False)
-        ant1 = np.concatenate( (ant1,t.getcol('ANTENNA1')) )
-        ant2 = np.concatenate( (ant2,t.getcol('ANTENNA2')) )
-        all_uvw = np.concatenate( (all_uvw,t.getcol('UVW')) )
-        t.close()
-    baseline_dict = {}
-    for ant in itertools.product(set(ant1), set(ant2)):
-        if ant[0] >= ant[1]:
-            continue
-        sel1 = np.where(ant1 == ant[0])[0]
-        sel2 = np.where(ant2 == ant[1])[0]
-        sel = sorted(list(frozenset(sel1).intersection(sel2)))
-        uvw = all_uvw[sel, :]
-        uvw_dist = np.sqrt(uvw[:, 0]**2 + uvw[:, 1]**2 + uvw[:, 2]**2)
-        baseline_dict['{0}'.format(ant[0])] = antnames[ant[0]]
-        baseline_dict['{0}'.format(ant[1])] = antnames[ant[1]]
-        baseline_dict['{0}-{1}'.format(ant[0], ant[1])] = np.mean(uvw_dist) / 1.e3
-    return baseline_dict
+        anttab = pt.table(ms_file+'::ANTENNA', ack=False)
+        if not all([a == b for a, b in zip(antnames, anttab.getcol('NAME'))]):
+            raise ValueError('pre_average_multi: Measurement sets "'+ms_list[0]+'" and "'+ms_file+'" have different ANTENNA tables!')
+        anttab.close()
 
 
 def find_ionfactor(parmdb_file, baseline_dict, t1, t2, target_rms_rad=0.2):
@@ -219,9 +245,15 @@ def find_ionfactor(parmdb_file, baseline_dict, t1, t2, target_rms_rad=0.2):
 
 
 def BLavg_multi(sorted_ms_dict, baseline_dict, input_colname, output_data_colname,
-        output_weights_colname, ionfactor, clobber=True, maxgap_sec=1800, check_files = True):
+        output_weights_colname, ionfactor, clobber=True, maxgap_sec=1800, check_files = True,
+        engine='vectorized', max_memory_gb=4.0, nthreads=1):
     """
     Averages data using a sliding Gaussian kernel on the weights
+
+    With engine='streaming', the data are read and written in blocks of rows
+    so that the memory used stays below max_memory_gb (in GB). With the
+    'vectorized' and 'streaming' engines, the baselines are smoothed in
+    parallel using nthreads threads
     """
 
     #### sort msnames into groups with gaps < maxgap_sec
@@ -273,6 +305,10 @@ def BLavg_multi(sorted_ms_dict, baseline_dict, input_colname, output_data_colnam
             all_time_list.append( ms.getcol('TIME_CENTROID') )
             ant1_list.append( ms.getcol('ANTENNA1') )
             ant2_list.append( ms.getcol('ANTENNA2') )
+            if engine == 'streaming':
+                # data are read block by block in smooth_baselines_streaming()
+                ms.close()
+                continue
             all_data_list.append( ms.getcol(input_colname) )
             all_weights_list.append( ms.getcol('WEIGHT_SPECTRUM') )
             all_flags_list.append( ms.getcol('FLAG') )
@@ -285,78 +321,30 @@ def BLavg_multi(sorted_ms_dict, baseline_dict, input_colname, output_data_colnam
                 logging.error('NaNs in unflagged data in {0}!'.format(msfile))
                 sys.exit(1)
 
-        ### iteration on baseline combination
-        for ant in itertools.product(set(ant1_list[0]), set(ant2_list[0])):
-            if ant[0] >= ant[1]:
-                continue
-            sel_list = []
-            weights_list = []
-            data_list = []
-            # select data from all MSs
-            for msindex in xrange(len(ms_names)):
-                sel1 = np.where(ant1_list[msindex] == ant[0])[0]
-                sel2 = np.where(ant2_list[msindex] == ant[1])[0]
-                sel_list.append( sorted(list(frozenset(sel1).intersection(sel2))) )
-
-                # # get weights and data
-                # weights_list.append( all_weights[sel_list[msindex],:,:] )
-                # data_list.append( all_data[sel_list[msindex],:,:] )
-            # combine data and weights into one array
-            data = all_data_list[0][sel_list[0],:,:]
-            weights = all_weights_list[0][sel_list[0],:,:]
-            fillshape = list(data.shape)
-            startidx = [0]
-            endidx = [data.shape[0]]
-            for msindex in xrange(1,len(ms_names)):
-                #pad gap between obs
-                filltimes = np.arange(np.max(all_time_list[msindex-1]),np.min(all_time_list[msindex]),timepersample)
-                fillshape[0] = len(filltimes)
-                data = np.concatenate( (data,np.zeros(fillshape)), axis=0 )
-                weights = np.concatenate( (weights,np.zeros(fillshape)), axis=0  )
-                startidx.append(data.shape[0])
-                data = np.concatenate( (data,all_data_list[msindex][sel_list[msindex],:,:]), axis=0  )
-                weights = np.concatenate( (weights,all_weights_list[msindex][sel_list[msindex],:,:]), axis=0  )
-                endidx.append(data.shape[0])
-
-            # compute the FWHM
-            dist = baseline_dict['{0}-{1}'.format(ant[0], ant[1])]
-            stddev = 30.0 * ionfactor * np.sqrt((25.0 / dist)) * (freq / 60.e6) # in sec
-            stddev = stddev/timepersample # in samples
-
-            #    Multiply every element of the data by the weights, convolve both
-            #    the scaled data and the weights, and then divide the convolved data
-            #    by the convolved weights (translating flagged data into weight=0).
-            #    That's basically the equivalent of a running weighted average with
-            #    a Gaussian window function.
-
-            # weigth data and set bad data to 0 so nans do not propagate
-            data = np.nan_to_num(data*weights)
-
-            # smear weighted data and weights
-            dataR = gfilter(np.real(data), stddev, axis=0)#, truncate=4.)
-            dataI = gfilter(np.imag(data), stddev, axis=0)#, truncate=4.)
-            weights = gfilter(weights, stddev, axis=0)#, truncate=4.)
-
-            # re-create data
-            data = (dataR + 1j * dataI)
-            data[(weights != 0)] /= weights[(weights != 0)] # avoid divbyzero
-            for msindex in xrange(len(ms_names)):
-                all_data_list[msindex][sel_list[msindex],:,:] = data[startidx[msindex]:endidx[msindex],:,:]
-                all_weights_list[msindex][sel_list[msindex],:,:] = weights[startidx[msindex]:endidx[msindex],:,:]
+        ### smooth the data of all baselines
+        if engine == 'streaming':
+            smooth_baselines_streaming(ms_names, ant1_list, ant2_list, all_time_list,
+                input_colname, output_data_colname, output_weights_colname,
+                baseline_dict, ionfactor, freq, timepersample, max_memory_gb,
+                nthreads=nthreads)
+            print "BLavg_multi: Finished one group of measurement sets."
+            continue
+        elif engine == 'vectorized':
+            smooth_baselines_vectorized(ant1_list, ant2_list, all_time_list,
+                all_data_list, all_weights_list, baseline_dict, ionfactor, freq,
+                timepersample, nthreads=nthreads)
+        elif engine == 'loop':
+            smooth_baselines_loop(ant1_list, ant2_list, all_time_list,
+                all_data_list, all_weights_list, baseline_dict, ionfactor, freq,
+                timepersample)
+        else:
+            raise ValueError('BLavg_multi: Unknown averaging engine "{}"'.format(engine))
 
         ### write the data back to the files
         for msindex in xrange(len(ms_names)):
             ms = pt.table(ms_names[msindex], readonly=False, ack=False)
-            # Add the output columns if needed
-            if output_data_colname not in ms.colnames():
-                desc = ms.getcoldesc(input_colname)
-                desc['name'] = output_data_colname
-                ms.addcols(desc)
-            if output_weights_colname not in ms.colnames():
-                desc = ms.getcoldesc('WEIGHT_SPECTRUM')
-                desc['name'] = output_weights_colname
-                ms.addcols(desc)
-
+            add_output_columns(ms, input_colname, output_data_colname,
+                output_weights_colname)
             ms.putcol(output_data_colname, all_data_list[msindex])
             ms.putcol('FLAG', all_flags_list[msindex]) # this saves flags of nans, which is always good
             ms.putcol(output_weights_colname, all_weights_list[msindex])
@@ -364,6 +352,510 @@ def BLavg_multi(sorted_ms_dict, baseline_dict, input_colname, output_data_colnam
         print "BLavg_multi: Finished one group of measurement sets."
 
 
+def add_output_columns(ms, input_colname, output_data_colname, output_weights_colname):
+    """
+    Adds the output columns to an MS if needed
+    """
+    if output_data_colname not in ms.colnames():
+        desc = ms.getcoldesc(input_colname)
+        desc['name'] = output_data_colname
+        ms.addcols(desc)
+    if output_weights_colname not in ms.colnames():
+        desc = ms.getcoldesc('WEIGHT_SPECTRUM')
+        desc['name'] = output_weights_colname
+        ms.addcols(desc)
+
+
+def smooth_baselines_loop(ant1_list, ant2_list, all_time_list, all_data_list,
+        all_weights_list, baseline_dict, ionfactor, freq, timepersample):
+    """
+    Smooths the data of one group of MSs baseline by baseline (original engine)
+
+    The data and weights arrays in all_data_list and all_weights_list are
+    updated in place
+    """
+    nfiles = len(all_data_list)
+    for ant in itertools.product(set(ant1_list[0]), set(ant2_list[0])):
+        if ant[0] >= ant[1]:
+            continue
+        sel_list = []
+        # select data from all MSs
+        for msindex in xrange(nfiles):
+            sel1 = np.where(ant1_list[msindex] == ant[0])[0]
+            sel2 = np.where(ant2_list[msindex] == ant[1])[0]
+            sel_list.append( sorted(list(frozenset(sel1).intersection(sel2))) )
+
+        # combine data and weights into one array
+        data = all_data_list[0][sel_list[0],:,:]
+        weights = all_weights_list[0][sel_list[0],:,:]
+        fillshape = list(data.shape)
+        startidx = [0]
+        endidx = [data.shape[0]]
+        for msindex in xrange(1,nfiles):
+            #pad gap between obs
+            filltimes = np.arange(np.max(all_time_list[msindex-1]),np.min(all_time_list[msindex]),timepersample)
+            fillshape[0] = len(filltimes)
+            data = np.concatenate( (data,np.zeros(fillshape)), axis=0 )
+            weights = np.concatenate( (weights,np.zeros(fillshape)), axis=0  )
+            startidx.append(data.shape[0])
+            data = np.concatenate( (data,all_data_list[msindex][sel_list[msindex],:,:]), axis=0  )
+            weights = np.concatenate( (weights,all_weights_list[msindex][sel_list[msindex],:,:]), axis=0  )
+            endidx.append(data.shape[0])
+
+        # compute the FWHM
+        dist = baseline_dict['{0}-{1}'.format(ant[0], ant[1])]
+        stddev = 30.0 * ionfactor * np.sqrt((25.0 / dist)) * (freq / 60.e6) # in sec
+        stddev = stddev/timepersample # in samples
+
+        #    Multiply every element of the data by the weights, convolve both
+        #    the scaled data and the weights, and then divide the convolved data
+        #    by the convolved weights (translating flagged data into weight=0).
+        #    That's basically the equivalent of a running weighted average with
+        #    a Gaussian window function.
+
+        # weigth data and set bad data to 0 so nans do not propagate
+        data = np.nan_to_num(data*weights)
+
+        # smear weighted data and weights
+        dataR = gfilter(np.real(data), stddev, axis=0)#, truncate=4.)
+        dataI = gfilter(np.imag(data), stddev, axis=0)#, truncate=4.)
+        weights = gfilter(weights, stddev, axis=0)#, truncate=4.)
+
+        # re-create data
+        data = (dataR + 1j * dataI)
+        data[(weights != 0)] /= weights[(weights != 0)] # avoid divbyzero
+        for msindex in xrange(nfiles):
+            all_data_list[msindex][sel_list[msindex],:,:] = data[startidx[msindex]:endidx[msindex],:,:]
+            all_weights_list[msindex][sel_list[msindex],:,:] = weights[startidx[msindex]:endidx[msindex],:,:]
+
+
+def get_baseline_index(ant1_list, ant2_list, all_time_list):
+    """
+    Sorts the rows of each MS by (baseline, time) and indexes the baselines
+
+    Only the cross-correlations with ANTENNA1 < ANTENNA2 are indexed (the same
+    baselines as are smoothed by smooth_baselines_loop())
+
+    Parameters
+    ----------
+    ant1_list : list of arrays
+        ANTENNA1 column of each MS
+    ant2_list : list of arrays
+        ANTENNA2 column of each MS
+    all_time_list : list of arrays
+        TIME_CENTROID column of each MS
+
+    Returns
+    -------
+    baselines : array
+        Array of shape (nbaselines, 2) with the antenna pairs of the baselines
+    row_index : list of tuples
+        For each MS, a tuple of (order, starts, counts), where order gives the
+        row numbers sorted by (baseline, time) and starts and counts give the
+        position and number of the rows of each baseline in order
+
+    """
+    nant = max([max(np.max(a1), np.max(a2)) for a1, a2 in
+        zip(ant1_list, ant2_list)]) + 1
+    ant1_set = np.unique(ant1_list[0])
+    ant2_set = np.unique(ant2_list[0])
+
+    # Make a unique id for each baseline
+    blid_list = []
+    for ant1, ant2 in zip(ant1_list, ant2_list):
+        blid_list.append(ant1.astype(np.int64) * nant + ant2)
+    blids = np.unique(np.concatenate([blid[(ant1 < ant2) & np.in1d(ant1, ant1_set) &
+        np.in1d(ant2, ant2_set)] for blid, ant1, ant2 in zip(blid_list, ant1_list,
+        ant2_list)]))
+    baselines = np.column_stack((blids // nant, blids % nant))
+
+    # Sort the rows of each MS once and find the block of each baseline
+    row_index = []
+    for blid, times in zip(blid_list, all_time_list):
+        order = np.lexsort((times, blid))
+        blid_sorted = blid[order]
+        starts = np.searchsorted(blid_sorted, blids, side='left')
+        counts = np.searchsorted(blid_sorted, blids, side='right') - starts
+        row_index.append((order, starts, counts))
+
+    return baselines, row_index
+
+
+def get_fill_lengths(all_time_list, timepersample):
+    """
+    Returns the number of samples used to pad the gap before each MS
+    """
+    fill_lengths = [0]
+    for msindex in xrange(1, len(all_time_list)):
+        filltimes = np.arange(np.max(all_time_list[msindex-1]),
+            np.min(all_time_list[msindex]), timepersample)
+        fill_lengths.append(len(filltimes))
+
+    return fill_lengths
+
+
+def get_baseline_groups(baselines, row_index, baseline_dict, ionfactor, freq,
+        timepersample):
+    """
+    Groups baselines that can be smoothed in one go
+
+    Returns a dict with (stddev, row counts per MS) as keys and the lists of
+    baseline indices as values
+    """
+    # Compute the stddev of each baseline
+    dist = np.array([baseline_dict['{0}-{1}'.format(a1, a2)] for a1, a2 in baselines])
+    stddev = 30.0 * ionfactor * np.sqrt((25.0 / dist)) * (freq / 60.e6) # in sec
+    stddev = stddev/timepersample # in samples
+
+    groups = {}
+    for blindex in xrange(len(baselines)):
+        key = (stddev[blindex], tuple([counts[blindex] for _, _, counts in row_index]))
+        groups.setdefault(key, []).append(blindex)
+
+    return groups
+
+
+def get_work_dtypes(nfiles, data_dtype, weights_dtype):
+    """
+    Returns the dtypes in which the data and weights are smoothed
+
+    Padding the gaps with zeros promotes the data to double precision when
+    there is more than one MS (see smooth_baselines_loop())
+    """
+    if nfiles > 1:
+        return (np.result_type(data_dtype, np.float64),
+            np.result_type(weights_dtype, np.float64))
+    else:
+        return data_dtype, weights_dtype
+
+
+def smooth_stacked_baselines(data, weights, stddev):
+    """
+    Smooths stacked (baseline, time, ...) data and weights along the time axis
+
+    The operations are those of smooth_baselines_loop()
+    """
+    # weight data, smear weighted data and weights, and re-create data
+    data = np.nan_to_num(data*weights)
+    dataR = gfilter(np.real(data), stddev, axis=1)
+    dataI = gfilter(np.imag(data), stddev, axis=1)
+    weights = gfilter(weights, stddev, axis=1)
+    data = (dataR + 1j * dataI)
+    data[(weights != 0)] /= weights[(weights != 0)] # avoid divbyzero
+
+    return data, weights
+
+
+def smooth_baselines_vectorized(ant1_list, ant2_list, all_time_list, all_data_list,
+        all_weights_list, baseline_dict, ionfactor, freq, timepersample, nthreads=1):
+    """
+    Smooths the data of one group of MSs, batching baselines with equal stddev
+
+    The rows are sorted and indexed by baseline in a single pass. Baselines
+    with the same smoothing width and the same number of rows in each MS are
+    then stacked into one array and smoothed together. The operations are the
+    same as those of smooth_baselines_loop(), done in the same precision, so
+    the results are identical. The groups of baselines are independent and
+    are processed in parallel by nthreads threads. The data and weights arrays
+    in all_data_list and all_weights_list are updated in place
+    """
+    nfiles = len(all_data_list)
+    baselines, row_index = get_baseline_index(ant1_list, ant2_list, all_time_list)
+    if len(baselines) == 0:
+        return
+    fill_lengths = get_fill_lengths(all_time_list, timepersample)
+    groups = get_baseline_groups(baselines, row_index, baseline_dict, ionfactor,
+        freq, timepersample)
+    data_dtype, weights_dtype = get_work_dtypes(nfiles, all_data_list[0].dtype,
+        all_weights_list[0].dtype)
+
+    def smooth_group(group):
+        (group_stddev, group_counts), blindices = group
+        blindices = np.array(blindices)
+        nrows = sum(group_counts) + sum(fill_lengths)
+        shape = (len(blindices), nrows) + all_data_list[0].shape[1:]
+        data = np.zeros(shape, dtype=data_dtype)
+        weights = np.zeros(shape, dtype=weights_dtype)
+
+        # Gather the rows of all baselines into the (baseline, time, ...) arrays
+        segments = []
+        startidx = 0
+        for msindex in xrange(nfiles):
+            order, starts, counts = row_index[msindex]
+            startidx += fill_lengths[msindex]
+            endidx = startidx + group_counts[msindex]
+            rows = order[starts[blindices][:, np.newaxis] +
+                np.arange(group_counts[msindex])]
+            data[:, startidx:endidx] = all_data_list[msindex][rows]
+            weights[:, startidx:endidx] = all_weights_list[msindex][rows]
+            segments.append((rows, startidx, endidx))
+            startidx = endidx
+
+        data, weights = smooth_stacked_baselines(data, weights, group_stddev)
+
+        # Scatter the smoothed rows back (the rows of the groups do not overlap)
+        for msindex, (rows, startidx, endidx) in enumerate(segments):
+            all_data_list[msindex][rows] = data[:, startidx:endidx]
+            all_weights_list[msindex][rows] = weights[:, startidx:endidx]
+
+    run_in_threads(smooth_group, groups.items(), nthreads)
+
+
+def run_in_threads(func, items, nthreads):
+    """
+    Calls func on each item, using a pool of nthreads threads if nthreads > 1
+
+    The smoothing is done by scipy.ndimage and numpy, which release the GIL
+    """
+    if nthreads > 1 and len(items) > 1:
+        pool = ThreadPool(processes=min(nthreads, len(items)))
+        try:
+            pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for item in items:
+            func(item)
+
+
+def get_row_positions(row_index, nrows_list, fill_lengths):
+    """
+    Finds the position of each row in the gap-padded timeline of its baseline
+
+    Parameters
+    ----------
+    row_index : list of tuples
+        Baseline index of each MS, as returned by get_baseline_index()
+    nrows_list : list of int
+        Number of rows of each MS
+    fill_lengths : list of int
+        Number of samples used to pad the gap before each MS
+
+    Returns
+    -------
+    pos_list : list of arrays
+        For each MS, the sample position of each row (-1 for rows that are not
+        smoothed)
+    rowbl_list : list of arrays
+        For each MS, the baseline index of each row (-1 for rows that are not
+        smoothed)
+
+    """
+    pos_list = []
+    rowbl_list = []
+    offsets = np.zeros(len(row_index[0][1]), dtype=np.int64)
+    for (order, starts, counts), nrows, fill in zip(row_index, nrows_list, fill_lengths):
+        offsets += fill
+        blindex = np.repeat(np.arange(len(starts)), counts)
+        rank = np.arange(len(blindex)) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = order[np.repeat(starts, counts) + rank]
+        pos = np.empty(nrows, dtype=np.int64)
+        pos.fill(-1)
+        pos[rows] = offsets[blindex] + rank
+        rowbl = np.empty(nrows, dtype=np.int64)
+        rowbl.fill(-1)
+        rowbl[rows] = blindex
+        pos_list.append(pos)
+        rowbl_list.append(rowbl)
+        offsets += counts
+
+    return pos_list, rowbl_list
+
+
+def read_rows(ms, input_colname, startrow, endrow):
+    """
+    Reads data, weights and flags for a range of rows, flagging NaNs
+
+    The weights of flagged data are set to 0
+    """
+    nrow = endrow - startrow
+    data = ms.getcol(input_colname, startrow=startrow, nrow=nrow)
+    weights = ms.getcol('WEIGHT_SPECTRUM', startrow=startrow, nrow=nrow)
+    flags = ms.getcol('FLAG', startrow=startrow, nrow=nrow)
+    flags[ np.isnan(data) ] = True # flag NaNs
+    weights = weights * ~flags # set weight of flagged data to 0
+
+    return data, weights, flags
+
+
+def smooth_baselines_streaming(ms_names, ant1_list, ant2_list, all_time_list,
+        input_colname, output_data_colname, output_weights_colname, baseline_dict,
+        ionfactor, freq, timepersample, max_memory_gb, nthreads=1):
+    """
+    Smooths the data of one group of MSs, reading and writing blocks of rows
+
+    Each MS is processed in blocks of whole timeslots. For each block, the rows
+    of all MSs that lie within the truncation radius of the Gaussian kernel are
+    read as well, so that the smoothed values are identical to those of
+    smooth_baselines_vectorized(). As the output columns may be the input
+    columns, a block is only written once no later block needs its unsmoothed
+    values. The block size is chosen so that the memory used stays below
+    max_memory_gb. Within a block, the groups of baselines are processed in
+    parallel by nthreads threads
+    """
+    nfiles = len(ms_names)
+    baselines, row_index = get_baseline_index(ant1_list, ant2_list, all_time_list)
+    fill_lengths = get_fill_lengths(all_time_list, timepersample)
+    if len(baselines) > 0:
+        groups = get_baseline_groups(baselines, row_index, baseline_dict, ionfactor,
+            freq, timepersample)
+    else:
+        groups = {}
+    group_keys = list(groups.keys())
+    group_nsamples = [sum(counts) + sum(fill_lengths) for _, counts in group_keys]
+    group_of_bl = np.zeros(len(baselines), dtype=np.int64)
+    slot_of_bl = np.zeros(len(baselines), dtype=np.int64)
+    for gindex, key in enumerate(group_keys):
+        group_of_bl[groups[key]] = gindex
+        slot_of_bl[groups[key]] = np.arange(len(groups[key]))
+    if len(group_keys) > 0:
+        radius = int(STREAMING_KERNEL_TRUNCATE * max([stddev for stddev, _ in
+            group_keys]) + 0.5)
+    else:
+        radius = 0
+
+    # Find the position of each row in the timeline of its baseline, and sort
+    # the smoothed rows by position, so that the rows needed for a block can be
+    # looked up quickly
+    pos_list, rowbl_list = get_row_positions(row_index, [len(ant1) for ant1 in
+        ant1_list], fill_lengths)
+    pos_order_list = []
+    pos_sorted_list = []
+    for pos in pos_list:
+        pos_order = np.argsort(pos, kind='mergesort')
+        pos_order = pos_order[pos[pos_order] >= 0]
+        pos_order_list.append(pos_order)
+        pos_sorted_list.append(pos[pos_order])
+
+    # Open the MSs and add the output columns if needed
+    ms_list = []
+    for msfile in ms_names:
+        ms = pt.table(msfile, readonly=False, ack=False)
+        add_output_columns(ms, input_colname, output_data_colname,
+            output_weights_colname)
+        ms_list.append(ms)
+    cell = ms_list[0].getcell(input_colname, 0)
+    data_dtype, weights_dtype = get_work_dtypes(nfiles, cell.dtype,
+        ms_list[0].getcell('WEIGHT_SPECTRUM', 0).dtype)
+
+    # Determine the block size from the memory budget. The blocks are extended
+    # by the kernel radius on both sides
+    bytes_per_row = cell.size * STREAMING_BYTES_PER_CELL
+    rows_per_timeslot = max([len(times) // len(np.unique(times)) for times in
+        all_time_list])
+    block_rows = (int(max_memory_gb * 1024**3 / bytes_per_row) -
+        2 * radius * rows_per_timeslot)
+    if block_rows < rows_per_timeslot:
+        print('Memory budget of {0} GB is too small for the kernel radius of {1} '
+            'samples. Using blocks of one timeslot'.format(max_memory_gb, radius))
+        block_rows = rows_per_timeslot
+
+    # Divide each MS into blocks of whole timeslots and find the range of sample
+    # positions needed to smooth each block
+    blocks = []
+    for msindex, times in enumerate(all_time_list):
+        nrows = len(times)
+        boundaries = np.append(np.nonzero(np.diff(times))[0] + 1, nrows)
+        startrow = 0
+        while startrow < nrows:
+            i = np.searchsorted(boundaries, startrow + block_rows, side='right') - 1
+            if i < 0 or boundaries[i] <= startrow:
+                i = np.searchsorted(boundaries, startrow, side='right')
+            endrow = boundaries[i]
+            pos = pos_list[msindex][startrow:endrow]
+            pos = pos[pos >= 0]
+            if len(pos) > 0:
+                blocks.append((msindex, startrow, endrow, max(0, np.min(pos) - radius),
+                    np.max(pos) + radius + 1, np.max(pos)))
+            else:
+                blocks.append((msindex, startrow, endrow, None, None, -1))
+            startrow = endrow
+
+    # For each block, the lowest position that is read by it or any later block
+    next_lowpos = [np.inf] * (len(blocks) + 1)
+    for bindex in xrange(len(blocks)-1, -1, -1):
+        lowpos = blocks[bindex][3]
+        if lowpos is None:
+            lowpos = np.inf
+        next_lowpos[bindex] = min(lowpos, next_lowpos[bindex+1])
+
+    pending = []
+    for bindex, (msindex, startrow, endrow, lowpos, highpos, maxpos) in enumerate(blocks):
+        out_data, out_weights, out_flags = read_rows(ms_list[msindex], input_colname,
+            startrow, endrow)
+
+        if lowpos is not None:
+            # Read the rows of all MSs that lie within the window, sorted by group
+            group_entries = {}
+            for msindex2 in xrange(nfiles):
+                i0 = np.searchsorted(pos_sorted_list[msindex2], lowpos, side='left')
+                i1 = np.searchsorted(pos_sorted_list[msindex2], highpos, side='left')
+                rows = pos_order_list[msindex2][i0:i1]
+                if len(rows) == 0:
+                    continue
+                rmin = np.min(rows)
+                rmax = np.max(rows) + 1
+                if msindex2 == msindex and rmin >= startrow and rmax <= endrow:
+                    data, weights, rowoffset = out_data, out_weights, startrow
+                else:
+                    data, weights, _ = read_rows(ms_list[msindex2], input_colname,
+                        rmin, rmax)
+                    rowoffset = rmin
+                gindices = group_of_bl[rowbl_list[msindex2][rows]]
+                gorder = np.argsort(gindices, kind='mergesort')
+                rows = rows[gorder]
+                gindices = gindices[gorder]
+                gstarts = np.append(0, np.nonzero(np.diff(gindices))[0] + 1)
+                for gindex, grows in zip(gindices[gstarts], np.split(rows, gstarts[1:])):
+                    group_entries.setdefault(gindex, []).append((msindex2, grows,
+                        data, weights, rowoffset))
+
+            # Smooth each group over the window and keep the rows of this block
+            def smooth_group(group):
+                gindex, entries = group
+                group_stddev = group_keys[gindex][0]
+                nsamples = min(highpos, group_nsamples[gindex]) - lowpos
+                shape = (len(groups[group_keys[gindex]]), nsamples) + cell.shape
+                gdata = np.zeros(shape, dtype=data_dtype)
+                gweights = np.zeros(shape, dtype=weights_dtype)
+                for msindex2, grows, data, weights, rowoffset in entries:
+                    slots = slot_of_bl[rowbl_list[msindex2][grows]]
+                    samples = pos_list[msindex2][grows] - lowpos
+                    gdata[slots, samples] = data[grows - rowoffset]
+                    gweights[slots, samples] = weights[grows - rowoffset]
+
+                gdata, gweights = smooth_stacked_baselines(gdata, gweights, group_stddev)
+
+                for msindex2, grows, data, weights, rowoffset in entries:
+                    if msindex2 != msindex:
+                        continue
+                    keep = (grows >= startrow) & (grows < endrow)
+                    grows = grows[keep]
+                    slots = slot_of_bl[rowbl_list[msindex2][grows]]
+                    samples = pos_list[msindex2][grows] - lowpos
+                    out_data[grows - startrow] = gdata[slots, samples]
+                    out_weights[grows - startrow] = gweights[slots, samples]
+
+            run_in_threads(smooth_group, group_entries.items(), nthreads)
+
+        # Write the blocks whose unsmoothed values are no longer needed
+        pending.append((msindex, startrow, endrow, maxpos, out_data, out_weights, out_flags))
+        still_pending = []
+        for msindex2, startrow2, endrow2, maxpos2, data, weights, flags in pending:
+            if maxpos2 < next_lowpos[bindex+1]:
+                nrow = endrow2 - startrow2
+                ms_list[msindex2].putcol(output_data_colname, data, startrow=startrow2, nrow=nrow)
+                ms_list[msindex2].putcol('FLAG', flags, startrow=startrow2, nrow=nrow) # this saves flags of nans, which is always good
+                ms_list[msindex2].putcol(output_weights_colname, weights, startrow=startrow2, nrow=nrow)
+            else:
+                still_pending.append((msindex2, startrow2, endrow2, maxpos2, data,
+                    weights, flags))
+        pending = still_pending
+
+    for ms in ms_list:
+        ms.close()
+
 def smooth(x, window_len=10, window='hanning'):
     """smooth the data using a window with requested size.
 
@@ -507,10 +999,22 @@ if __name__ == '__main__':
     parser.add_argument('output_data_colname', help='Name of output column')
     parser.add_argument('output_weights_colname', help='Name of output column')
     parser.add_argument('target_rms', help='Target rms in Jy/beam')
+    parser.add_argument('--engine', help='Averaging engine', choices=['vectorized', 'loop',
+        'streaming'], default='vectorized')
+    parser.add_argument('--max_memory_gb', help='Memory budget in GB for the streaming engine',
+        type=float, default=4.0)
+    parser.add_argument('--nthreads', help='Number of threads used for the smoothing',
+        type=int, default=1)
+    parser.add_argument('--baseline_file', help='Pickle file with baseline lengths',
+        default=None)
+    parser.add_argument('--baseline_cache_dir', help='Directory with cached baseline lengths',
+        default=None)
     args = parser.parse_args()
 
     ms_input = glob.glob(args.ms_file_pattern)
     parmdb_input = glob.glob(args.parmdb_file_pattern)
 
     main(ms_input, parmdb_input, args.input_colname, args.output_data_colname,
-        args.output_weights_colname, args.target_rms)
+        args.output_weights_colname, args.target_rms, engine=args.engine,
+        baseline_file=args.baseline_file, max_memory_gb=args.max_memory_gb,
+        nthreads=args.nthreads, baseline_cache_dir=args.baseline_cache_dir)
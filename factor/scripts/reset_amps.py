@@ -5,65 +5,31 @@ Script to reset amplitude solutions to unity
 import argparse
 from argparse import RawTextHelpFormatter
 import casacore.tables as pt
-import numpy
-import os
-import lofar.parmdb
 import math
-import shutil
 import numpy as np
+from factor.lib.solution_store import load_solutions, SolutionStore
 
 
 def main(instrument_name, instrument_name_reset):
-    pdb = lofar.parmdb.parmdb(instrument_name)
-    parms = pdb.getValuesGrid('*')
-    key_names = parms.keys()
+    solstore = load_solutions(instrument_name)
+    axes = solstore.get_axes('Gain:Phase')
 
     # determine the number of polarizations in parmdb (2 or 4)
-    if any('Gain:0:1:' in s for s in key_names):
+    if '0:1' in axes['pols']:
         pol_list = ['0:0', '1:1', '0:1', '1:0']
     else:
         pol_list = ['0:0', '1:1']
-
-    # Get station names
-    antenna_list = list(set([s.split(':')[-1] for s in pdb.getNames()]))
-
-    # Identify any gaps in time (frequency gaps are not allowed), as we need to handle
-    # each section separately if gaps are present
-    freqs = parms['Gain:1:1:Ampl:{s}'.format(s=antenna_list[0])]['freqs']
-    freqwidths = parms['Gain:1:1:Ampl:{s}'.format(s=antenna_list[0])]['freqwidths']
-    times = parms['Gain:1:1:Ampl:{s}'.format(s=antenna_list[0])]['times']
-    timewidths = parms['Gain:1:1:Ampl:{s}'.format(s=antenna_list[0])]['timewidths']
-    delta_times = times[1:] - times[:-1]
-    gaps = np.where(delta_times > timewidths[:-1]*2.)
-    if len(gaps[0]) > 0:
-        gaps_ind = gaps[0] + 1
-    else:
-        gaps_ind = []
+    pol_ind = [axes['pols'].index(pol) for pol in pol_list]
+    axes['pols'] = pol_list
 
     # Reset the amplitude solutions to unity
-    if os.path.exists(instrument_name_reset):
-        shutil.rmtree(instrument_name_reset)
-    pdbnew = lofar.parmdb.parmdb(instrument_name_reset, create=True)
-    for pol in pol_list:
-        for antenna in antenna_list:
-            g_start = 0
-            phase = parms['Gain:'+pol+':Phase:'+antenna]['values']
-            for g in gaps_ind:
-                # If time gaps exist, add them one-by-one (except for last one)
-                data_shape = phase[g_start:g].shape
-                pdbnew.addValues('Gain:'+pol+':Phase:{}'.format(antenna), phase[g_start:g], freqs, freqwidths,
-                    times[g_start:g], timewidths[g_start:g], asStartEnd=False)
-                pdbnew.addValues('Gain:'+pol+':Ampl:{}'.format(antenna), numpy.ones(data_shape), freqs, freqwidths,
-                    times[g_start:g], timewidths[g_start:g], asStartEnd=False)
-                g_start = g
+    phase = solstore.get_values('Gain:Phase')[:, pol_ind]
+    solstore_reset = SolutionStore()
+    solstore_reset.set_values('Gain:Phase', phase, axes)
+    solstore_reset.set_values('Gain:Ampl', np.ones(phase.shape), axes)
 
-            # Add remaining time slots
-            data_shape = phase[g_start:].shape
-            pdbnew.addValues('Gain:'+pol+':Phase:{}'.format(antenna), phase[g_start:], freqs, freqwidths,
-                times[g_start:], timewidths[g_start:], asStartEnd=False)
-            pdbnew.addValues('Gain:'+pol+':Ampl:{}'.format(antenna), numpy.ones(data_shape), freqs, freqwidths,
-                times[g_start:], timewidths[g_start:], asStartEnd=False)
-    pdbnew.flush()
+    # Write all values at once for each section between gaps in time
+    solstore_reset.write_parmdb(instrument_name_reset, gap_factor=2.0)
 
 
 if __name__ == '__main__':
@@ -4,15 +4,10 @@ Script to smooth and normalize amplitude solutions
 """
 import argparse
 from argparse import RawTextHelpFormatter
-import casacore.tables as pt
 import numpy
-import os
-import lofar.parmdb
+from factor.lib.solution_store import load_solutions
 import math
 import scipy.signal
-import shutil
-import multiprocessing
-import itertools
 
 
 def median_window_filter(ampl, half_window, threshold):
@@ -66,39 +61,175 @@ def median_window_filter(ampl, half_window, threshold):
     return ampl_tot_copy
 
 
-def smooth_star(inputs):
+def masked_median(values, mask):
     """
-    Simple helper function for pool.map
+    Returns the median along the last axis of a 2-D array, excluding masked values
+
+    As with numpy.median(), the median of a row is NaN if any of its unmasked
+    values is NaN
+
+    Parameters
+    ----------
+    values : array
+        2-D array of values
+    mask : array
+        Boolean array of the same shape as values that is True for values to
+        exclude
+
+    Returns
+    -------
+    median : array
+        Median of each row
+
     """
-    return smooth(*inputs)
+    data = numpy.where(mask, numpy.inf, values)
+    data.sort(axis=-1)
+    nvalid = numpy.sum(~mask, axis=-1)
+    rows = numpy.arange(data.shape[0])
+    lo = data[rows, numpy.maximum(nvalid - 1, 0) // 2]
+    hi = data[rows, nvalid // 2]
+    median = numpy.where(nvalid % 2 == 1, lo, (lo + hi) / 2.0)
+    median[numpy.any(numpy.isnan(values) & ~mask, axis=-1)] = numpy.nan
+
+    return median
+
+
+def median_window_filter_multi(ampl, ndata, half_window, threshold):
+    """
+    Applies the median window filter to many series at once
+
+    The result for each series is identical to that of median_window_filter().
+    The series are mirrored at their edges and each sample is flagged if it
+    lies more than threshold * 1.4826 * MAD from the median of its window (of
+    2 * half_window + 1 samples). Since samples that are flagged are excluded
+    from the windows of later samples, the samples are processed in order,
+    but all series are processed together. Flagged samples are replaced by
+    the median of a window of 2 * half_window - 1 samples
+
+    Parameters
+    ----------
+    ampl : array
+        2-D array of shape (nseries, nsamples). Only the first ndata values of
+        each series are used
+    ndata : array
+        Number of values of each series
+    half_window : int
+        Half size of the window
+    threshold : float
+        Threshold in units of 1.4826 * MAD above which samples are flagged
+
+    Returns
+    -------
+    ampl_filtered : array
+        Filtered copy of ampl
+
+    """
+    nseries, nmax = ampl.shape
+    ndata = numpy.asarray(ndata)
+    rows = numpy.arange(nseries)
+
+    # Pad each series by mirroring at its edges (positions beyond the padded
+    # end of shorter series are never used)
+    pos = numpy.arange(nmax + 2*half_window)[numpy.newaxis, :]
+    n = ndata[:, numpy.newaxis]
+    idx = pos - half_window
+    idx = numpy.where(pos < half_window, numpy.minimum(n - 1, half_window - pos), idx)
+    idx = numpy.where(pos >= n + half_window, numpy.maximum(0, 2*n + half_window - 2 - pos), idx)
+    idx = numpy.clip(idx, 0, nmax - 1)
+    sol = numpy.where(pos < n + 2*half_window, ampl[rows[:, numpy.newaxis], idx], 0.0)
+
+    sol_orig = numpy.copy(sol)
+
+    sol_flag = numpy.zeros(sol.shape, dtype=bool)
+    min_points = math.sqrt(2*half_window + 1)
+    for i in range(half_window, half_window + nmax):
+        active = i < ndata + half_window
+        window = sol[:, i-half_window:i+half_window+1]
+        window_flag = sol_flag[:, i-half_window:i+half_window+1]
+
+        # Compute median of the absolute distance to the median, skipping
+        # series without enough data to get accurate statistics
+        median = masked_median(window, window_flag)
+        q = 1.4826 * masked_median(numpy.abs(window - median[:, numpy.newaxis]), window_flag)
+        enough = numpy.sum(~window_flag, axis=1) >= min_points
+
+        # Flag sample if it is more than 1.4826 * threshold * the
+        # median distance away from the median.
+        sol_flag[:, i] = active & enough & (numpy.abs(sol[:, i] - median) > (threshold * q))
+
+        if i == half_window:
+            # As in median_window_filter(), zeros are replaced with ones after
+            # the first sample is checked
+            sol[sol == 0.0] = True
 
+    # Replace flagged samples with the median of their window (including
+    # flagged samples, as done by scipy.signal.medfilt() in
+    # median_window_filter())
+    ampl_filtered = numpy.copy(ampl)
+    flag_rows, flag_cols = numpy.where(sol_flag[:, half_window:half_window+nmax])
+    if len(flag_rows) > 0:
+        offsets = numpy.arange(-half_window + 1, half_window)[numpy.newaxis, :]
+        windows = sol_orig[flag_rows[:, numpy.newaxis],
+            flag_cols[:, numpy.newaxis] + half_window + offsets]
+        ampl_filtered[flag_rows, flag_cols] = numpy.median(windows, axis=1)
 
-def smooth(chan, real, imag, window):
+    return ampl_filtered
+
+
+def smooth(real, imag, window):
     """
-    Smooth solutions for a single channel
+    Smooth solutions for many series (e.g., stations, polarizations and
+    channels) at once
+
+    Parameters
+    ----------
+    real : array
+        2-D array of shape (ntimes, nseries) of the real part of the solutions
+    imag : array
+        2-D array of shape (ntimes, nseries) of the imaginary part of the
+        solutions
+    window : int
+        Half size of the window of the first median filters
+
+    Returns
+    -------
+    real_smoothed, imag_smoothed : arrays
+        Smoothed solutions
+
     """
     phase = numpy.arctan2(imag, real)
     allamp = numpy.sqrt(imag**2 + real**2)
 
+    # Only series with enough unflagged solutions are smoothed. Their unflagged
+    # solutions are moved to the start of each series
     goodmask = numpy.isfinite(allamp)
-    amp = allamp[goodmask]
-    
-    if len(amp)>7:    
+    ndata = numpy.sum(goodmask, axis=0)
+    cols = numpy.where(ndata > 7)[0]
+    if len(cols) > 0:
+        order = numpy.argsort(~goodmask[:, cols].T, axis=1, kind='mergesort')
+        rows = numpy.arange(len(cols))[:, numpy.newaxis]
+        packed = allamp[:, cols].T[rows, order]
+        valid = numpy.arange(packed.shape[1])[numpy.newaxis, :] < ndata[cols][:, numpy.newaxis]
+        amp = numpy.ones(packed.shape)
+        amp[valid] = packed[valid]
+
         amp = numpy.log10(amp)
-        amp = median_window_filter(amp, window, 6)
-        amp = median_window_filter(amp, window, 6)
-        amp = median_window_filter(amp, 7, 6)
-        amp = median_window_filter(amp, 4, 6)
-        amp = median_window_filter(amp, 3, 6)
+        amp = median_window_filter_multi(amp, ndata[cols], window, 6)
+        amp = median_window_filter_multi(amp, ndata[cols], window, 6)
+        amp = median_window_filter_multi(amp, ndata[cols], 7, 6)
+        amp = median_window_filter_multi(amp, ndata[cols], 4, 6)
+        amp = median_window_filter_multi(amp, ndata[cols], 3, 6)
         amp = 10**amp
 
         # Clip extremely high amplitude solutions to prevent biasing the
         # normalization done later
         high_ind = numpy.where(amp > 5.0)
         amp[high_ind] = 5.0
-        
-        allamp[goodmask] = amp
-        
+
+        amp_cols = allamp[:, cols].T
+        amp_cols[numpy.repeat(rows, order.shape[1], axis=1)[valid], order[valid]] = amp[valid]
+        allamp[:, cols] = amp_cols.T
+
     real_smoothed = allamp * numpy.cos(phase)
     imag_smoothed = allamp * numpy.sin(phase)
 
@@ -115,71 +246,53 @@ def main(instrument_name, instrument_name_smoothed, normalize=True):
     pol_list = ['0:0','1:1']
     gain = 'Gain'
 
-    pdb = lofar.parmdb.parmdb(instrument_name)
-    parms = pdb.getValuesGrid('*')
-
-    key_names = parms.keys()
-    nchans = len(parms[key_names[0]]['freqs'])
-
-    # Get station names
-    antenna_list = set([s.split(':')[-1] for s in pdb.getNames()])
+    # The values are arrays of shape (nstations, npols, ntimes, nchans) that
+    # are held by the store, so changes to them are written to the output
+    # parmdb
+    solstore = load_solutions(instrument_name)
+    real_values = solstore.get_values(gain + ':Real')
+    imag_values = solstore.get_values(gain + ':Imag')
+    pols = solstore.get_axes(gain + ':Real')['pols']
+    pol_ind = [pols.index(pol) for pol in pol_list]
+    nstations, npols, ntimes, nchans = real_values.shape
     window = 4
 
-    # Smooth
-    for pol in pol_list:
-        for antenna in antenna_list:
-            channel_parms_real = [parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan] for chan in range(nchans)]
-            channel_parms_imag = [parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan] for chan in range(nchans)]
-            pool = multiprocessing.Pool()
-            results = pool.map(smooth_star, itertools.izip(range(nchans),
-                channel_parms_real, channel_parms_imag, itertools.repeat(window)))
-            pool.close()
-            pool.join()
-
-            for chan, (real, imag) in enumerate(results):
-                parms[gain + ':' + pol + ':Real:' + antenna]['values'][:, chan] = real
-                parms[gain + ':' + pol + ':Imag:' + antenna]['values'][:, chan] = imag
+    # Smooth all stations, polarizations and channels at once, as columns of
+    # arrays of shape (ntimes, nstations * len(pol_list) * nchans)
+    real = real_values[:, pol_ind].transpose(2, 0, 1, 3).reshape(ntimes, -1)
+    imag = imag_values[:, pol_ind].transpose(2, 0, 1, 3).reshape(ntimes, -1)
+    real, imag = smooth(real, imag, window)
+    real_values[:, pol_ind] = real.reshape(ntimes, nstations, len(pol_ind),
+        nchans).transpose(1, 2, 0, 3)
+    imag_values[:, pol_ind] = imag.reshape(ntimes, nstations, len(pol_ind),
+        nchans).transpose(1, 2, 0, 3)
 
     # Normalize the amplitude solutions to a mean of one across all channels
     if normalize:
         # First find the normalization factor
-        amplist = []
-        for chan in range(nchans):
-            for pol in pol_list:
-                for antenna in antenna_list:
-                    real = numpy.copy(parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan])
-                    imag = numpy.copy(parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan])
-                    amp = numpy.ma.masked_invalid(numpy.copy(numpy.sqrt(real**2 + imag**2))).compressed()
-                    amplist.append(amp)
-        norm_factor = 1.0/(numpy.mean(numpy.concatenate(amplist)))
+        real = real_values[:, pol_ind]
+        imag = imag_values[:, pol_ind]
+        amp = numpy.sqrt(real**2 + imag**2)
+        norm_factor = 1.0/(numpy.mean(amp[numpy.isfinite(amp)]))
         print "smooth_amps.py: Normalization-Factor is:", norm_factor
 
         # Now do the normalization
-        for chan in range(nchans):
-            for pol in pol_list:
-                for antenna in antenna_list:
-                    real = numpy.copy(parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan])
-                    imag = numpy.copy(parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan])
-                    phase = numpy.arctan2(imag, real)
-                    amp  = numpy.copy(numpy.sqrt(real**2 + imag**2))
-
-                    # Clip extremely low amplitude solutions to prevent very high
-                    # amplitudes in the corrected data
-                    # First get a copy and fill all NANs with dummy values
-                    amp_nonan = numpy.copy(amp) 
-                    amp_nonan[~numpy.isfinite(amp)] = 1.
-                    low_ind = numpy.where( amp_nonan < 0.2)
-                    amp[low_ind] = 0.2
-
-                    parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan] = numpy.copy(amp *
-                        numpy.cos(phase) * norm_factor)
-                    parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan] = numpy.copy(amp *
-                        numpy.sin(phase) * norm_factor)
-    if os.path.exists(instrument_name_smoothed):
-        shutil.rmtree(instrument_name_smoothed)
-    pdbnew = lofar.parmdb.parmdb(instrument_name_smoothed, create=True)
-    pdbnew.addValues(parms)
-    pdbnew.flush()
+        phase = numpy.arctan2(imag, real)
+
+        # Clip extremely low amplitude solutions to prevent very high
+        # amplitudes in the corrected data
+        # First get a copy and fill all NANs with dummy values
+        amp_nonan = numpy.copy(amp)
+        amp_nonan[~numpy.isfinite(amp)] = 1.
+        low_ind = numpy.where( amp_nonan < 0.2)
+        amp[low_ind] = 0.2
+
+        real_values[:, pol_ind] = amp * numpy.cos(phase) * norm_factor
+        imag_values[:, pol_ind] = amp * numpy.sin(phase) * norm_factor
+
+    # Write the output parmdb and its store file, which is read by the steps
+    # that merge and convert the solutions
+    solstore.write_parmdb(instrument_name_smoothed)
 
 
 if __name__ == '__main__':
@@ -7,17 +7,15 @@ import argparse
 from argparse import RawTextHelpFormatter
 import casacore.tables as pt
 import numpy
-import os
-import lofar.parmdb
 import math
-import shutil
-import multiprocessing
 import matplotlib.pyplot as plt
 from scipy.interpolate import LSQUnivariateSpline
 import sys
 import scipy.ndimage
 import astropy.convolution
 import matplotlib as mpl
+from factor.lib.parallel_smooth import smooth_series
+from factor.lib.solution_store import load_solutions
 
 
 def std(inputData, Zero=False, axis=None, dtype=None):
@@ -498,26 +496,30 @@ def main(instrument_name, instrument_name_smoothed, normalize=True, plotting=Fal
 
     gain = 'Gain'
 
-    pdb = lofar.parmdb.parmdb(instrument_name)
-    parms = pdb.getValuesGrid('*')
-
-    key_names = parms.keys()
-    nchans = len(parms[key_names[0]]['freqs'])
+    # The values are arrays of shape (nstations, npols, ntimes, nchans) that
+    # are held by the store, so changes to them are written to the output
+    # parmdb
+    solstore = load_solutions(instrument_name)
+    real_values = solstore.get_values(gain + ':Real')
+    imag_values = solstore.get_values(gain + ':Imag')
+    axes = solstore.get_axes(gain + ':Real')
+    nstations, npols, ntimes, nchans = real_values.shape
 
     # determine the number of polarizations in parmdb (2 or 4)
-    if any(gain+':0:1:' in s for s in key_names):
+    if '0:1' in axes['pols']:
         pol_list = ['0:0', '1:1', '0:1', '1:0']
     else:
         pol_list = ['0:0', '1:1']
+    pol_ind = [axes['pols'].index(pol) for pol in pol_list]
 
-    times = numpy.copy(sorted( parms[key_names[0]]['times']))
-    freqs = numpy.copy(sorted( parms[key_names[0]]['freqs']))/1e6 # get this in MHz
+    times = numpy.copy(sorted(axes['times']))
+    freqs = numpy.copy(sorted(axes['freqs']))/1e6 # get this in MHz
 
     # times not used at the moment, I assume the time axis for a parmdb is regular and does not contain gaps
     times = (times - numpy.min(times))/24. #so we get an axis in hrs
 
     # Get station names
-    antenna_list = set([s.split(':')[-1] for s in pdb.getNames()])
+    antenna_list = axes['stations']
 
     # for plotting
     Nr = int(numpy.ceil(numpy.sqrt(len(antenna_list))))
@@ -533,50 +535,55 @@ def main(instrument_name, instrument_name_smoothed, normalize=True, plotting=Fal
             fa2, axa2 = plt.subplots(Nr, Nc, sharex=True, sharey=True, figsize=(8,108),)
             axsa2 = axa2.reshape((Nr*Nc,1))
 
-    for pol in pol_list:
-        for istat,antenna in enumerate(sorted(antenna_list)[::-1]):
-            channel_parms_real = [parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan]
-                for chan in range(nchans)]
-            channel_parms_imag = [parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan]
-                for chan in range(nchans)]
+    # Collect the amplitudes and phases of all stations, polarizations and
+    # channels, so that they can be smoothed together in a single pool. The
+    # series are ordered by polarization, station (in reverse order) and
+    # channel
+    ant_list = sorted(antenna_list)[::-1]
+    sel = numpy.ix_([antenna_list.index(antenna) for antenna in ant_list], pol_ind)
+    real = real_values[sel].transpose(1, 0, 3, 2).reshape(-1, ntimes)
+    imag = imag_values[sel].transpose(1, 0, 3, 2).reshape(-1, ntimes)
+    amps_orig = numpy.sqrt(real**2 + imag**2)
+    phases_orig = numpy.arctan2(imag, real)
+    if plotting:
+        info_rows = range(nchans-1, len(amps_orig), nchans)
+    else:
+        info_rows = []
+
+    # Check for NaNs. If found, set amps to 1 and phases to 0.0
+    amps_orig[numpy.isnan(amps_orig)] = 1.0
+    phases_orig[numpy.isnan(phases_orig)] = 0.0
+
+    # now find the bad data
+    (amps_cleaned, amp_info), (phases_cleaned, phase_info) = smooth_series(
+        [(spline1D_amp, amps_orig, None, info_rows),
+        (spline1D_phase, phases_orig, None, info_rows)])
 
+    # put back the results
+    real_values[sel] = (amps_cleaned*numpy.cos(phases_cleaned)).reshape(len(pol_ind),
+        nstations, nchans, ntimes).transpose(1, 0, 3, 2)
+    imag_values[sel] = (amps_cleaned*numpy.sin(phases_cleaned)).reshape(len(pol_ind),
+        nstations, nchans, ntimes).transpose(1, 0, 3, 2)
+
+    row = 0
+    for pol in pol_list:
+        for istat,antenna in enumerate(ant_list):
             # some plotting setup
-            if len(channel_parms_real[0]) > 500:
+            if ntimes > 500:
                 fmt = ','
             else:
                 fmt = 'o'
             ls='none'
 
-            channel_amp_orig = [numpy.sqrt(channel_parms_real[chan]**2 +
-                channel_parms_imag[chan]**2) for chan in range(nchans)]
-            channel_phase_orig = [numpy.arctan2(channel_parms_imag[chan],
-                channel_parms_real[chan]) for chan in range(nchans)]
-
-            # Check for NaNs. If found, set amps to 1 and phases to 0.0
+            channel_amp_orig = amps_orig[row:row+nchans]
+            channel_phase_orig = phases_orig[row:row+nchans]
             for chan in range(nchans):
-                flagged_indx = numpy.where(numpy.isnan(channel_amp_orig[chan]))
-                if len(flagged_indx[0]) > 0:
-                    channel_amp_orig[chan][flagged_indx] = 1.0
-                flagged_indx = numpy.where(numpy.isnan(channel_phase_orig[chan]))
-                if len(flagged_indx[0]) > 0:
-                    channel_phase_orig[chan][flagged_indx] = 0.0
-
-            # now find the bad data
-            pool = multiprocessing.Pool()
-            amp_results = pool.map(spline1D_amp, channel_amp_orig)
-            pool.close()
-            pool.join()
-            pool = multiprocessing.Pool()
-            phase_results = pool.map(spline1D_phase, channel_phase_orig)
-            pool.close()
-            pool.join()
-
-            for chan, ((amp_cleaned, model, noisevec, scatter, n_knots, idxbad, weights),
-                (phase_cleaned, phase_model, phase_noisevec, phase_scatter, phase_n_knots,
-                phase_idxbad, phase_weights)) in enumerate(zip(amp_results, phase_results)):
-                # put back the results
-                parms[gain + ':' + pol + ':Real:' + antenna]['values'][:, chan] = numpy.copy(amp_cleaned*numpy.cos(phase_cleaned))
-                parms[gain + ':' + pol + ':Imag:' + antenna]['values'][:, chan] = numpy.copy(amp_cleaned*numpy.sin(phase_cleaned))
+                amp_cleaned = amps_cleaned[row+chan]
+                phase_cleaned = phases_cleaned[row+chan]
+                if row+chan in amp_info:
+                    model, noisevec, scatter, n_knots, idxbad, weights = amp_info[row+chan]
+                    (phase_model, phase_noisevec, phase_scatter, phase_n_knots,
+                        phase_idxbad, phase_weights) = phase_info[row+chan]
 
                 if pol in pol_list[0]:
                     cc = 'blue'
@@ -589,7 +596,7 @@ def main(instrument_name, instrument_name_smoothed, normalize=True, plotting=Fal
 
                 # only plot one channel, just to verify code works
                 if plot_phases:
-                    if plotting and chan == nchans-1: # plot last channel
+                    if plotting and chan == nchans-1 and row+chan in amp_info: # plot last channel
                         axsa[istat][0].plot(timevec,numpy.mod(phase_cleaned+numpy.pi, 2*numpy.pi) - numpy.pi , marker=fmt, ls=ls,
                             markersize=500/len(phase_cleaned), c=cc,mec=cc)
                         axsa[istat][0].plot(timevec,phase_noisevec, c=cc, lw=0.75, ls='--')
@@ -619,7 +626,7 @@ def main(instrument_name, instrument_name_smoothed, normalize=True, plotting=Fal
                         axsa[istat][0].set_ylim(-3.14, 3.14)
                         axsa[istat][0].set_xlim(0, max(timevec))
                 else:
-                    if plotting and chan == nchans-1: # plot last channel
+                    if plotting and chan == nchans-1 and row+chan in amp_info: # plot last channel
                         axsa[istat][0].plot(timevec, amp_cleaned, marker=fmt, ls=ls,
                             markersize=0.1*len(amp_cleaned), c=cc,mec=cc)
                         axsa[istat][0].plot(timevec,noisevec, c=cc, lw=0.75, ls='--')
@@ -648,26 +655,22 @@ def main(instrument_name, instrument_name_smoothed, normalize=True, plotting=Fal
                         axsa[istat][0].set_title(antenna)
                         axsa[istat][0].set_ylim(-0.3, 2)
                         axsa[istat][0].set_xlim(0, max(timevec))
+            row += nchans
 
             if nchans > 5: # Do 2D smooth
-                channel_parms_real = [parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan]
-                    for chan in range(nchans)]
-                channel_parms_imag = [parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan]
-                    for chan in range(nchans)]
-                channel_parms_real =  numpy.asarray(channel_parms_real)
-                channel_parms_imag =  numpy.asarray(channel_parms_imag)
-                channel_amp_orig = [numpy.sqrt(channel_parms_real[chan]**2 +
-                    channel_parms_imag[chan]**2) for chan in range(nchans)]
-                amp_orig = numpy.sqrt(channel_parms_real[:]**2 + channel_parms_imag[:]**2)
-                phase_orig = numpy.arctan2(channel_parms_imag[:], channel_parms_real[:]**2)
+                s = antenna_list.index(antenna)
+                p = axes['pols'].index(pol)
+                channel_parms_real = numpy.transpose(real_values[s, p])
+                channel_parms_imag = numpy.transpose(imag_values[s, p])
+                amp_orig = numpy.sqrt(channel_parms_real**2 + channel_parms_imag**2)
+                phase_orig = numpy.arctan2(channel_parms_imag, channel_parms_real**2)
 
                 amp_cleaned, amp_median, baddata = median2Dampfilter(numpy.copy(amp_orig))
                 phase_cleaned, phase_median, phase_baddata = median2Dphasefilter(numpy.copy(phase_orig))
 
-                for chan in range(nchans):
-                    # put back the results
-                    parms[gain + ':' + pol + ':Real:' + antenna]['values'][:, chan] = numpy.copy((amp_cleaned[chan,:])*numpy.cos(phase_cleaned[chan,:]))
-                    parms[gain + ':' + pol + ':Imag:' + antenna]['values'][:, chan] = numpy.copy((amp_cleaned[chan,:])*numpy.sin(phase_cleaned[chan,:]))
+                # put back the results
+                real_values[s, p] = numpy.transpose(amp_cleaned*numpy.cos(phase_cleaned))
+                imag_values[s, p] = numpy.transpose(amp_cleaned*numpy.sin(phase_cleaned))
 
                 if plotting:
                     axsa2[4*istat][0].imshow(numpy.transpose(amp_orig),
@@ -706,42 +709,30 @@ def main(instrument_name, instrument_name_smoothed, normalize=True, plotting=Fal
     # Normalize the amplitude solutions to a mean of one across all channels
     if normalize:
         # First find the normalization factor
-        amplist = []
-        for chan in range(nchans):
-            for pol in ['0:0','1:1']:  # hard code here in case the data contains 0:1 and 1:0
-                for antenna in antenna_list:
-                    real = numpy.copy(parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan])
-                    imag = numpy.copy(parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan])
-                    amp  = numpy.copy(numpy.sqrt(real**2 + imag**2))
-                    amplist.append(amp)
-        norm_factor = 1.0/(numpy.mean(numpy.concatenate(amplist)))
+        norm_ind = [axes['pols'].index(pol) for pol in ['0:0','1:1']]  # hard code here in case the data contains 0:1 and 1:0
+        amp = numpy.sqrt(real_values[:, norm_ind]**2 + imag_values[:, norm_ind]**2)
+        norm_factor = 1.0/(numpy.mean(amp))
         print "smooth_amps_spline.py: Normalization-Factor is:", norm_factor
 
         # Now do the normalization
-        for chan in range(nchans):
-            for pol in pol_list:
-                for antenna in antenna_list:
-                    real = numpy.copy(parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan])
-                    imag = numpy.copy(parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan])
-                    phase = numpy.arctan2(imag, real)
-                    amp  = numpy.copy(numpy.sqrt(real**2 + imag**2))
-
-                    # Clip extremely low amplitude solutions to prevent very high
-                    # amplitudes in the corrected data
-                    if pol == '1:1' or pol == '0:0':
-                        low_ind = numpy.where(amp < 0.2)
-                        amp[low_ind] = 0.2
-
-                    parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan] = numpy.copy(amp *
-                        numpy.cos(phase) * norm_factor)
-                    parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan] = numpy.copy(amp *
-                        numpy.sin(phase) * norm_factor)
-
-    if os.path.exists(instrument_name_smoothed):
-        shutil.rmtree(instrument_name_smoothed)
-    pdbnew = lofar.parmdb.parmdb(instrument_name_smoothed, create=True)
-    pdbnew.addValues(parms)
-    pdbnew.flush()
+        real = real_values[:, pol_ind]
+        imag = imag_values[:, pol_ind]
+        phase = numpy.arctan2(imag, real)
+        amp = numpy.sqrt(real**2 + imag**2)
+
+        # Clip extremely low amplitude solutions to prevent very high
+        # amplitudes in the corrected data (only for 0:0 and 1:1, the first
+        # two polarizations of pol_list)
+        amp_diag = amp[:, :2]
+        low_ind = numpy.where(amp_diag < 0.2)
+        amp_diag[low_ind] = 0.2
+
+        real_values[:, pol_ind] = amp * numpy.cos(phase) * norm_factor
+        imag_values[:, pol_ind] = amp * numpy.sin(phase) * norm_factor
+
+    # Write the output parmdb and its store file, which is read by the steps
+    # that merge and convert the solutions
+    solstore.write_parmdb(instrument_name_smoothed)
 
 
 if __name__ == '__main__':
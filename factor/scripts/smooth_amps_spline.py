@@ -7,17 +7,15 @@ import argparse
 from argparse import RawTextHelpFormatter
 import casacore.tables as pt
 import numpy
-import os
-import lofar.parmdb
 import math
-import shutil
-import multiprocessing
 import matplotlib.pyplot as plt
-from scipy.interpolate import LSQUnivariateSpline, interp1d, interp2d
+from scipy.interpolate import LSQUnivariateSpline, interp2d
 import sys
 import scipy.ndimage
 import astropy.convolution
 import matplotlib as mpl
+from factor.lib.parallel_smooth import smooth_series
+from factor.lib.solution_store import load_solutions, SolutionStore
 
 
 def std(inputData, Zero=False, axis=None, dtype=None):
@@ -318,42 +316,35 @@ def main(instrument_name, instrument_name_smoothed, normalize=True, plotting=Fal
 
     gain = 'Gain'
 
-    pdb = lofar.parmdb.parmdb(instrument_name)
-    parms = pdb.getValuesGrid('*')
+    # The values are arrays of shape (nstations, npols, ntimes, nchans) that
+    # are held by the store
+    solstore = load_solutions(instrument_name)
+    real_values = solstore.get_values(gain + ':Real')
+    imag_values = solstore.get_values(gain + ':Imag')
+    axes = solstore.get_axes(gain + ':Real')
+    nstations, npols, ntimes, nchans = real_values.shape
 
-    key_names = parms.keys()
-    initial_flagged_dict = {}
-    initial_unflagged_dict = {}
-    for key_name in key_names:
-        # Check for NaNs and zeros. If found, set to 1
-        initial_flagged_indx = numpy.where(numpy.logical_or(numpy.isnan(parms[key_name]['values']),
-            parms[key_name]['values'] == 0.0))
-        initial_flagged_dict[key_name] = initial_flagged_indx
-        initial_unflagged_indx = numpy.where(numpy.logical_and(~numpy.isnan(parms[key_name]['values']),
-            parms[key_name]['values'] != 0.0))
-        initial_unflagged_dict[key_name] = initial_unflagged_indx
-        parms[key_name]['values'][initial_flagged_indx] = 1.0
-
-    nchans = len(parms[key_names[0]]['freqs'])
+    # Check for NaNs and zeros. If found, set to 1
+    real_flagged = numpy.logical_or(numpy.isnan(real_values), real_values == 0.0)
+    imag_flagged = numpy.logical_or(numpy.isnan(imag_values), imag_values == 0.0)
+    real_values[real_flagged] = 1.0
+    imag_values[imag_flagged] = 1.0
 
     # determine the number of polarizations in parmdb (2 or 4)
-    if any(gain+':0:1:' in s for s in key_names):
+    if '0:1' in axes['pols']:
         pol_list = ['0:0', '1:1', '0:1', '1:0']
     else:
         pol_list = ['0:0', '1:1']
+    pol_ind = [axes['pols'].index(pol) for pol in pol_list]
 
-    times = numpy.copy(sorted( parms[key_names[0]]['times']))
-    orig_times = parms[key_names[0]]['times']
-    timewidths = parms[key_names[0]]['timewidths']
-    freqs = numpy.copy(sorted( parms[key_names[0]]['freqs']))/1e6 # get this in MHz
-    orig_freqs = parms[key_names[0]]['freqs']
-    freqwidths = parms[key_names[0]]['freqwidths']
+    times = numpy.copy(sorted(axes['times']))
+    freqs = numpy.copy(sorted(axes['freqs']))/1e6 # get this in MHz
 
     # times not used at the moment, I assume the time axis for a parmdb is regular and does not contain gaps
     times = (times - numpy.min(times))/24. #so we get an axis in hrs
 
     # Get station names
-    antenna_list = set([s.split(':')[-1] for s in pdb.getNames()])
+    antenna_list = axes['stations']
 
     # for plotting
     Nr = int(numpy.ceil(numpy.sqrt(len(antenna_list))))
@@ -369,50 +360,54 @@ def main(instrument_name, instrument_name_smoothed, normalize=True, plotting=Fal
             fa2, axa2 = plt.subplots(Nr, Nc, sharex=True, sharey=True, figsize=(8,108),)
             axsa2 = axa2.reshape((Nr*Nc,1))
 
+    # Interpolate across flagged solutions and collect the amplitudes of all
+    # stations, polarizations and channels, so that they can be smoothed
+    # together in a single pool. The series are ordered by polarization,
+    # station (in reverse order) and channel
+    ant_list = sorted(antenna_list)[::-1]
+    sel = numpy.ix_([antenna_list.index(antenna) for antenna in ant_list], pol_ind)
+    real = real_values[sel].transpose(1, 0, 3, 2).reshape(-1, ntimes)
+    imag = imag_values[sel].transpose(1, 0, 3, 2).reshape(-1, ntimes)
+    amps_interp = numpy.sqrt(real**2 + imag**2)
+    nseries = len(amps_interp)
+    valid = numpy.zeros(nseries, dtype=bool)
+    info_rows = []
+    for row in range(nseries):
+        amp = amps_interp[row]
+        unflagged_times = numpy.where(real[row] != 1.0)
+        flagged_times = numpy.where(real[row] == 1.0)
+        if numpy.any(unflagged_times):
+            if numpy.any(flagged_times):
+                fill_value = numpy.mean(amp[unflagged_times])
+                amp[flagged_times] = numpy.interp(times[flagged_times], times[unflagged_times],
+                    amp[unflagged_times], left=fill_value, right=fill_value)
+            valid[row] = True
+        if plotting and row % nchans == nchans-1:
+            info_rows.append(row)
+
+    # now find the bad data
+    amps_cleaned, info = smooth_series([(spline1D, amps_interp, valid, info_rows)])[0]
+
+    # put back the results
+    phase = numpy.arctan2(imag, real)
+    real_values[sel] = (amps_cleaned*numpy.cos(phase)).reshape(len(pol_ind),
+        nstations, nchans, ntimes).transpose(1, 0, 3, 2)
+    imag_values[sel] = (amps_cleaned*numpy.sin(phase)).reshape(len(pol_ind),
+        nstations, nchans, ntimes).transpose(1, 0, 3, 2)
+
+    row = 0
     for pol in pol_list:
-        for istat,antenna in enumerate(sorted(antenna_list)[::-1]):
-            channel_parms_real = [parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan]
-                for chan in range(nchans)]
-            channel_parms_imag = [parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan]
-                for chan in range(nchans)]
-
+        for istat,antenna in enumerate(ant_list):
             # some plotting setup
-            if len(channel_parms_real[0]) > 500:
+            if ntimes > 500:
                 fmt = ','
             else:
                 fmt = 'o'
             ls='none'
 
-            channel_amp_orig = [numpy.sqrt(channel_parms_real[chan]**2 +
-                channel_parms_imag[chan]**2) for chan in range(nchans)]
-
-            # Interpolate across flagged solutions
-            channel_amp_interp = []
+            channel_amp_orig = amps_interp[row:row+nchans]
             for chan in range(nchans):
-                unflagged_times = numpy.where(channel_parms_real[chan] != 1.0)
-                flagged_times = numpy.where(channel_parms_real[chan] == 1.0)
-                if numpy.any(unflagged_times):
-                    if numpy.any(flagged_times):
-                        finterp = interp1d(times[unflagged_times], channel_amp_orig[chan][unflagged_times],
-                            kind='linear', bounds_error=False, fill_value=numpy.mean(channel_amp_orig[chan][unflagged_times]))
-                        channel_amp_orig[chan][flagged_times] = finterp(times[flagged_times])
-                    channel_amp_interp.append(channel_amp_orig[chan])
-                else:
-                    channel_amp_interp.append(None)
-
-            # now find the bad data
-            pool = multiprocessing.Pool()
-            results = pool.map(spline1D, channel_amp_interp)
-            pool.close()
-            pool.join()
-
-            for chan, (amp_cleaned, model, noisevec, scatter, n_knots, idxbad, weights) in enumerate(results):
-                # put back the results
-                phase = numpy.arctan2(channel_parms_imag[chan], channel_parms_real[chan])
-                if amp_cleaned is None:
-                    amp_cleaned = channel_amp_orig[chan]
-                parms[gain + ':' + pol + ':Real:' + antenna]['values'][:, chan] = numpy.copy(amp_cleaned*numpy.cos(phase))
-                parms[gain + ':' + pol + ':Imag:' + antenna]['values'][:, chan] = numpy.copy(amp_cleaned*numpy.sin(phase))
+                amp_cleaned = amps_cleaned[row+chan]
 
                 if pol in pol_list[0]:
                     cc = 'blue'
@@ -424,7 +419,8 @@ def main(instrument_name, instrument_name_smoothed, normalize=True, plotting=Fal
                 timevec = numpy.arange(0,len(channel_amp_orig[chan]))
 
                 # only plot one channel, just to verify code works
-                if plotting and chan == nchans-1: # plot last channel
+                if plotting and chan == nchans-1 and row+chan in info: # plot last channel
+                    model, noisevec, scatter, n_knots, idxbad, weights = info[row+chan]
                     axsa[istat][0].plot(timevec, amp_cleaned, marker=fmt, ls=ls,
                         markersize=0.1*len(amp_cleaned), c=cc,mec=cc)
                     axsa[istat][0].plot(timevec,noisevec, c=cc, lw=0.75, ls='--')
@@ -453,20 +449,17 @@ def main(instrument_name, instrument_name_smoothed, normalize=True, plotting=Fal
                     axsa[istat][0].set_title(antenna)
                     axsa[istat][0].set_ylim(-0.3, 2)
                     axsa[istat][0].set_xlim(0, max(timevec))
+            row += nchans
 
             if nchans > 5: # Do 2D smooth
-                channel_parms_real = [parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan]
-                    for chan in range(nchans)]
-                channel_parms_imag = [parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan]
-                    for chan in range(nchans)]
-                channel_parms_real =  numpy.asarray(channel_parms_real)
-                channel_parms_imag =  numpy.asarray(channel_parms_imag)
-                channel_amp_orig = numpy.asarray([numpy.sqrt(channel_parms_real[chan]**2 +
-                    channel_parms_imag[chan]**2) for chan in range(nchans)])
-                phase = numpy.arctan2(channel_parms_imag[:], channel_parms_real[:])
+                s = antenna_list.index(antenna)
+                p = axes['pols'].index(pol)
+                channel_parms_real = numpy.copy(real_values[s, p].T)
+                channel_parms_imag = numpy.copy(imag_values[s, p].T)
+                channel_amp_orig = numpy.sqrt(channel_parms_real**2 + channel_parms_imag**2)
+                phase = numpy.arctan2(channel_parms_imag, channel_parms_real)
 
                 # Interpolate across flagged solutions
-                channel_amp_interp = []
                 unflagged_sols = numpy.where(channel_parms_real != 1.0)
                 x, y = numpy.meshgrid(times, range(nchans))
                 if numpy.any(unflagged_sols):
@@ -477,10 +470,9 @@ def main(instrument_name, instrument_name_smoothed, normalize=True, plotting=Fal
                         channel_amp_orig[flagged_sols] = finterp(x[flagged_sols], y[flagged_sols])
                     amp_cleaned, amp_median, baddata = median2Dampfilter(channel_amp_orig)
 
-                    for chan in range(nchans):
-                        # put back the results
-                        parms[gain + ':' + pol + ':Real:' + antenna]['values'][:, chan] = numpy.copy((amp_cleaned[chan,:])*numpy.cos(phase[chan,:]))
-                        parms[gain + ':' + pol + ':Imag:' + antenna]['values'][:, chan] = numpy.copy((amp_cleaned[chan,:])*numpy.sin(phase[chan,:]))
+                    # put back the results
+                    real_values[s, p] = numpy.transpose(amp_cleaned*numpy.cos(phase))
+                    imag_values[s, p] = numpy.transpose(amp_cleaned*numpy.sin(phase))
 
                     if plotting:
                         axsa2[4*istat][0].imshow(numpy.transpose(channel_amp_orig),
@@ -518,75 +510,42 @@ def main(instrument_name, instrument_name_smoothed, normalize=True, plotting=Fal
     # Normalize the amplitude solutions to a mean of one across all channels
     if normalize:
         # First find the normalization factor
-        amplist = []
-        for pol in ['0:0','1:1']:  # hard code here in case the data contains 0:1 and 1:0
-            for antenna in antenna_list:
-                key_name = gain + ':' + pol + ':Real:'+ antenna
-                if numpy.any(initial_unflagged_dict[key_name]):
-                    # Only use unflagged data for normalization
-                    real = numpy.copy(parms[key_name]['values'])
-                    key_name = gain + ':' + pol + ':Imag:'+ antenna
-                    imag = numpy.copy(parms[key_name]['values'])
-                    amp  = numpy.copy(numpy.sqrt(real**2 + imag**2))
-                    amplist.append(amp[initial_unflagged_dict[key_name]])
-        norm_factor = 1.0/(numpy.mean(numpy.concatenate(amplist)))
+        norm_ind = [axes['pols'].index(pol) for pol in ['0:0','1:1']]  # hard code here in case the data contains 0:1 and 1:0
+        real = real_values[:, norm_ind]
+        imag = imag_values[:, norm_ind]
+        amp = numpy.sqrt(real**2 + imag**2)
+
+        # Only use unflagged data for normalization
+        unflagged = ~imag_flagged[:, norm_ind]
+        unflagged[numpy.all(real_flagged[:, norm_ind], axis=(2, 3))] = False
+        norm_factor = 1.0/(numpy.mean(amp[unflagged]))
         print "smooth_amps_spline.py: Normalization-Factor is:", norm_factor
 
         # Now do the normalization
-        for chan in range(nchans):
-            for pol in pol_list:
-                for antenna in antenna_list:
-                    real = numpy.copy(parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan])
-                    imag = numpy.copy(parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan])
-                    phase = numpy.arctan2(imag, real)
-                    amp  = numpy.copy(numpy.sqrt(real**2 + imag**2))
-
-                    # Clip extremely low amplitude solutions to prevent very high
-                    # amplitudes in the corrected data
-                    low_ind = numpy.where(amp < 0.2)
-                    amp[low_ind] = 0.2
-
-                    parms[gain + ':' + pol + ':Real:'+ antenna]['values'][:, chan] = numpy.copy(amp *
-                        numpy.cos(phase) * norm_factor)
-                    parms[gain + ':' + pol + ':Imag:'+ antenna]['values'][:, chan] = numpy.copy(amp *
-                        numpy.sin(phase) * norm_factor)
+        real = real_values[:, pol_ind]
+        imag = imag_values[:, pol_ind]
+        phase = numpy.arctan2(imag, real)
+        amp = numpy.sqrt(real**2 + imag**2)
 
-    # Make sure flagged solutions are still flagged
-    for key_name in key_names:
-        parms[key_name]['values'][initial_flagged_dict[key_name]] = numpy.nan
-
-    if os.path.exists(instrument_name_smoothed):
-        shutil.rmtree(instrument_name_smoothed)
-    pdbnew = lofar.parmdb.parmdb(instrument_name_smoothed, create=True)
-
-    # Identify any gaps in time (frequency gaps are not allowed), as we need to handle
-    # each section separately if gaps are present
-    delta_times = orig_times[1:] - orig_times[:-1]
-    gaps = numpy.where(delta_times > timewidths[:-1]*1.1)
-    if len(gaps[0]) > 0:
-        gaps_ind = gaps[0] + 1
-    else:
-        gaps_ind = []
+        # Clip extremely low amplitude solutions to prevent very high
+        # amplitudes in the corrected data
+        low_ind = numpy.where(amp < 0.2)
+        amp[low_ind] = 0.2
 
-    for pol in pol_list:
-        for station in antenna_list:
-            g_start = 0
-            real = parms['Gain:' + pol + ':Real:'+ station]['values']
-            imag = parms['Gain:' + pol + ':Imag:'+ station]['values']
-            for g in gaps_ind:
-                # If time gaps exist, add them one-by-one (except for last one)
-                pdbnew.addValues('Gain:'+pol+':Real:{}'.format(station), real[g_start:g], orig_freqs, freqwidths,
-                    orig_times[g_start:g], timewidths[g_start:g], asStartEnd=False)
-                pdbnew.addValues('Gain:'+pol+':Imag:{}'.format(station), imag[g_start:g], orig_freqs, freqwidths,
-                    orig_times[g_start:g], timewidths[g_start:g], asStartEnd=False)
-                g_start = g
-
-            # Add remaining time slots
-            pdbnew.addValues('Gain:'+pol+':Real:{}'.format(station), real[g_start:], orig_freqs, freqwidths,
-                orig_times[g_start:], timewidths[g_start:], asStartEnd=False)
-            pdbnew.addValues('Gain:'+pol+':Imag:{}'.format(station), imag[g_start:], orig_freqs, freqwidths,
-                orig_times[g_start:], timewidths[g_start:], asStartEnd=False)
-    pdbnew.flush()
+        real_values[:, pol_ind] = amp * numpy.cos(phase) * norm_factor
+        imag_values[:, pol_ind] = amp * numpy.sin(phase) * norm_factor
+
+    # Make sure flagged solutions are still flagged
+    real_values[real_flagged] = numpy.nan
+    imag_values[imag_flagged] = numpy.nan
+
+    # Write the output parmdb and its store file, which is read by the steps
+    # that merge and convert the solutions
+    axes['pols'] = pol_list
+    solstore_out = SolutionStore()
+    solstore_out.set_values(gain + ':Real', real_values[:, pol_ind], axes)
+    solstore_out.set_values(gain + ':Imag', imag_values[:, pol_ind], axes)
+    solstore_out.write_parmdb(instrument_name_smoothed)
 
 
 if __name__ == '__main__':
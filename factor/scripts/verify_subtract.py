@@ -4,9 +4,8 @@ Script to verify selfcal subtract
 """
 import argparse
 from argparse import RawTextHelpFormatter
-import numpy
-import casacore.images as pim
 import os
+from factor.lib.image_stats import get_image_stats
 
 
 def main(image_pre, image_post, res_val, max_factor=0.25):
@@ -25,10 +24,10 @@ def main(image_pre, image_post, res_val, max_factor=0.25):
         Factor by which old peak residual must exceed new peak residual
 
     """
-    imgpre = pim.image(image_pre)
-    maxvalpre = numpy.max(numpy.abs(imgpre.getdata()))
-    imgpost = pim.image(image_post)
-    maxvalpost = numpy.max(numpy.abs(imgpost.getdata()))
+    stats_pre = get_image_stats(image_pre)
+    maxvalpre = max(abs(stats_pre['max']), abs(stats_pre['min']))
+    stats_post = get_image_stats(image_post)
+    maxvalpost = max(abs(stats_post['max']), abs(stats_post['min']))
 
     if (maxvalpost > res_val) or (maxvalpost*max_factor > maxvalpre):
         return {'break': False, 'maxvalpost': maxvalpost, 'maxvalpre': maxvalpre}
@@ -6,6 +6,7 @@ import argparse
 from argparse import RawTextHelpFormatter
 import casacore.images as pim
 import numpy as np
+from factor.lib.image_io import get_row_tiles, read_casa_tile, write_casa_tile, get_corner_mask
 
 
 def main(image, output=None, radius=0.5):
@@ -26,35 +27,27 @@ def main(image, output=None, radius=0.5):
     if type(radius) is str:
         radius = float(radius)
 
-    pb = pim.image(image)
-    pbdata = pb.getdata()
-    (nx, ny) = pbdata.shape[2:]
-    pbrad = radius * nx
-    cy = ny / 2
-    cx = nx / 2
-    pbcounter = 0
-    for j in range(nx, cx, -1):
-        k = ny
-        while np.sqrt((j-cx)**2+(k-cy)**2) > pbrad and k > cy:
-            pbcounter += 1
-            pbdata[:, :, k-1, j-1] = 0.
-            pbdata[:, :, k-1, nx-j] = 0.
-            pbdata[:, :, ny-k, j-1] = 0.
-            pbdata[:, :, ny-k, nx-j] = 0.
-            k -= 1
-        if k == ny:
-            break
-
-    print pbcounter,'x 4 =',pbcounter*4,'zeros replaced'
-
     if output is None:
         while image[-1] == '/':
             image = image[: -1]
         outim = image + 'z'
     else:
         outim = output
-    pout = pim.image(outim, values=pbdata, coordsys=pb.coordinates())
 
+    # Copy the image in tiles of rows, zeroing the pixels outside the radius
+    pb = pim.image(image)
+    shape = pb.shape()
+    pout = pim.image(outim, shape=shape, coordsys=pb.coordinates())
+    pbrad = radius * shape[2]
+    nzero = 0
+    for r0, r1 in get_row_tiles(shape[2]):
+        pbdata = read_casa_tile(pb, r0, r1)
+        outside = get_corner_mask(r0, r1, shape[2:], pbrad)
+        pbdata[:, :, outside] = 0.
+        nzero += np.sum(outside)
+        write_casa_tile(pout, pbdata, r0)
+
+    print nzero, 'zeros replaced'
 
 if __name__ == '__main__':
     descriptiontext = "Zero corners of avgpb images.\n"
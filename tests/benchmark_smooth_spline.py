@@ -0,0 +1,221 @@
+#! /usr/bin/env python
+"""
+Benchmark of the spline smoothing of smooth_amps_spline.py and
+smooth_amps_phases_spline.py
+
+The series of a synthetic solution table (by default 60 stations, 4
+polarizations and 4 channels) are smoothed both with the original engine of
+the scripts (interp1d to fill flagged solutions and one process pool per
+polarization and station) and with factor.lib.parallel_smooth.smooth_series()
+(one pool for all series). The outputs are checked to be identical and the
+times are printed
+"""
+import argparse
+from argparse import RawTextHelpFormatter
+import multiprocessing
+import time
+import numpy
+from numpy.testing import assert_array_equal
+from scipy.interpolate import interp1d
+from factor.lib.parallel_smooth import smooth_series
+from factor.scripts.smooth_amps_spline import spline1D
+from factor.scripts.smooth_amps_phases_spline import spline1D_amp, spline1D_phase
+from conftest import make_gain_series
+
+
+def make_table(nstations, npols, nchans, ntimes, seed=0):
+    """
+    Returns synthetic amplitude and phase series with outliers and flagged gaps
+    (see make_gain_series() in conftest.py)
+
+    Parameters
+    ----------
+    nstations : int
+        Number of stations
+    npols : int
+        Number of polarizations
+    nchans : int
+        Number of channels
+    ntimes : int
+        Number of solution times
+    seed : int, optional
+        Seed of the random numbers
+
+    Returns
+    -------
+    times : array
+        Times in hours
+    amps : array
+        Amplitudes of shape (npols * nstations * nchans, ntimes), ordered by
+        polarization, station and channel as in the scripts
+    phases : array
+        Phases of the same shape
+    flagged : array
+        Boolean array of the same shape that is True for flagged solutions. The
+        last series is fully flagged
+
+    """
+    times = numpy.arange(ntimes) * 10.0 / 24.0
+    amps, phases, flagged = make_gain_series(npols * nstations * nchans, ntimes,
+        seed)
+
+    return times, amps, phases, flagged
+
+
+def smooth_amps_per_antenna(times, amps, flagged, nchans, ncores):
+    """
+    Smooths the amplitudes as done by smooth_amps_spline.py before
+    smooth_series() was used
+    """
+    amps_cleaned = numpy.copy(amps)
+    for start in range(0, len(amps), nchans):
+        channel_amp_orig = [numpy.copy(amps[start+chan]) for chan in range(nchans)]
+        channel_amp_interp = []
+        for chan in range(nchans):
+            unflagged_times = numpy.where(~flagged[start+chan])
+            flagged_times = numpy.where(flagged[start+chan])
+            if numpy.any(unflagged_times):
+                if numpy.any(flagged_times):
+                    finterp = interp1d(times[unflagged_times], channel_amp_orig[chan][unflagged_times],
+                        kind='linear', bounds_error=False, fill_value=numpy.mean(channel_amp_orig[chan][unflagged_times]))
+                    channel_amp_orig[chan][flagged_times] = finterp(times[flagged_times])
+                channel_amp_interp.append(channel_amp_orig[chan])
+            else:
+                channel_amp_interp.append(None)
+
+        pool = multiprocessing.Pool(ncores)
+        results = pool.map(spline1D, channel_amp_interp)
+        pool.close()
+        pool.join()
+
+        for chan, result in enumerate(results):
+            if result[0] is not None:
+                amps_cleaned[start+chan] = result[0]
+
+    return amps_cleaned
+
+
+def smooth_amps_single_pool(times, amps, flagged, ncores):
+    """
+    Smooths the amplitudes as done by smooth_amps_spline.py
+    """
+    amps_interp = numpy.copy(amps)
+    valid = numpy.zeros(len(amps), dtype=bool)
+    for row in range(len(amps)):
+        amp = amps_interp[row]
+        unflagged_times = numpy.where(~flagged[row])
+        flagged_times = numpy.where(flagged[row])
+        if numpy.any(unflagged_times):
+            if numpy.any(flagged_times):
+                fill_value = numpy.mean(amp[unflagged_times])
+                amp[flagged_times] = numpy.interp(times[flagged_times], times[unflagged_times],
+                    amp[unflagged_times], left=fill_value, right=fill_value)
+            valid[row] = True
+
+    return smooth_series([(spline1D, amps_interp, valid, None)], ncores=ncores)[0][0]
+
+
+def smooth_amps_phases_per_antenna(amps, phases, nchans, ncores):
+    """
+    Smooths the amplitudes and phases as done by smooth_amps_phases_spline.py
+    before smooth_series() was used
+    """
+    amps_cleaned = numpy.copy(amps)
+    phases_cleaned = numpy.copy(phases)
+    for start in range(0, len(amps), nchans):
+        pool = multiprocessing.Pool(ncores)
+        amp_results = pool.map(spline1D_amp, list(amps[start:start+nchans]))
+        pool.close()
+        pool.join()
+        pool = multiprocessing.Pool(ncores)
+        phase_results = pool.map(spline1D_phase, list(phases[start:start+nchans]))
+        pool.close()
+        pool.join()
+
+        for chan, (amp_result, phase_result) in enumerate(zip(amp_results, phase_results)):
+            amps_cleaned[start+chan] = amp_result[0]
+            phases_cleaned[start+chan] = phase_result[0]
+
+    return amps_cleaned, phases_cleaned
+
+
+def smooth_amps_phases_single_pool(amps, phases, ncores):
+    """
+    Smooths the amplitudes and phases as done by smooth_amps_phases_spline.py
+    """
+    (amps_cleaned, amp_info), (phases_cleaned, phase_info) = smooth_series(
+        [(spline1D_amp, amps, None, None), (spline1D_phase, phases, None, None)],
+        ncores=ncores)
+
+    return amps_cleaned, phases_cleaned
+
+
+def main(nstations=60, npols=4, nchans=4, ntimes=120, ncores=None):
+    """
+    Runs the benchmark
+
+    Parameters
+    ----------
+    nstations : int, optional
+        Number of stations
+    npols : int, optional
+        Number of polarizations
+    nchans : int, optional
+        Number of channels
+    ntimes : int, optional
+        Number of solution times
+    ncores : int, optional
+        Number of processes per pool. If None, the number of CPUs is used
+
+    """
+    nstations = int(nstations)
+    npols = int(npols)
+    nchans = int(nchans)
+    ntimes = int(ntimes)
+    if ncores is not None:
+        ncores = int(ncores)
+
+    times, amps, phases, flagged = make_table(nstations, npols, nchans, ntimes)
+    print('{0} stations, {1} polarizations, {2} channels, {3} times ({4} series)'.format(
+        nstations, npols, nchans, ntimes, len(amps)))
+
+    # Amplitudes (smooth_amps_spline.py)
+    start = time.time()
+    amps_reference = smooth_amps_per_antenna(times, amps, flagged, nchans, ncores)
+    time_reference = time.time() - start
+    start = time.time()
+    amps_cleaned = smooth_amps_single_pool(times, amps, flagged, ncores)
+    time_single_pool = time.time() - start
+    assert_array_equal(amps_cleaned, amps_reference)
+    print('smooth_amps_spline: {0:.2f} s per antenna, {1:.2f} s in one pool '
+        '(identical output)'.format(time_reference, time_single_pool))
+
+    # Amplitudes and phases (smooth_amps_phases_spline.py), with flagged
+    # solutions set to an amplitude of 1 and a phase of 0
+    amps[flagged] = 1.0
+    phases[flagged] = 0.0
+    start = time.time()
+    amps_reference, phases_reference = smooth_amps_phases_per_antenna(amps, phases,
+        nchans, ncores)
+    time_reference = time.time() - start
+    start = time.time()
+    amps_cleaned, phases_cleaned = smooth_amps_phases_single_pool(amps, phases, ncores)
+    time_single_pool = time.time() - start
+    assert_array_equal(amps_cleaned, amps_reference)
+    assert_array_equal(phases_cleaned, phases_reference)
+    print('smooth_amps_phases_spline: {0:.2f} s per antenna, {1:.2f} s in one pool '
+        '(identical output)'.format(time_reference, time_single_pool))
+
+
+if __name__ == '__main__':
+    descriptiontext = "Benchmark the spline smoothing of solution series.\n"
+
+    parser = argparse.ArgumentParser(description=descriptiontext, formatter_class=RawTextHelpFormatter)
+    parser.add_argument('-s', '--nstations', help='number of stations', type=int, default=60)
+    parser.add_argument('-p', '--npols', help='number of polarizations', type=int, default=4)
+    parser.add_argument('-c', '--nchans', help='number of channels', type=int, default=4)
+    parser.add_argument('-t', '--ntimes', help='number of solution times', type=int, default=120)
+    parser.add_argument('-n', '--ncores', help='number of processes per pool', type=int, default=None)
+    args = parser.parse_args()
+
+    main(args.nstations, args.npols, args.nchans, args.ntimes, args.ncores)
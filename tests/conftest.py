@@ -0,0 +1,113 @@
+"""
+Builders of synthetic data shared by the tests (and by
+benchmark_smooth_spline.py)
+"""
+import numpy
+import astropy.wcs as pywcs
+from astropy.io import fits
+
+
+def make_wcs(crval, cdelt, crpix, extra_axes=('STOKES', 'FREQ')):
+    """
+    Returns a SIN-projection WCS with RA and Dec axes and the given extra axes
+
+    Parameters
+    ----------
+    crval : list of float
+        RA and Dec of the reference pixel in degrees
+    cdelt : float
+        Pixel size in degrees
+    crpix : list of float
+        Reference pixel (x, y), 1-based
+    extra_axes : tuple of str, optional
+        Extra axes, in order ('STOKES' for a Stokes I plane and 'FREQ' for a
+        150 MHz plane)
+
+    Returns
+    -------
+    wcs : WCS object
+        The WCS
+
+    """
+    extra_crval = {'STOKES': 1.0, 'FREQ': 1.5e8}
+    extra_cdelt = {'STOKES': 1.0, 'FREQ': 1e6}
+    wcs = pywcs.WCS(naxis=2+len(extra_axes))
+    wcs.wcs.ctype = ['RA---SIN', 'DEC--SIN'] + list(extra_axes)
+    wcs.wcs.crval = list(crval) + [extra_crval[axis] for axis in extra_axes]
+    wcs.wcs.cdelt = [-cdelt, cdelt] + [extra_cdelt[axis] for axis in extra_axes]
+    wcs.wcs.crpix = list(crpix) + [1.0] * len(extra_axes)
+
+    return wcs
+
+
+def write_image(filename, data, wcs=None, header=None):
+    """
+    Writes a FITS image
+
+    Parameters
+    ----------
+    filename : str
+        Filename of the image. An existing file is overwritten
+    data : array
+        Image data
+    wcs : WCS object, optional
+        WCS of the image
+    header : dict, optional
+        Extra header keywords
+
+    """
+    if wcs is not None:
+        hdr = wcs.to_header()
+    else:
+        hdr = fits.Header()
+    if header is not None:
+        hdr.update(header)
+    fits.PrimaryHDU(data, header=hdr).writeto(filename, overwrite=True)
+
+
+def make_gain_series(nseries, ntimes, seed=0):
+    """
+    Returns synthetic amplitude and phase solution series
+
+    The amplitudes vary smoothly about one, with noise and occasional outliers
+    of 2 to 4 times the amplitude. The phases vary smoothly over [-pi, pi).
+    Each series has up to two gaps of flagged solutions and the last series is
+    fully flagged
+
+    Parameters
+    ----------
+    nseries : int
+        Number of series
+    ntimes : int
+        Number of solution times
+    seed : int, optional
+        Seed of the random numbers
+
+    Returns
+    -------
+    amps : array
+        Amplitudes of shape (nseries, ntimes)
+    phases : array
+        Phases of the same shape
+    flagged : array
+        Boolean array of the same shape that is True for flagged solutions
+
+    """
+    rs = numpy.random.RandomState(seed)
+    t = numpy.linspace(0.0, 1.0, ntimes)
+    amps = (1.0 + 0.2 * numpy.sin(2.0 * numpy.pi * (t + rs.rand(nseries, 1))) +
+        0.02 * rs.randn(nseries, ntimes))
+    outliers = rs.rand(nseries, ntimes) < 0.02
+    amps[outliers] *= rs.uniform(2.0, 4.0, numpy.sum(outliers))
+    phases = (numpy.pi * numpy.sin(2.0 * numpy.pi * (t + rs.rand(nseries, 1))) +
+        0.05 * rs.randn(nseries, ntimes))
+    phases = numpy.mod(phases + numpy.pi, 2.0 * numpy.pi) - numpy.pi
+
+    flagged = numpy.zeros((nseries, ntimes), dtype=bool)
+    for row in range(nseries):
+        for gap in range(rs.randint(0, 3)):
+            start = rs.randint(0, ntimes)
+            flagged[row, start:start+rs.randint(1, max(2, ntimes // 10))] = True
+    flagged[-1] = True
+
+    return amps, phases, flagged
@@ -0,0 +1,56 @@
+"""
+Tests for the cache file helpers of factor.lib.cache
+"""
+import os
+import pickle
+from factor.lib.cache import get_cache_file, get_file_key, write_cache_file
+
+
+def write_file(filename, text, mtime):
+    with open(filename, 'w') as f:
+        f.write(text)
+    os.utime(filename, (mtime, mtime))
+
+
+def test_get_file_key_of_table(tmpdir):
+    # A casacore table (e.g., a casa image or a parmdb) is a directory
+    table = str(tmpdir.join('field.image'))
+    os.mkdir(table)
+    write_file(os.path.join(table, 'table.dat'), 'data', 1.0e9)
+    write_file(os.path.join(table, 'table.f0'), 'more data', 1.0e9 + 5.0)
+    key = get_file_key(table)
+    assert key == (table, 13, 1.0e9 + 5.0)
+
+    # Opening the table changes only its lock file
+    write_file(os.path.join(table, 'table.lock'), 'locked', 1.0e9 + 10.0)
+    assert get_file_key(table) == key
+
+    write_file(os.path.join(table, 'table.f0'), 'modified data', 1.0e9 + 20.0)
+    assert get_file_key(table) == (table, 17, 1.0e9 + 20.0)
+
+
+def test_get_file_key_of_file(tmpdir):
+    filename = str(tmpdir.join('field.fits'))
+    write_file(filename, 'data', 1.0e9)
+    assert get_file_key(filename) == (filename, 4, 1.0e9)
+
+
+def test_get_cache_file(tmpdir):
+    filename = str(tmpdir.join('field.fits'))
+    cache_file = get_cache_file(filename, 'image_stats', 'pkl')
+    assert os.path.dirname(cache_file) == str(tmpdir)
+    assert os.path.basename(cache_file).startswith('image_stats_')
+    assert cache_file.endswith('.pkl')
+    assert get_cache_file(str(tmpdir.join('other.fits')), 'image_stats', 'pkl') != cache_file
+
+    cache_dir = str(tmpdir.join('state'))
+    assert get_cache_file(filename, 'image_stats', 'pkl', cache_dir) == os.path.join(
+        cache_dir, os.path.basename(cache_file))
+
+
+def test_write_cache_file(tmpdir):
+    cache_file = str(tmpdir.join('state', 'cache.pkl'))
+    write_cache_file(cache_file, lambda f: pickle.dump({'rms': 0.01}, f))
+    with open(cache_file, 'rb') as f:
+        assert pickle.load(f) == {'rms': 0.01}
+    assert os.listdir(str(tmpdir.join('state'))) == ['cache.pkl']
@@ -0,0 +1,80 @@
+"""
+Tests for the image statistics cache of factor.lib.image_stats and its use in
+the selfcal loop check (copy_image.py and compare_image_stats.py)
+"""
+import os
+import numpy
+from factor.lib import image_stats
+from factor.scripts import copy_image, compare_image_stats
+from conftest import write_image
+
+
+def write_noise_image(filename, seed, noise):
+    """
+    Writes a FITS image of Gaussian noise with a bright source
+    """
+    rs = numpy.random.RandomState(seed)
+    data = noise * rs.randn(1, 1, 64, 64)
+    data[0, 0, 32, 32] = 100.0 * noise
+    write_image(filename, data)
+
+
+def count_calc_stats(monkeypatch):
+    """
+    Makes calc_stats() record the images it reads, and returns the list of them
+    """
+    calc_stats = image_stats.calc_stats
+    read_images = []
+
+    def recording_calc_stats(imagename, **kwargs):
+        read_images.append(imagename)
+        return calc_stats(imagename, **kwargs)
+    monkeypatch.setattr(image_stats, 'calc_stats', recording_calc_stats)
+
+    return read_images
+
+
+def test_get_image_stats_cache(tmpdir, monkeypatch):
+    image = str(tmpdir.join('field_image42-MFS-image.fits'))
+    write_noise_image(image, 0, 0.01)
+    read_images = count_calc_stats(monkeypatch)
+
+    stats = image_stats.get_image_stats(image)
+    assert image_stats.get_image_stats(image) == stats
+    assert read_images == [image]
+    assert stats['max'] == 1.0
+    assert abs(stats['rms'] / 0.01 - 1.0) < 0.05
+
+    # A modified image is read again
+    write_noise_image(image, 1, 0.02)
+    mtime = os.path.getmtime(image) + 10.0
+    os.utime(image, (mtime, mtime))
+    assert image_stats.get_image_stats(image)['max'] == 2.0
+    assert read_images == [image, image]
+
+
+def test_selfcal_loop_check(tmpdir, monkeypatch):
+    image_prev_step = str(tmpdir.join('field_image32-MFS-image.fits'))
+    image = str(tmpdir.join('field_image42-MFS-image.fits'))
+    image_iter0 = str(tmpdir.join('field_image42_iter0-MFS-image.fits'))
+    write_noise_image(image_prev_step, 0, 0.02)
+    read_images = count_calc_stats(monkeypatch)
+
+    # First loop: the new image and the image of the previous imaging step are
+    # read
+    write_noise_image(image, 1, 0.01)
+    image_prev = copy_image.main(image, 0, 4)['previous_image']
+    assert image_prev == image_prev_step
+    compare_image_stats.main(image, image_prev, count=0)
+    assert read_images == [image, image_prev_step]
+
+    # Second loop: only the new image is read, as the statistics of the copy
+    # made in the first loop were saved by copy_image.py
+    write_noise_image(image, 2, 0.005)
+    mtime = os.path.getmtime(image) + 10.0
+    os.utime(image, (mtime, mtime))
+    image_prev = copy_image.main(image, 1, 4)['previous_image']
+    assert image_prev == image_iter0
+    compare_image_stats.main(image, image_prev, count=1)
+    assert read_images == [image, image_prev_step, image]
+    assert image_stats.get_image_stats(image_iter0)['max'] == 1.0
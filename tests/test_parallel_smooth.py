@@ -0,0 +1,70 @@
+"""
+Tests for factor.lib.parallel_smooth
+
+smooth_series() must give the same results as smoothing each series
+separately, whatever the number of processes and the size of the batches (see
+tests/benchmark_smooth_spline.py for a comparison with the spline smoothing
+of the scripts on a full-size table)
+"""
+import numpy
+from numpy.testing import assert_array_equal
+from factor.lib.parallel_smooth import smooth_series
+from conftest import make_gain_series
+
+
+def running_median(series):
+    """
+    Returns a 5-point running median of a series, its residuals and the
+    number of samples
+    """
+    padded = numpy.concatenate([series[:2][::-1], series, series[-2:][::-1]])
+    windows = numpy.array([padded[i:i+len(series)] for i in range(5)])
+    smoothed = numpy.median(windows, axis=0)
+
+    return smoothed, series - smoothed, len(series)
+
+
+def wrap_phases(series):
+    """
+    Returns the phases wrapped to [-pi, pi)
+    """
+    return (numpy.mod(series + numpy.pi, 2.0 * numpy.pi) - numpy.pi, )
+
+
+def check_smooth_series(ncores, batch_size):
+    amps, phases, flagged = make_gain_series(4 * 60 * 2, 30)
+    phases = 4.0 * phases  # beyond [-pi, pi), so that wrapping changes them
+    valid = numpy.ones(len(amps), dtype=bool)
+    valid[[0, 17, 18, 479]] = False
+    info_rows = [1, 5, 17, 200, 478]
+
+    (amps_smoothed, amp_info), (phases_smoothed, phase_info) = smooth_series(
+        [(running_median, amps, valid, info_rows), (wrap_phases, phases, None, None)],
+        ncores=ncores, batch_size=batch_size)
+
+    for row in range(len(amps)):
+        if valid[row]:
+            smoothed, residuals, nsamples = running_median(amps[row])
+            assert_array_equal(amps_smoothed[row], smoothed)
+        else:
+            assert_array_equal(amps_smoothed[row], amps[row])
+        assert_array_equal(phases_smoothed[row], wrap_phases(phases[row])[0])
+
+    assert sorted(amp_info.keys()) == [1, 5, 200, 478]
+    for row in amp_info:
+        smoothed, residuals, nsamples = running_median(amps[row])
+        assert_array_equal(amp_info[row][0], residuals)
+        assert amp_info[row][1] == nsamples
+    assert phase_info == {}
+
+
+def test_smooth_series_serial():
+    check_smooth_series(1, None)
+
+
+def test_smooth_series_pool():
+    check_smooth_series(2, None)
+
+
+def test_smooth_series_pool_small_batches():
+    check_smooth_series(3, 7)
@@ -0,0 +1,84 @@
+"""
+Tests for the resampling of the avgpb image in pb_correct.py
+
+The mosaic grid has the pixel size of the avgpb image and is offset from it
+by 2.5 pixels in x and 1.5 pixels in y, so that mosaic pixel (x, y) lies at
+avgpb pixel (x + 2.5, y + 1.5). The avgpb image is not square, so that its x
+and y axes cannot be swapped by mistake
+"""
+import numpy
+from numpy.testing import assert_array_equal, assert_allclose
+from factor.scripts.pb_correct import resample_pb
+from conftest import make_wcs
+
+
+PB_SHAPE = (30, 40)
+SHAPE = (35, 45)
+
+
+def make_grids(naxis, pbplane):
+    """
+    Returns the avgpb image, its WCS, and the shape and WCS of the mosaic grid
+    """
+    if naxis == 4:
+        extra_axes = ('STOKES', 'FREQ')
+        pbcordat = pbplane.reshape((1, 1) + PB_SHAPE)
+        shape = (1, 1) + SHAPE
+    else:
+        extra_axes = ()
+        pbcordat = pbplane
+        shape = SHAPE
+    pbwcs = make_wcs([150.0, 40.0], 0.017, [20.5, 15.5], extra_axes)
+    wcsout = make_wcs([150.0, 40.0], 0.017, [18.0, 14.0], extra_axes)
+
+    return pbcordat, pbwcs, shape, wcsout
+
+
+def check_resample_nearest(naxis):
+    # Each pixel of the avgpb image holds 1000 * row + column
+    row, col = numpy.mgrid[0:PB_SHAPE[0], 0:PB_SHAPE[1]]
+    pbcordat, pbwcs, shape, wcsout = make_grids(naxis, 1000.0 * row + col)
+
+    # The pixel coordinates in the avgpb image are truncated
+    expected = numpy.nan * numpy.ones(SHAPE)
+    expected[:29, :38] = 1000.0 * row[1:30, 2:40] + col[1:30, 2:40]
+
+    for rows_per_tile in [1, 7, 256]:
+        resampled = resample_pb(pbcordat, pbwcs, shape, wcsout, 'nearest',
+            rows_per_tile)
+        assert resampled.shape == shape
+        assert_array_equal(resampled.reshape(SHAPE), expected)
+
+
+def check_resample_bilinear(naxis):
+    # The avgpb image is linear in row and column, so that its bilinear
+    # interpolation is exact
+    row, col = numpy.mgrid[0:PB_SHAPE[0], 0:PB_SHAPE[1]]
+    pbcordat, pbwcs, shape, wcsout = make_grids(naxis, 0.1 + 0.02 * row + 0.01 * col)
+
+    y, x = numpy.mgrid[0:SHAPE[0], 0:SHAPE[1]]
+    expected = numpy.nan * numpy.ones(SHAPE)
+    expected[:28, :37] = (0.1 + 0.02 * (y[:28, :37] + 1.5) +
+        0.01 * (x[:28, :37] + 2.5))
+
+    for rows_per_tile in [1, 256]:
+        resampled = resample_pb(pbcordat, pbwcs, shape, wcsout, 'bilinear',
+            rows_per_tile)
+        assert resampled.shape == shape
+        assert_allclose(resampled.reshape(SHAPE), expected, rtol=1e-9)
+
+
+def test_resample_pb_nearest_4d():
+    check_resample_nearest(4)
+
+
+def test_resample_pb_nearest_2d():
+    check_resample_nearest(2)
+
+
+def test_resample_pb_bilinear_4d():
+    check_resample_bilinear(4)
+
+
+def test_resample_pb_bilinear_2d():
+    check_resample_bilinear(2)
@@ -0,0 +1,134 @@
+"""
+Tests for the selection and writing of components in poly2sky.py
+"""
+import numpy
+from numpy.testing import assert_array_equal
+from factor.scripts import poly2sky
+from conftest import make_wcs, write_image
+
+
+COMPONENTS = """FORMAT = Name, Type, Ra, Dec, SpectralTerms, MajorAxis, MinorAxis, Orientation
+# ReferenceFrequency = 100000000.0
+s0c0, POINT, 10:00:00.0, +30.00.00.0, [2.0,0.5], , ,
+s0c1, POINT, 10:00:08.0, +30.00.00.0, [1.0], , ,
+s0c2, GAUSSIAN, 09:59:52.0, +30.00.00.0, [1.0,-0.5,0.25], 60.0, 30.0, 45.0
+
+s0c3, POINT, 10:10:00.0, +30.00.00.0, [4.0,1.0], , ,
+s0c4, GAUSSIAN, 10:00:00.0, +30.02.00.0, [3.0], 20.0, 10.0, 0.0
+"""
+
+HEADER = ('FORMAT = Name, Type, Ra, Dec, I, Q, U, V, ReferenceFrequency, '
+    'MajorAxis, MinorAxis, Orientation\n')
+
+
+def make_mask_wcs():
+    """
+    Returns the WCS of a 20 x 20 pixel mask image centered on the components
+    """
+    return make_wcs([150.0, 30.0], 0.01, [11.0, 11.0], ('FREQ', 'STOKES'))
+
+
+def make_mask():
+    """
+    Returns mask image data that exclude the pixels to the east (lower x) of
+    the image center
+    """
+    mask = numpy.ones((1, 1, 20, 20))
+    mask[:, :, :, :10] = 0.0
+
+    return mask
+
+
+def write_inputs(tmpdir):
+    """
+    Writes a component list, a model image and a mask image
+
+    Returns the model root and the filename of the mask image
+    """
+    model_root = str(tmpdir.join('field'))
+    with open(model_root + '-components.txt', 'w') as f:
+        f.write(COMPONENTS)
+
+    write_image(model_root + '-model.fits', numpy.zeros((1, 1, 4, 4)),
+        header={'CRVAL3': 1.5e8})
+
+    mask_file = str(tmpdir.join('field.mask.fits'))
+    write_image(mask_file, make_mask(), make_mask_wcs())
+
+    return model_root, mask_file
+
+
+class FakeTable(object):
+    """
+    Stands in for the SPECTRAL_WINDOW table of an MS
+    """
+    def __init__(self, tablename, ack=True):
+        pass
+
+    def col(self, columnname):
+        return [149000000.0]
+
+    def close(self):
+        pass
+
+
+def run_main(tmpdir, monkeypatch, fits_mask):
+    monkeypatch.setattr(poly2sky.pt, 'table', FakeTable)
+    model_root, mask_file = write_inputs(tmpdir)
+    if fits_mask == 'mask':
+        fits_mask = mask_file
+    skymodel = str(tmpdir.join('field.skymodel'))
+    poly2sky.main(model_root, '[field1.ms,field2.ms]', skymodel, fits_mask=fits_mask)
+    with open(skymodel) as f:
+        lines = f.readlines()
+
+    return lines
+
+
+def test_read_components(tmpdir):
+    model_root, mask_file = write_inputs(tmpdir)
+    columns = ['Name', 'Type', 'Ra', 'Dec', 'SpectralTerms', 'MajorAxis',
+        'MinorAxis', 'Orientation']
+    ref_freq, data = poly2sky.read_components(model_root + '-components.txt',
+        columns)
+
+    assert ref_freq == 1e8
+    assert data['Name'] == ['s0c0', 's0c1', 's0c2', 's0c3', 's0c4']
+    assert data['Ra'][2] == '09:59:52.0'
+    assert data['Dec'][4] == '+30.02.00.0'
+    assert data['SpectralTerms'][2] == '1.0;-0.5;0.25'
+    assert data['MajorAxis'] == ['', '', 60.0, '', 20.0]
+    assert data['Orientation'] == ['', '', 45.0, '', 0.0]
+
+
+def test_get_in_mask():
+    ra = ['10:00:00.0', '10:00:08.0', '09:59:52.0', '10:10:00.0', '10:00:00.0']
+    dec = ['+30.00.00.0', '+30.00.00.0', '+30.00.00.0', '+30.00.00.0', '+30.02.00.0']
+    in_mask = poly2sky.get_in_mask(make_mask(), make_mask_wcs(), ra, dec)
+    assert_array_equal(in_mask, [True, False, True, False, True])
+
+    # Positions in degrees are converted with RA2Angle() and Dec2Angle()
+    ra_deg = [150.0, 150.0 + 8.0/240.0, 150.0 - 8.0/240.0, 152.5, 150.0]
+    dec_deg = [30.0, 30.0, 30.0, 30.0, 30.0 + 2.0/60.0]
+    in_mask = poly2sky.get_in_mask(make_mask(), make_mask_wcs(), ra_deg, dec_deg)
+    assert_array_equal(in_mask, [True, False, True, False, True])
+
+
+def test_main_with_mask(tmpdir, monkeypatch):
+    lines = run_main(tmpdir, monkeypatch, 'mask')
+    assert lines == [HEADER,
+        'cc0, POINT, 10:00:00.0, +30.00.00.0, 2.75, 0.0, 0.0, 0.0, 149000000.0, , , \n',
+        'cc1, GAUSSIAN, 09:59:52.0, +30.00.00.0, 0.8125, 0.0, 0.0, 0.0, 149000000.0, 60.0, 30.0, 45.0\n',
+        'cc2, GAUSSIAN, 10:00:00.0, +30.02.00.0, 3.0, 0.0, 0.0, 0.0, 149000000.0, 20.0, 10.0, 0.0\n']
+
+
+def test_main_without_mask(tmpdir, monkeypatch):
+    lines = run_main(tmpdir, monkeypatch, 'none')
+    assert len(lines) == 6
+    assert [line.split(',')[4].strip() for line in lines[1:]] == ['2.75', '1.0',
+        '0.8125', '5.5', '3.0']
+
+
+def test_main_with_empty_mask(tmpdir, monkeypatch):
+    lines = run_main(tmpdir, monkeypatch, 'empty')
+    assert lines == [HEADER]
@@ -0,0 +1,75 @@
+"""
+Tests for the vectorized amplitude smoothing of smooth_amps.py
+
+The vectorized filter must give results identical to those of the per-series
+filter (median_window_filter()), and smooth() must replace outliers and keep
+the phases and flagged solutions
+"""
+import numpy
+from numpy.testing import assert_array_equal, assert_allclose
+from factor.scripts.smooth_amps import (smooth, median_window_filter,
+    median_window_filter_multi)
+from conftest import make_gain_series
+
+
+def test_median_window_filter_multi():
+    rs = numpy.random.RandomState(1)
+    ndata = numpy.array([8, 9, 15, 40, 61, 100])
+    ampl = rs.randn(len(ndata), ndata.max())
+    ampl[rs.rand(*ampl.shape) < 0.05] += 20.0
+    for half_window in [3, 4, 7]:
+        filtered = median_window_filter_multi(ampl, ndata, half_window, 6)
+        for row, n in enumerate(ndata):
+            assert_array_equal(filtered[row, :n],
+                median_window_filter(ampl[row, :n], half_window, 6))
+
+
+def test_smooth():
+    ntimes = 40
+    rs = numpy.random.RandomState(2)
+    phase = rs.uniform(-numpy.pi, numpy.pi, (ntimes, 5))
+    amp = 2.0 * numpy.ones((ntimes, 5))
+    amp_expected = amp.copy()
+
+    # Outliers are replaced
+    amp[10, 0] = 60.0
+    amp[25, 0] = 0.02
+
+    # Flagged solutions stay flagged
+    amp[5:10, 1] = numpy.nan
+    amp[20, 1] = 60.0
+    amp_expected[5:10, 1] = numpy.nan
+
+    # Extremely high amplitudes are clipped
+    amp[:, 2] = 8.0
+    amp_expected[:, 2] = 5.0
+
+    # Series with too few unflagged solutions are not smoothed
+    amp[7:, 3] = numpy.nan
+    amp[3, 3] = 60.0
+    amp_expected[:, 3] = amp[:, 3]
+
+    # Fully flagged series
+    amp[:, 4] = numpy.nan
+    amp_expected[:, 4] = numpy.nan
+
+    real_smoothed, imag_smoothed = smooth(amp * numpy.cos(phase),
+        amp * numpy.sin(phase), 4)
+    assert_allclose(real_smoothed, amp_expected * numpy.cos(phase), rtol=1e-12)
+    assert_allclose(imag_smoothed, amp_expected * numpy.sin(phase), rtol=1e-12)
+
+
+def test_smooth_gain_series():
+    # 3 stations x 2 polarizations x 4 channels
+    amps, phases, flagged = make_gain_series(24, 150, seed=2)
+    amps[flagged] = numpy.nan
+    real = (amps * numpy.cos(phases)).T
+    imag = (amps * numpy.sin(phases)).T
+    assert numpy.nanmax(amps) > 2.0
+
+    real_smoothed, imag_smoothed = smooth(real, imag, 4)
+    assert_array_equal(numpy.isnan(real_smoothed), flagged.T)
+    amps_smoothed = numpy.sqrt(real_smoothed**2 + imag_smoothed**2)
+    assert numpy.nanmax(amps_smoothed) < 1.5
+    assert_allclose(numpy.arctan2(imag_smoothed, real_smoothed)[~flagged.T],
+        phases.T[~flagged.T], rtol=0.0, atol=1e-12)
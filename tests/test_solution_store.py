@@ -0,0 +1,179 @@
+"""
+Tests for the dense arrays of factor.lib.solution_store and the writing of
+gap-separated solutions
+
+add_values_by_segment() must add the values, times and widths of all parms
+for each segment of times between gaps in a single call
+"""
+import numpy
+from numpy.testing import assert_array_equal
+from factor.lib.solution_store import (get_time_segments, add_values_by_segment,
+    split_parm_name, get_parm_name, SolutionStore)
+
+
+class FakeParmDB(object):
+    """
+    Records the values added with addValues(), in either of its forms
+    """
+    def __init__(self):
+        self.ncalls = 0
+        self.added = []
+
+    def addValues(self, *args, **kwargs):
+        self.ncalls += 1
+        if len(args) == 1:
+            for name, parm in args[0].items():
+                self.added.append((name, parm['values'], parm['freqs'],
+                    parm['freqwidths'], parm['times'], parm['timewidths']))
+        else:
+            self.added.append(tuple(args[:6]))
+
+    def get_added(self):
+        """
+        Returns the added values sorted by parm name and start time
+        """
+        return sorted(self.added, key=lambda a: (a[0], a[4][0]))
+
+
+def make_times():
+    """
+    Returns 20 times with a width of 10 s, separated by 1.5 widths after the
+    fifth time, 3 widths after the twelfth and 1.05 widths after the sixteenth
+    """
+    timewidths = 10.0 * numpy.ones(20)
+    delta_times = 10.0 * numpy.ones(19)
+    delta_times[4] = 15.0
+    delta_times[11] = 30.0
+    delta_times[15] = 10.5
+    times = 4.8e9 + numpy.concatenate([[0.0], numpy.cumsum(delta_times)])
+
+    return times, timewidths
+
+
+def make_values(ntimes, nfreqs):
+    """
+    Returns the values of the Real and Imag parms of 3 stations and 2
+    polarizations
+    """
+    rs = numpy.random.RandomState(0)
+    values = {}
+    for pol in ['0:0', '1:1']:
+        for station in ['CS001HBA0', 'CS002HBA0', 'RS106HBA']:
+            for part in ['Real', 'Imag']:
+                name = 'Gain:{0}:{1}:{2}'.format(pol, part, station)
+                values[name] = rs.randn(ntimes, nfreqs)
+
+    return values
+
+
+def test_get_time_segments():
+    times, timewidths = make_times()
+    assert list(get_time_segments(times, timewidths, 1.1)) == [(0, 5), (5, 12),
+        (12, 20)]
+    assert list(get_time_segments(times, timewidths, 2.0)) == [(0, 12), (12, 20)]
+    assert list(get_time_segments(times, timewidths)) == [(0, 12), (12, 20)]
+
+
+def test_get_time_segments_without_gaps():
+    times = 4.8e9 + 10.0 * numpy.arange(8)
+    timewidths = 10.0 * numpy.ones(8)
+    assert list(get_time_segments(times, timewidths, 1.1)) == [(0, 8)]
+    assert list(get_time_segments(times[:1], timewidths[:1], 1.1)) == [(0, 1)]
+
+
+def check_add_values_by_segment(gap_factor, segments):
+    times, timewidths = make_times()
+    freqs = numpy.array([1.2e8, 1.4e8, 1.6e8])
+    freqwidths = 2e7 * numpy.ones(3)
+    values = make_values(len(times), len(freqs))
+
+    pdb = FakeParmDB()
+    add_values_by_segment(pdb, values, freqs, freqwidths, times, timewidths,
+        gap_factor=gap_factor)
+
+    assert pdb.ncalls == len(segments)
+    added = pdb.get_added()
+    assert len(added) == len(segments) * len(values)
+    for i, name in enumerate(sorted(values)):
+        for j, (start, end) in enumerate(segments):
+            (added_name, added_values, added_freqs, added_freqwidths,
+                added_times, added_timewidths) = added[i*len(segments)+j]
+            assert added_name == name
+            assert_array_equal(added_values, values[name][start:end])
+            assert_array_equal(added_freqs, freqs)
+            assert_array_equal(added_freqwidths, freqwidths)
+            assert_array_equal(added_times, times[start:end])
+            assert_array_equal(added_timewidths, timewidths[start:end])
+
+
+def test_add_values_by_segment_gap_factor_1_1():
+    check_add_values_by_segment(1.1, [(0, 5), (5, 12), (12, 20)])
+
+
+def test_add_values_by_segment_gap_factor_2():
+    check_add_values_by_segment(2.0, [(0, 12), (12, 20)])
+
+
+def make_parms(values, times, timewidths, freqs, freqwidths):
+    """
+    Returns a dict of parm values in the format of getValuesGrid()
+    """
+    return dict([(name, {'values': parm_values, 'times': times,
+        'timewidths': timewidths, 'freqs': freqs, 'freqwidths': freqwidths})
+        for name, parm_values in values.items()])
+
+
+def test_get_parm_name():
+    for name in ['Gain:0:0:Phase:CS001HBA0', 'Clock:1:CS001HBA0', 'TEC:CS001HBA0']:
+        assert get_parm_name(*split_parm_name(name)) == name
+
+
+def test_get_values():
+    times, timewidths = make_times()
+    freqs = numpy.array([1.2e8, 1.4e8, 1.6e8])
+    freqwidths = 2e7 * numpy.ones(3)
+    values = make_values(len(times), len(freqs))
+    store = SolutionStore(make_parms(values, times, timewidths, freqs, freqwidths))
+
+    assert store.get_soltypes() == ['Gain:Imag', 'Gain:Real']
+    axes = store.get_axes('Gain:Real')
+    assert axes['stations'] == ['CS001HBA0', 'CS002HBA0', 'RS106HBA']
+    assert axes['pols'] == ['0:0', '1:1']
+    assert_array_equal(axes['times'], times)
+    assert_array_equal(axes['freqs'], freqs)
+    real = store.get_values('Gain:Real')
+    assert real.shape == (3, 2, len(times), len(freqs))
+    assert_array_equal(real[2, 1], values['Gain:1:1:Real:RS106HBA'])
+
+    # Changes to the array are changes to the store
+    real[0, 0] = 1.0
+    assert_array_equal(store.to_parms()['Gain:0:0:Real:CS001HBA0']['values'],
+        numpy.ones((len(times), len(freqs))))
+
+
+def test_set_values():
+    times, timewidths = make_times()
+    freqs = numpy.array([1.2e8, 1.4e8, 1.6e8])
+    freqwidths = 2e7 * numpy.ones(3)
+    values = make_values(len(times), len(freqs))
+    parms = make_parms(values, times, timewidths, freqs, freqwidths)
+
+    # A station with other times is held separately
+    parms['Gain:0:0:Real:DE601HBA'] = {'values': numpy.ones((5, 3)),
+        'times': times[:5], 'timewidths': timewidths[:5], 'freqs': freqs,
+        'freqwidths': freqwidths}
+    store = SolutionStore(parms)
+    assert sorted(store.other_parms.keys()) == ['Gain:0:0:Real:DE601HBA']
+
+    axes = store.get_axes('Gain:Real')
+    axes['pols'] = ['1:1']
+    store.set_values('Gain:Real', 2.0 * store.get_values('Gain:Real')[:, 1:], axes)
+    assert store.other_parms == {}
+    new_parms = store.to_parms()
+    assert sorted([name for name in new_parms if ':Real:' in name]) == [
+        'Gain:1:1:Real:CS001HBA0', 'Gain:1:1:Real:CS002HBA0', 'Gain:1:1:Real:RS106HBA']
+    assert_array_equal(new_parms['Gain:1:1:Real:CS002HBA0']['values'],
+        2.0 * values['Gain:1:1:Real:CS002HBA0'])
+    assert_array_equal(new_parms['Gain:1:1:Real:CS002HBA0']['times'], times)
+    assert_array_equal(new_parms['Gain:0:0:Imag:CS002HBA0']['values'],
+        values['Gain:0:0:Imag:CS002HBA0'])